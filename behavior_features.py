@@ -0,0 +1,227 @@
+# behavior_features.py - 用户/商家维度的行为特征：一次流式扫描 JSONL 建立紧凑索引，再按批回连到每条评论
+import argparse
+import hashlib
+import os
+import time
+import numpy as np
+from tqdm import tqdm
+
+from json_codec import BEHAVIOR_FIELDS, decode_fields
+
+CHUNK_ROWS = 1 << 16
+# 缺失或为空的 user_id/gmap_id 统一记为该哨兵键：不计入任何用户/商家的统计，回连时也查不到
+MISSING_KEY = 0
+
+
+def hash64(value):
+    """跨进程稳定的 64 位字符串哈希（内置 hash() 受 PYTHONHASHSEED 影响，不能用于多进程/落盘）"""
+    digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _id_key(value):
+    return MISSING_KEY if value is None or value == '' else hash64(value)
+
+
+def _row_keys(rows):
+    """从一批行中取出 (user 哈希, gmap 哈希, 评分, 时间秒)；缺失 id 记为 MISSING_KEY，缺失时间记为 -1"""
+    n = len(rows)
+    users = np.empty(n, dtype=np.uint64)
+    gmaps = np.empty(n, dtype=np.uint64)
+    ratings = np.zeros(n, dtype=np.int8)
+    seconds = np.full(n, -1, dtype=np.int64)
+    for i, row in enumerate(rows):
+        users[i] = _id_key(row.get('user_id'))
+        gmaps[i] = _id_key(row.get('gmap_id'))
+        try:
+            ratings[i] = int(row.get('rating') or 0)
+        except (TypeError, ValueError):
+            pass
+        try:
+            seconds[i] = int(row.get('time')) // 1000
+        except (TypeError, ValueError):
+            pass
+    return users, gmaps, ratings, seconds
+
+
+class BehaviorIndex:
+    """
+    只保存排序后的整数数组（每条评论约 25 字节，不保留文本），可存为 .npz 供各工作进程加载：
+      - 用户: 去重后的用户哈希、总评论数、极端评分(1/5星)数
+      - 用户×日: 稠密键 uid*n_days+day 及其评论数
+      - 商家: 稠密键 gid*span+秒，按商家、时间排序，用于滑动窗口计数
+    """
+
+    def __init__(self, users, user_total, user_extreme, user_day_keys, user_day_counts,
+                 gmaps, biz_keys, day_min, n_days, sec_min, span, max_window_sec):
+        self.users = users
+        self.user_total = user_total
+        self.user_extreme = user_extreme
+        self.user_day_keys = user_day_keys
+        self.user_day_counts = user_day_counts
+        self.gmaps = gmaps
+        self.biz_keys = biz_keys
+        self.day_min = int(day_min)
+        self.n_days = int(n_days)
+        self.sec_min = int(sec_min)
+        self.span = int(span)
+        self.max_window_sec = int(max_window_sec)
+
+    # ------------------------------------------------------------------ 构建
+    @classmethod
+    def build(cls, input_path, max_window_hours=24 * 7):
+        """流式扫描一遍 JSONL，只抽取 user_id/gmap_id/rating/time 四个字段"""
+        chunks = []
+        buf = []
+        with open(input_path, 'rb') as f, \
+             tqdm(total=os.path.getsize(input_path), unit='B', unit_scale=True, desc="行为特征扫描") as pbar:
+            for raw in f:
+                pbar.update(len(raw))
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    buf.append(decode_fields(line, BEHAVIOR_FIELDS))
+                except ValueError:
+                    continue
+                if len(buf) >= CHUNK_ROWS:
+                    chunks.append(_row_keys(buf))
+                    buf = []
+        if buf:
+            chunks.append(_row_keys(buf))
+        if not chunks:
+            chunks.append(_row_keys([]))
+
+        users_h, gmaps_h, ratings, seconds = (np.concatenate(col) for col in zip(*chunks))
+        del chunks
+        return cls.from_columns(users_h, gmaps_h, ratings, seconds, max_window_hours)
+
+    @classmethod
+    def from_columns(cls, users_h, gmaps_h, ratings, seconds, max_window_hours=24 * 7):
+        has_time = seconds >= 0
+        has_user = users_h != MISSING_KEY
+        has_gmap = gmaps_h != MISSING_KEY
+
+        # 用户表（缺失 user_id 的行不参与）
+        users, uid = np.unique(users_h[has_user], return_inverse=True)
+        uid = uid.ravel()
+        user_total = np.bincount(uid, minlength=len(users)).astype(np.int32)
+        extreme = (ratings[has_user] == 1) | (ratings[has_user] == 5)
+        user_extreme = np.bincount(uid, weights=extreme, minlength=len(users)).astype(np.int32)
+
+        # 用户×日（缺失时间的行不参与）
+        days = np.where(has_time, seconds // 86400, 0)
+        day_min = int(days[has_time].min()) if has_time.any() else 0
+        n_days = int(days[has_time].max()) - day_min + 1 if has_time.any() else 1
+        user_timed = has_time[has_user]
+        ud = uid[user_timed].astype(np.int64) * n_days + (days[has_user][user_timed] - day_min)
+        user_day_keys, user_day_counts = np.unique(ud, return_counts=True)
+
+        # 商家×时间：每个商家占据一段互不重叠的键区间，区间之间留出窗口宽度的空隙（缺失 gmap_id 的行不参与）
+        gmaps, gid = np.unique(gmaps_h[has_gmap], return_inverse=True)
+        gid = gid.ravel()
+        sec_min = int(seconds[has_time].min()) if has_time.any() else 0
+        sec_max = int(seconds[has_time].max()) if has_time.any() else 0
+        max_window_sec = int(max_window_hours * 3600)
+        span = sec_max - sec_min + 2 * max_window_sec + 1
+        gmap_timed = has_time[has_gmap]
+        biz_keys = np.sort(gid[gmap_timed].astype(np.int64) * span + (seconds[has_gmap][gmap_timed] - sec_min))
+
+        return cls(users, user_total, user_extreme, user_day_keys, user_day_counts.astype(np.int32),
+                   gmaps, biz_keys, day_min, n_days, sec_min, span, max_window_sec)
+
+    # ------------------------------------------------------------------ 持久化
+    def save(self, path):
+        # 经文件句柄写入：直接传路径时 np.savez 会给没有 .npz 后缀的路径自动补上后缀，之后按原路径加载会找不到文件
+        with open(path, 'wb') as f:
+            np.savez(f, users=self.users, user_total=self.user_total, user_extreme=self.user_extreme,
+                     user_day_keys=self.user_day_keys, user_day_counts=self.user_day_counts,
+                     gmaps=self.gmaps, biz_keys=self.biz_keys,
+                     meta=np.array([self.day_min, self.n_days, self.sec_min, self.span, self.max_window_sec],
+                                   dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        day_min, n_days, sec_min, span, max_window_sec = (int(x) for x in data['meta'])
+        return cls(data['users'], data['user_total'], data['user_extreme'], data['user_day_keys'],
+                   data['user_day_counts'], data['gmaps'], data['biz_keys'], day_min, n_days, sec_min, span,
+                   max_window_sec)
+
+    # ------------------------------------------------------------------ 回连
+    @staticmethod
+    def _find(sorted_keys, keys):
+        """在有序数组中查找 keys，返回 (下标, 是否命中)"""
+        if len(sorted_keys) == 0:
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        pos = np.searchsorted(sorted_keys, keys)
+        pos = np.minimum(pos, len(sorted_keys) - 1)
+        return pos, sorted_keys[pos] == keys
+
+    def lookup(self, rows, biz_window_hours=24, min_user_history=1):
+        """
+        为一批行返回行为特征数组：
+          user_daily_cnt: 该用户当天的评论数
+          user_extreme_ratio: 该用户 1/5 星评论占比（历史评论数不足 min_user_history 时记 0）
+          biz_window_cnt: 该商家在 [t-窗口, t+窗口] 内的评论数
+        缺失 user_id/gmap_id 的行查不到对应的用户/商家，相应特征记 0，行为类标签函数弃权
+        """
+        users_h, gmaps_h, _, seconds = _row_keys(rows)
+        has_time = seconds >= 0
+
+        upos, ufound = self._find(self.users, users_h)
+        total = np.where(ufound, self.user_total[upos], 0)
+        extreme = np.where(ufound, self.user_extreme[upos], 0)
+        ratio = np.where(total >= max(1, min_user_history), extreme / np.maximum(total, 1), 0.0)
+
+        days = np.where(has_time, seconds // 86400, self.day_min) - self.day_min
+        day_ok = has_time & (days >= 0) & (days < self.n_days)
+        ud = upos.astype(np.int64) * self.n_days + days
+        dpos, dfound = self._find(self.user_day_keys, ud)
+        daily = np.where(ufound & day_ok & dfound, self.user_day_counts[dpos], 0)
+
+        window = int(biz_window_hours * 3600)
+        if window > self.max_window_sec:
+            raise ValueError(f"窗口 {biz_window_hours} 小时超过索引构建时的上限 {self.max_window_sec // 3600} 小时")
+        gpos, gfound = self._find(self.gmaps, gmaps_h)
+        offset = seconds - self.sec_min
+        # 只有落在索引时间范围内的行才能保证窗口不越过相邻商家的键区间
+        in_range = has_time & (offset >= 0) & (offset <= self.span - 2 * self.max_window_sec - 1)
+        key = gpos.astype(np.int64) * self.span + offset
+        count = np.searchsorted(self.biz_keys, key + window, side='right') - \
+                np.searchsorted(self.biz_keys, key - window, side='left')
+        biz_cnt = np.where(gfound & in_range, count, 0)
+
+        return {
+            'user_daily_cnt': daily.astype(np.int32),
+            'user_extreme_ratio': ratio.astype(np.float64),
+            'biz_window_cnt': biz_cnt.astype(np.int32),
+        }
+
+
+_INDEX_CACHE = {}
+
+def get_behavior_index(path):
+    """按路径缓存已加载的索引，工作进程内每个批次不会重复读盘"""
+    index = _INDEX_CACHE.get(path)
+    if index is None:
+        index = _INDEX_CACHE[path] = BehaviorIndex.load(path)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="扫描 JSONL 构建用户/商家行为特征索引")
+    parser.add_argument("--input", dest="input_path", required=True)
+    parser.add_argument("--output", dest="output_path", default="behavior_index.npz")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    index = BehaviorIndex.build(args.input_path)
+    index.save(args.output_path)
+    print(f"👥 用户数: {len(index.users):,}  🏪 商家数: {len(index.gmaps):,}  🕒 带时间的评论数: {len(index.biz_keys):,}")
+    print(f"⏱️ 耗时: {time.time() - start_time:.2f} 秒")
+    print(f"✅ 索引已保存到: {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
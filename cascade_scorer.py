@@ -0,0 +1,323 @@
+# cascade_scorer.py - 规则优先的级联打分：所有评论先过标签函数+聚合，只有决策边界附近的评论按批交给 RoBERTa / RoBERTa+XGBoost
+import argparse
+import math
+import os
+import time
+import numpy as np
+from tqdm import tqdm
+
+from json_codec import LABEL_FIELDS, decode_fields
+from run_full_labeling import process_batch, lf_names_for
+from lf_rules import get_rules
+from label_sink import SummaryAccumulator, open_result_sink
+from behavior_features import get_behavior_index
+from near_dupe import get_near_dupe_index
+from label_cache import check_label_cache, get_label_cache
+from predict_roberta import MODEL_DIR, clean_texts, pad_batch
+
+XGB_MODEL_PATH = "xgb_RoBERTa.model"  # classifier_xgbooster.py 的输出
+ENCODER_NAME = "roberta-base"         # classifier_xgbooster.py 提取向量所用的模型
+ENCODER_MAX_LEN = 128
+BAND = 0.10            # p_untrust 距决策边界不超过该值的评论交给模型
+MODEL_CHUNK = 2048     # 攒够这么多待模型打分的评论再一起推理
+MAX_PENDING = 8192     # 缓冲的结果（含不需要模型的行）达到该条数时，不论攒了多少待打分评论都推理并写出
+
+
+def decision_margin(p_untrust, tau_high, tau_low):
+    """
+    p_untrust 到三分类决策边界的距离。tau_high > tau_low 时 (tau_low, tau_high) 是忽略区，区内为 0；
+    否则（如当前配置 TAU_HIGH=0.30 < TAU_LOW=0.70）忽略区为空，边界只有 tau_high 一条线。
+    """
+    p = np.asarray(p_untrust, dtype=np.float64)
+    if tau_high > tau_low:
+        return np.maximum(0.0, np.maximum(p - tau_high, tau_low - p))
+    return np.abs(p - tau_high)
+
+
+def route_mask(results, tau_high, tau_low, band=BAND, fraction=None):
+    """
+    选出要交给模型的行：忽略标签 (-1) 和标注失败 (ERROR) 的行总是交给模型；
+    其余行 fraction 为 None 时按 margin <= band 选取，否则取本批中离边界最近的 fraction 比例。
+    """
+    n = len(results)
+    labels = [r['final_label'] for r in results]
+    failed = np.fromiter((label == 'ERROR' for label in labels), dtype=bool, count=n)
+    p = np.array([0.0 if f else r['p_untrust'] for r, f in zip(results, failed)], dtype=np.float64)
+    margin = decision_margin(p, tau_high, tau_low)
+    mask = failed | np.fromiter((label == -1 for label in labels), dtype=bool, count=n)
+    if fraction is None:
+        mask |= ~failed & (margin <= band)
+    else:
+        k = min(n, math.ceil(fraction * n))
+        if k > mask.sum():
+            margin[mask] = -1.0
+            mask[np.argsort(margin, kind='stable')[:k]] = True
+    return mask
+
+
+def model_text(row):
+    """与 Labeler 相同的文本取法（text → original_text → processed_text），但不截断"""
+    text = row.get('text', row.get('original_text', ''))
+    if not text:
+        text = row.get('processed_text', '')
+    return text
+
+
+class EmbeddingXGBScorer:
+    """
+    classifier_xgbooster.py 训练出的模型：RoBERTa 的 [CLS] 向量 + XGBoost。
+    embedding_cache_dir 指向训练时的 embedding_cache/ 时，见过的文本直接复用缓存向量。
+    """
+
+    def __init__(self, model_path=XGB_MODEL_PATH, encoder_name=ENCODER_NAME, max_len=ENCODER_MAX_LEN,
+                 batch_size=64, threads=None, embedding_cache_dir=None):
+        import torch
+        import xgboost as xgb
+        from transformers import RobertaModel, RobertaTokenizerFast
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"XGBoost 模型不存在: {model_path}（先运行 classifier_xgbooster.py）")
+        if threads:
+            torch.set_num_threads(threads)
+        self.torch = torch
+        self.xgb = xgb
+        self.max_len = max_len
+        self.batch_size = batch_size
+        self.tokenizer = RobertaTokenizerFast.from_pretrained(encoder_name)
+        self.encoder = RobertaModel.from_pretrained(encoder_name)
+        self.encoder.eval()
+        self.booster = xgb.Booster()
+        self.booster.load_model(model_path)
+        if threads:
+            self.booster.set_param({'nthread': threads})
+        self.cache = None
+        if embedding_cache_dir:
+            from embedding_cache import EmbeddingCache
+            self.cache = EmbeddingCache(embedding_cache_dir, encoder_name, max_len)
+        print(f"🧠 已加载 RoBERTa 编码器 + XGBoost 模型: {model_path}")
+
+    def encode(self, texts):
+        """按 token 数排序后分批前向，每批只补齐到批内最长，返回 [CLS] 向量（顺序与输入一致）"""
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_len, padding=False)['input_ids']
+        order = np.argsort([len(ids) for ids in encoded], kind='stable')
+        out = None
+        with self.torch.inference_mode():
+            for k in range(0, len(order), self.batch_size):
+                idx = order[k:k + self.batch_size]
+                input_ids, attention_mask = pad_batch([encoded[i] for i in idx], self.tokenizer.pad_token_id)
+                hidden = self.encoder(input_ids=self.torch.from_numpy(input_ids),
+                                      attention_mask=self.torch.from_numpy(attention_mask)).last_hidden_state
+                cls = hidden[:, 0, :].numpy()
+                if out is None:
+                    out = np.empty((len(texts), cls.shape[1]), dtype=np.float32)
+                out[idx] = cls
+        return out
+
+    def predict_proba(self, texts):
+        texts = clean_texts(texts)
+        if not texts:
+            return np.empty(0, dtype=np.float32)
+        if self.cache is not None:
+            embeddings = self.cache.get_or_encode(texts, self.encode, desc="Encoding routed texts")
+        else:
+            embeddings = self.encode(texts)
+        return self.booster.predict(self.xgb.DMatrix(np.asarray(embeddings))).astype(np.float32)
+
+
+def load_model(kind, threads=None, batch_size=64, model_dir=MODEL_DIR, backend='torch', quantize=False,
+               xgb_model_path=XGB_MODEL_PATH, embedding_cache_dir=None):
+    """kind: 'roberta'（predict_roberta.RobertaScorer）或 'xgboost'（EmbeddingXGBScorer）"""
+    if kind == 'roberta':
+        from predict_roberta import RobertaScorer
+        return RobertaScorer(model_dir, backend=backend, quantize=quantize, threads=threads, batch_size=batch_size)
+    if kind == 'xgboost':
+        return EmbeddingXGBScorer(xgb_model_path, batch_size=batch_size, threads=threads,
+                                  embedding_cache_dir=embedding_cache_dir)
+    raise ValueError(f"未知的级联模型: {kind}")
+
+
+class CascadeStats:
+    """级联结果统计：交给模型的比例、模型改判的条数、最终标签分布"""
+
+    def __init__(self):
+        self.total = 0
+        self.routed = 0
+        self.flipped = 0
+        self.model_seconds = 0.0
+        self.labels = {1: 0, 0: 0}
+
+    def report(self):
+        denom = max(1, self.total)
+        print(f"\n🔀 级联打分统计:")
+        print(f"   交给模型: {self.routed:,}/{self.total:,} ({self.routed/denom*100:.1f}%)，"
+              f"模型耗时 {self.model_seconds:.2f} 秒")
+        print(f"   模型改判（与规则标签不同，含忽略/失败行）: {self.flipped:,}")
+        print(f"   最终不可信: {self.labels[1]:,} ({self.labels[1]/denom*100:.1f}%)，"
+              f"最终可信: {self.labels[0]:,} ({self.labels[0]/denom*100:.1f}%)")
+
+
+class CascadeRunner:
+    """
+    逐批接收 (原始行, 标注结果)：不需要模型的行直接以规则标签定案，需要的行先缓冲，
+    攒够 model_chunk 条、或缓冲的结果总数达到 max_pending 时一起推理并按输入顺序写出，
+    交给模型的比例很低时内存也不会随输入增长。写出的每行新增
+    model_prob（未交给模型为 None）、cascade_label（0/1）和 cascade_source（'rules' 或模型名）。
+    模型的正类（机器人评论）对应规则的不可信 (1)。
+    """
+
+    def __init__(self, sink, model, source, threshold=0.5, band=BAND, fraction=None, model_chunk=MODEL_CHUNK,
+                 max_pending=MAX_PENDING, rules=None):
+        self.sink = sink
+        self.model = model
+        self.source = source
+        self.threshold = threshold
+        self.band = band
+        self.fraction = fraction
+        self.model_chunk = model_chunk
+        self.max_pending = max_pending
+        self.rules = rules if rules is not None else get_rules()
+        self.stats = CascadeStats()
+        self._pending = []   # 按输入顺序缓冲的结果
+        self._texts = []     # 其中需要模型打分的 (结果, 文本)
+
+    def add(self, batch, results):
+        mask = route_mask(results, self.rules.tau_high, self.rules.tau_low, self.band, self.fraction)
+        for row, result, routed in zip(batch, results, mask.tolist()):
+            if routed:
+                self._texts.append((result, model_text(row)))
+            else:
+                result['model_prob'] = None
+                result['cascade_label'] = result['final_label']
+                result['cascade_source'] = 'rules'
+            self._pending.append(result)
+        if len(self._texts) >= self.model_chunk or len(self._pending) >= self.max_pending:
+            self.flush()
+
+    def flush(self):
+        if self._texts:
+            t0 = time.time()
+            probs = self.model.predict_proba([text for _, text in self._texts])
+            self.stats.model_seconds += time.time() - t0
+            for (result, _), prob in zip(self._texts, probs.tolist()):
+                label = int(prob >= self.threshold)
+                result['model_prob'] = round(prob, 6)
+                result['cascade_label'] = label
+                result['cascade_source'] = self.source
+                self.stats.flipped += label != result['final_label']
+            self.stats.routed += len(self._texts)
+            self._texts = []
+        for result in self._pending:
+            self.stats.labels[result['cascade_label']] += 1
+        self.stats.total += len(self._pending)
+        self.sink.write(self._pending)
+        self._pending = []
+
+
+def run_cascade(input_path, runner, batch_size=1000, behavior_path=None, near_dupe_path=None, cache_path=None):
+    """单遍读取输入：每批先运行标签函数（可选行为/近重复索引与增量缓存），再交给 CascadeRunner"""
+    behavior = get_behavior_index(behavior_path) if behavior_path else None
+    near_dupes = get_near_dupe_index(near_dupe_path) if near_dupe_path else None
+    cache = get_label_cache(cache_path) if cache_path else None
+    processed = 0
+    batch = []
+
+    def flush_batch():
+        results = process_batch(batch, processed - len(batch) + 1, behavior=behavior, near_dupes=near_dupes,
+                                cache=cache)
+        runner.add(batch, results)
+
+    with open(input_path, 'rb') as f, \
+            tqdm(total=os.path.getsize(input_path), unit='B', unit_scale=True, desc="级联打分进度") as pbar:
+        pos = 0
+        for raw in f:
+            line_start = pos
+            pos += len(raw)
+            pbar.update(len(raw))
+            line = raw.decode('utf-8').strip()
+            if not line:
+                continue
+            try:
+                data = decode_fields(line, LABEL_FIELDS)
+            except ValueError as e:
+                print(f"⚠️ 字节偏移{line_start}处JSON解析失败: {e}")
+                continue
+            batch.append(data)
+            processed += 1
+            if len(batch) >= batch_size:
+                flush_batch()
+                batch = []
+        if batch:
+            flush_batch()
+    runner.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="规则优先的级联打分：只把决策边界附近的评论交给神经网络模型")
+    parser.add_argument("--input", dest="input_path", required=True, help="JSONL 评论文件")
+    parser.add_argument("--output", dest="output_path", default="cascade_labeled.csv",
+                        help="结果（.csv 或 .parquet），在标注结果之外新增 model_prob/cascade_label/cascade_source")
+    parser.add_argument("--model", choices=("roberta", "xgboost"), default="roberta",
+                        help="roberta: 微调后的 RoBERTa 分类器；xgboost: RoBERTa 向量 + XGBoost")
+    parser.add_argument("--band", type=float, default=BAND, help="p_untrust 距决策边界不超过该值的评论交给模型")
+    parser.add_argument("--route-fraction", dest="route_fraction", type=float, default=None,
+                        help="改为每批把离边界最近的该比例评论交给模型（0~1），设置后忽略 --band")
+    parser.add_argument("--threshold", type=float, default=0.5, help="模型概率达到该值判为不可信")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1000)
+    parser.add_argument("--model-chunk", dest="model_chunk", type=int, default=MODEL_CHUNK,
+                        help="攒够这么多待打分评论后一起推理")
+    parser.add_argument("--model-batch-size", dest="model_batch_size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None, help="推理的算子内线程数")
+    parser.add_argument("--model-dir", dest="model_dir", default=MODEL_DIR, help="RoBERTa 分类器目录")
+    parser.add_argument("--backend", choices=("torch", "onnx"), default="torch", help="RoBERTa 分类器的推理后端")
+    parser.add_argument("--quantize", action="store_true", help="RoBERTa 分类器使用动态 int8 量化")
+    parser.add_argument("--xgb-model", dest="xgb_model", default=XGB_MODEL_PATH)
+    parser.add_argument("--embedding-cache", dest="embedding_cache", default=None,
+                        help="xgboost 模式下复用的 RoBERTa 向量缓存目录（如 embedding_cache）")
+    parser.add_argument("--behavior-index", dest="behavior_index", default=None,
+                        help="预先构建的用户/商家行为特征索引 (.npz)")
+    parser.add_argument("--near-dupe-index", dest="near_dupe_index", default=None,
+                        help="预先构建的近重复簇索引 (.npz)")
+    parser.add_argument("--label-cache", dest="label_cache", default=None,
+                        help="增量标注缓存 (SQLite)；只对新增或变化的评论运行标签函数")
+    args = parser.parse_args()
+
+    print("🚀 开始级联打分: 标签函数 → 边界附近的评论交给模型")
+    print("=" * 80)
+    if not os.path.exists(args.input_path):
+        print(f"❌ 输入文件不存在: {args.input_path}")
+        return
+    for path in (args.behavior_index, args.near_dupe_index):
+        if path and not os.path.exists(path):
+            print(f"❌ 索引文件不存在: {path}（先用 run_full_labeling.py 构建）")
+            return
+    if args.route_fraction is not None and not 0 <= args.route_fraction <= 1:
+        print(f"❌ --route-fraction 应在 0~1 之间: {args.route_fraction}")
+        return
+
+    start_time = time.time()
+    model = load_model(args.model, threads=args.threads, batch_size=args.model_batch_size,
+                       model_dir=args.model_dir, backend=args.backend, quantize=args.quantize,
+                       xgb_model_path=args.xgb_model, embedding_cache_dir=args.embedding_cache)
+    if args.label_cache:
+        print(f"♻️ 增量标注缓存: {args.label_cache}（已有 {check_label_cache(args.label_cache):,} 条结果）")
+
+    summary = SummaryAccumulator()
+    lf_names = lf_names_for(bool(args.behavior_index), bool(args.near_dupe_index))
+    with open_result_sink(args.output_path, summary, lf_names=lf_names) as sink:
+        runner = CascadeRunner(sink, model, args.model, threshold=args.threshold, band=args.band,
+                               fraction=args.route_fraction, model_chunk=args.model_chunk,
+                               max_pending=max(4 * args.batch_size, args.model_chunk))
+        run_cascade(args.input_path, runner, batch_size=args.batch_size, behavior_path=args.behavior_index,
+                    near_dupe_path=args.near_dupe_index, cache_path=args.label_cache)
+
+    print(f"✅ 已保存 {sink.rows_written} 条评论到 {sink.path}")
+    summary.report()
+    runner.stats.report()
+
+    total_time = time.time() - start_time
+    print(f"\n⏱️ 总耗时: {total_time:.2f} 秒")
+    print(f"🚀 处理速度: {summary.total/max(total_time, 1e-9):.0f} 条/秒")
+    print(f"\n🎉 级联打分完成!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import torch
-from torch.utils.data import Dataset, DataLoader
-from transformers import RobertaTokenizer, RobertaForSequenceClassification, get_linear_schedule_with_warmup
+from torch.utils.data import DataLoader
+from transformers import RobertaTokenizerFast, RobertaForSequenceClassification, get_linear_schedule_with_warmup
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
 import pandas as pd
 from tqdm import tqdm
 import os
+from token_dataset import TokenCache, TokenizedDataset, LengthBucketSampler, DynamicPadCollate
 
 
 MODEL_NAME = "roberta-base"
@@ -16,6 +17,8 @@ LR = 2e-5
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 OUTPUT_DPATH = "./roberta_bot_classifier_weighted"
 INPUT_PATH = "bot_comments_dataset.csv"
+# 分词结果缓存目录：同一份语料只分词一次
+TOKEN_CACHE_DIR = "token_cache"
 
 df = pd.read_csv(INPUT_PATH)
 
@@ -32,38 +35,20 @@ train_index = int(len(df) * train_size)
 train_df = df.iloc[:train_index].reset_index(drop=True)
 val_df = df.iloc[train_index:].reset_index(drop=True)
 
-tokenizer = RobertaTokenizer.from_pretrained(MODEL_NAME)
-
-class CommentDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_len):
-        self.texts = texts
-        self.labels = labels
-        self.tokenizer = tokenizer
-        self.max_len = max_len
-
-    def __len__(self):
-        return len(self.texts)
-
-    def __getitem__(self, idx):
-        text = str(self.texts[idx])
-        encoding = self.tokenizer(
-            text,
-            padding="max_length",
-            truncation=True,
-            max_length=self.max_len,
-            return_tensors="pt"
-        )
-        return {
-            "input_ids": encoding["input_ids"].squeeze(),
-            "attention_mask": encoding["attention_mask"].squeeze(),
-            "labels": torch.tensor(self.labels[idx], dtype=torch.long)
-        }
-
-train_dataset = CommentDataset(train_df["text"].tolist(), train_df["label"].tolist(), tokenizer, MAX_LEN)
-val_dataset = CommentDataset(val_df["text"].tolist(), val_df["label"].tolist(), tokenizer, MAX_LEN)
-
-train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE)
+tokenizer = RobertaTokenizerFast.from_pretrained(MODEL_NAME)
+
+# 整份语料用快速分词器批量分词一次并缓存，训练时按长度分桶组批，每批只补齐到批内最长的样本
+train_cache = TokenCache(TOKEN_CACHE_DIR, train_df["text"].tolist(), tokenizer, MAX_LEN)
+val_cache = TokenCache(TOKEN_CACHE_DIR, val_df["text"].tolist(), tokenizer, MAX_LEN)
+
+train_dataset = TokenizedDataset(train_cache, train_df["label"].tolist())
+val_dataset = TokenizedDataset(val_cache, val_df["label"].tolist())
+
+collate = DynamicPadCollate(tokenizer.pad_token_id)
+train_loader = DataLoader(train_dataset, batch_sampler=LengthBucketSampler(train_dataset.lengths, BATCH_SIZE, shuffle=True),
+                          collate_fn=collate)
+val_loader = DataLoader(val_dataset, batch_sampler=LengthBucketSampler(val_dataset.lengths, BATCH_SIZE, shuffle=False),
+                        collate_fn=collate)
 
 model = RobertaForSequenceClassification.from_pretrained(MODEL_NAME, num_labels=2)
 model.to(DEVICE)
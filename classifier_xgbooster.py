@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import numpy as np
 from transformers import RobertaTokenizer, RobertaModel
@@ -5,10 +6,24 @@ import torch
 import xgboost as xgb
 from sklearn.metrics import classification_report
 from tqdm import tqdm
+from embedding_cache import EmbeddingCache
 
 
 INPUT_PATH = "bot_comments_dataset.csv"
 OUTPUT_PATH = "xgb_RoBERTa.model"
+MODEL_NAME = "roberta-base"
+MAX_LENGTH = 128
+# Embeddings are cached by (model, max_length, text); only unseen texts go through RoBERTa
+EMBEDDING_CACHE_DIR = "embedding_cache"
+EMBEDDING_DTYPE = "float32"
+NUM_BOOST_ROUND = 100
+EARLY_STOPPING_ROUNDS = 10
+# Best-so-far model on the val set, rewritten whenever val logloss improves
+CHECKPOINT_PATH = OUTPUT_PATH + ".best"
+# Stream embeddings from the on-disk cache instead of materialising them in RAM
+EXTERNAL_MEMORY = False
+EXTERNAL_MEMORY_DIR = "xgb_cache"
+EXTERNAL_MEMORY_BATCH_ROWS = 65536
 
 df = pd.read_csv(INPUT_PATH)
 df = df.dropna(subset=["text", "label", "time"])
@@ -24,35 +39,136 @@ val_df   = df.iloc[train_len:]
 
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
-roberta_model = RobertaModel.from_pretrained("roberta-base").to(device)
-roberta_model.eval()
+tokenizer = None
+roberta_model = None
+
+def load_encoder():
+    # Loaded on first cache miss, so fully cached runs never touch the RoBERTa weights
+    global tokenizer, roberta_model
+    if roberta_model is None:
+        tokenizer = RobertaTokenizer.from_pretrained(MODEL_NAME)
+        roberta_model = RobertaModel.from_pretrained(MODEL_NAME).to(device)
+        roberta_model.eval()
+
+def clean_texts(texts):
+    return ["" if x is None or str(x) == "nan" else str(x) for x in texts]
 
 def encode_texts(texts, batch_size=32):
+    load_encoder()
     all_embeddings = []
-    for i in tqdm(range(0, len(texts), batch_size), desc="Encoding texts"):
-        batch = texts[i:i+batch_size]
-        batch = ["" if x is None or str(x) == "nan" else str(x) for x in batch]
+    for i in range(0, len(texts), batch_size):
+        batch = clean_texts(texts[i:i+batch_size])
 
-        enc = tokenizer(batch, padding=True, truncation=True, max_length=128, return_tensors="pt").to(device)
+        enc = tokenizer(batch, padding=True, truncation=True, max_length=MAX_LENGTH, return_tensors="pt").to(device)
         with torch.no_grad():
             outputs = roberta_model(**enc)
             embeddings = outputs.last_hidden_state[:,0,:].cpu().numpy()
             all_embeddings.append(embeddings)
     return np.vstack(all_embeddings)
 
-X_train = encode_texts(train_df["text"].tolist())
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, MODEL_NAME, MAX_LENGTH, EMBEDDING_DTYPE)
+
+train_rows = embedding_cache.ensure(clean_texts(train_df["text"].tolist()), encode_texts)
 y_train = train_df["label"].values
 
-X_val   = encode_texts(val_df["text"].tolist())
+val_rows = embedding_cache.ensure(clean_texts(val_df["text"].tolist()), encode_texts)
 y_val   = val_df["label"].values
 
+
+class EmbeddingIter(xgb.DataIter):
+    # Feeds XGBoost fixed-size slices of the embedding cache; with a cache_prefix the
+    # DMatrix is built in external memory and only one batch is resident at a time
+    def __init__(self, cache, rows, labels, cache_prefix, batch_rows=EXTERNAL_MEMORY_BATCH_ROWS):
+        self.cache = cache
+        self.rows = rows
+        self.labels = labels
+        self.batch_rows = batch_rows
+        self._pos = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._pos >= len(self.rows):
+            return 0
+        end = min(self._pos + self.batch_rows, len(self.rows))
+        input_data(data=self.cache.take(self.rows[self._pos:end]), label=self.labels[self._pos:end])
+        self._pos = end
+        return 1
+
+    def reset(self):
+        self._pos = 0
+
+
+class TrainingProgress(xgb.callback.TrainingCallback):
+    def __init__(self, num_rounds, data_name="val", metric_name="logloss"):
+        self.num_rounds = num_rounds
+        self.data_name = data_name
+        self.metric_name = metric_name
+        self.pbar = None
+
+    def before_training(self, model):
+        self.pbar = tqdm(total=self.num_rounds, desc="XGBoost training rounds")
+        return model
+
+    def after_iteration(self, model, epoch, evals_log):
+        history = evals_log.get(self.data_name, {}).get(self.metric_name)
+        if history:
+            self.pbar.set_postfix({f"{self.data_name}-{self.metric_name}": f"{history[-1]:.5f}"})
+        self.pbar.update(1)
+        return False
+
+    def after_training(self, model):
+        self.pbar.close()
+        return model
+
+
+class BestModelCheckpoint(xgb.callback.TrainingCallback):
+    def __init__(self, path, data_name="val", metric_name="logloss", maximize=False):
+        self.path = path
+        self.data_name = data_name
+        self.metric_name = metric_name
+        self.maximize = maximize
+        self.best = None
+
+    def after_iteration(self, model, epoch, evals_log):
+        score = evals_log[self.data_name][self.metric_name][-1]
+        if self.best is None or (score > self.best if self.maximize else score < self.best):
+            self.best = score
+            model.save_model(self.path)
+        return False
+
+
+def train_booster(params, dtrain, dval, num_boost_round=NUM_BOOST_ROUND,
+                  early_stopping_rounds=EARLY_STOPPING_ROUNDS, checkpoint_path=CHECKPOINT_PATH):
+    # One boosting run: each round is built once, callbacks report progress, keep the best
+    # val model on disk and stop once val logloss has not improved for early_stopping_rounds
+    metric = params["eval_metric"]
+    callbacks = [
+        TrainingProgress(num_boost_round, "val", metric),
+        BestModelCheckpoint(checkpoint_path, "val", metric),
+        xgb.callback.EarlyStopping(rounds=early_stopping_rounds, metric_name=metric,
+                                   data_name="val", save_best=True),
+    ]
+    return xgb.train(
+        params,
+        dtrain,
+        num_boost_round=num_boost_round,
+        evals=[(dtrain, "train"), (dval, "val")],
+        callbacks=callbacks,
+        verbose_eval=False
+    )
+
+
 n_pos = (y_train == 1).sum()
 n_neg = (y_train == 0).sum()
 scale_pos_weight = n_neg / n_pos
 
-dtrain = xgb.DMatrix(X_train, label=y_train)
-dval   = xgb.DMatrix(X_val, label=y_val)
+if EXTERNAL_MEMORY:
+    os.makedirs(EXTERNAL_MEMORY_DIR, exist_ok=True)
+    dtrain = xgb.DMatrix(EmbeddingIter(embedding_cache, train_rows, y_train, os.path.join(EXTERNAL_MEMORY_DIR, "train")))
+    dval   = xgb.DMatrix(EmbeddingIter(embedding_cache, val_rows, y_val, os.path.join(EXTERNAL_MEMORY_DIR, "val")))
+else:
+    dtrain = xgb.DMatrix(embedding_cache.take(train_rows), label=y_train)
+    dval   = xgb.DMatrix(embedding_cache.take(val_rows), label=y_val)
 
 params = {
     "objective": "binary:logistic",
@@ -62,19 +178,12 @@ params = {
     "eta": 0.1,
     "verbosity": 1
 }
+if EXTERNAL_MEMORY:
+    # External-memory DMatrix is only supported by the hist tree method
+    params["tree_method"] = "hist"
 
-
-num_boost_round = 100
-evals = [(dtrain, "train"), (dval, "val")]
-
-for i in tqdm(range(1, num_boost_round+1), desc="XGBoost training rounds"):
-    bst = xgb.train(
-        params,
-        dtrain,
-        num_boost_round=i,
-        evals=evals,
-        verbose_eval=False  
-    )
+bst = train_booster(params, dtrain, dval)
+print(f"best iteration: {bst.best_iteration}, best val {params['eval_metric']}: {bst.best_score:.5f}")
 
 
 y_pred_prob = bst.predict(dval)
@@ -4,6 +4,9 @@
 TAU_HIGH = 0.30  # 从0.40降低到0.30 - 更容易标记为不可信
 TAU_LOW = 0.70   # 从0.60提高到0.70 - 让更多评论进入忽略区域，减少可信标签
 
+# Label model strictness - lf_aggregate 按此放大促销/情感冲突/离题等权重，0.0 即基础权重
+STRICTNESS_LEVEL = 0.0
+
 # Sampling parameters
 PER_BIZ_MAX = 80
 TOTAL_CAP = 50000
@@ -19,6 +22,15 @@ MAX_BRAND_MENTIONS = 5      # 从4增加到5 - 更多品牌提及允许
 MAX_DAILY_REVIEWS = 12             # 从10增加到12 - 更多每日评论允许
 MAX_EXTREME_RATING_RATIO = 0.995   # 从0.99增加到0.995 - 更多极端评分允许
 
+# Group behavior thresholds (behavior_features.py 预计算后回连到每条评论)
+BIZ_BURST_WINDOW_HOURS = 24   # 商家突发检测的时间窗口（前后各 N 小时）
+BIZ_BURST_MIN_REVIEWS = 10    # 窗口内评论数达到该值视为商家突发
+MIN_USER_HISTORY = 3          # 用户历史评论数不足时不计算极端评分比例
+
+# Near-duplicate detection (near_dupe.py MinHash/LSH 预计算后回连到每条评论)
+NEAR_DUPE_THRESHOLD = 0.7     # 估计 Jaccard 相似度达到该值视为近重复
+NEAR_DUPE_MIN_TOKENS = 5      # 词数少于该值的短评不参与（"great food" 这类通用短评不算刷评）
+
 # Sentiment conflict threshold - 进一步放宽
 SENTIMENT_CONFLICT_THRESHOLD = 0.99  # 从0.98增加到0.99 - 更宽松的情感冲突检测
 
@@ -35,6 +47,9 @@ FOOD_CATEGORIES = [
     "food truck", "food court", "delicatessen", "grocery store"
 ]
 
+# Learned label model (label_model.py 拟合得到的 .npz)；为 None 时使用 lf_aggregate 的手工权重
+LABEL_MODEL_PATH = None
+
 # File paths
 DEFAULT_INPUT_PATH = r"D:\MyPersonalFiles\NTU\TechJam2025\review-Alaska_10.filtered.redacted.strict.dedup.preprocessed.targeted.json"
 DEFAULT_OUTPUT_PATH = "train_highconf.parquet"
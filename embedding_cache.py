@@ -0,0 +1,161 @@
+# embedding_cache.py - 文本向量的持久化缓存：按 (模型名, max_length, 文本) 的摘要寻址，只对新文本运行编码器
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from tqdm import tqdm
+
+ENCODE_CHUNK = 1024  # 每编码这么多条新文本就追加一次矩阵；索引在每次 ensure 结束（或中途出错）时写入一次
+
+
+def text_key(model_name, max_length, text):
+    """缓存键：128 位摘要拆成 (hi, lo) 两个 uint64"""
+    payload = f"{model_name}\0{max_length}\0{text}".encode('utf-8', 'surrogatepass')
+    digest = hashlib.blake2b(payload, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
+
+class EmbeddingCache:
+    """
+    每个 (模型, max_length, dtype) 一个目录：embeddings.bin 是只追加的 N×dim 原始矩阵，
+    index.npz 保存按摘要排序的 (hi, lo, 行号)。矩阵通过只读 memmap 访问，
+    请求的文本恰好是连续的若干行时直接返回 memmap 切片，不复制数据。
+    写入顺序为先追加矩阵、再原子替换索引，进程中断最多留下索引之外的孤立行。
+    """
+
+    def __init__(self, cache_dir, model_name, max_length, dtype='float32'):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.dtype = np.dtype(dtype)
+        namespace = re.sub(r'[^A-Za-z0-9_.-]+', '_', f'{model_name}-{max_length}-{self.dtype.name}')
+        self.dir = os.path.join(cache_dir, namespace)
+        os.makedirs(self.dir, exist_ok=True)
+        self.matrix_path = os.path.join(self.dir, 'embeddings.bin')
+        self.index_path = os.path.join(self.dir, 'index.npz')
+        self.meta_path = os.path.join(self.dir, 'meta.json')
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        if os.path.exists(self.index_path):
+            index = np.load(self.index_path)
+            self.hi, self.lo, self.rows = index['hi'], index['lo'], index['rows']
+        else:
+            self.hi = np.empty(0, dtype=np.uint64)
+            self.lo = np.empty(0, dtype=np.uint64)
+            self.rows = np.empty(0, dtype=np.int64)
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _keys(self, texts):
+        keys = [text_key(self.model_name, self.max_length, text) for text in texts]
+        hi = np.fromiter((k[0] for k in keys), dtype=np.uint64, count=len(keys))
+        lo = np.fromiter((k[1] for k in keys), dtype=np.uint64, count=len(keys))
+        return hi, lo
+
+    def _find(self, hi, lo):
+        """每个键对应的矩阵行号，未缓存的为 -1"""
+        found = np.full(len(hi), -1, dtype=np.int64)
+        if len(self.rows) == 0:
+            return found
+        left = np.searchsorted(self.hi, hi, side='left')
+        right = np.searchsorted(self.hi, hi, side='right')
+        single = np.flatnonzero(right - left == 1)
+        match = single[self.lo[left[single]] == lo[single]]
+        found[match] = self.rows[left[match]]
+        # 高 64 位相同的极少数情况逐个比较低 64 位
+        for i in np.flatnonzero(right - left > 1):
+            hit = np.flatnonzero(self.lo[left[i]:right[i]] == lo[i])
+            if len(hit):
+                found[i] = self.rows[left[i] + hit[0]]
+        return found
+
+    def matrix(self):
+        """整个缓存矩阵的只读 memmap"""
+        if self._matrix is None or len(self._matrix) < self._num_rows():
+            self._matrix = np.memmap(self.matrix_path, dtype=self.dtype, mode='r', shape=(self._num_rows(), self.dim))
+        return self._matrix
+
+    def _num_rows(self):
+        if self.dim is None or not os.path.exists(self.matrix_path):
+            return 0
+        return os.path.getsize(self.matrix_path) // (self.dim * self.dtype.itemsize)
+
+    def _append(self, embeddings):
+        """把向量追加到矩阵文件末尾，返回它们的行号"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        if self.dim is None:
+            self.dim = int(embeddings.shape[1])
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'model_name': self.model_name, 'max_length': self.max_length,
+                           'dtype': self.dtype.name, 'dim': self.dim}, f)
+        # 新行号从文件当前行数开始（跳过中断留下的孤立行）
+        start = self._num_rows()
+        with open(self.matrix_path, 'ab') as f:
+            f.truncate(start * self.dim * self.dtype.itemsize)
+            f.write(embeddings.tobytes())
+        return np.arange(start, start + len(embeddings), dtype=np.int64)
+
+    def _merge(self, hi, lo, rows):
+        """把索引中尚不存在的新键并入有序索引：只对新键排序，再按插入位置一次性插入"""
+        order = np.lexsort((lo, hi))
+        hi, lo, rows = hi[order], lo[order], rows[order]
+        pos = np.searchsorted(self.hi, hi, side='left')
+        right = np.searchsorted(self.hi, hi, side='right')
+        # 高 64 位相同的极少数情况按低 64 位后移
+        for i in np.flatnonzero(right > pos):
+            pos[i] += np.searchsorted(self.lo[pos[i]:right[i]], lo[i])
+        self.hi = np.insert(self.hi, pos, hi)
+        self.lo = np.insert(self.lo, pos, lo)
+        self.rows = np.insert(self.rows, pos, rows)
+
+    def _save_index(self):
+        tmp_path = os.path.join(self.dir, 'index.tmp.npz')
+        np.savez(tmp_path, hi=self.hi, lo=self.lo, rows=self.rows)
+        os.replace(tmp_path, self.index_path)
+
+    def ensure(self, texts, encode_fn, desc="Encoding texts"):
+        """
+        保证 texts 都已缓存，返回它们在缓存矩阵中的行号。未缓存的文本去重后按 ENCODE_CHUNK 分块
+        交给 encode_fn(list[str]) -> ndarray 编码并追加进缓存。
+        """
+        hi, lo = self._keys(texts)
+        rows = self._find(hi, lo)
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            # 同一文本只编码一次
+            _, first = np.unique(np.stack([hi[missing], lo[missing]], axis=1), axis=0, return_index=True)
+            todo = missing[np.sort(first)]
+            print(f"🧠 {len(texts) - len(missing):,} 条命中缓存，编码 {len(todo):,} 条新文本")
+            done, new_rows = [], []
+            try:
+                for k in tqdm(range(0, len(todo), ENCODE_CHUNK), desc=desc):
+                    chunk = todo[k:k + ENCODE_CHUNK]
+                    new_rows.append(self._append(encode_fn([texts[i] for i in chunk])))
+                    done.append(chunk)
+            finally:
+                # 中途出错时已编码的块照样入索引，下次不必重新编码
+                if done:
+                    done = np.concatenate(done)
+                    self._merge(hi[done], lo[done], np.concatenate(new_rows))
+                    self._save_index()
+            rows = self._find(hi, lo)
+        else:
+            print(f"🧠 {len(texts):,} 条全部命中缓存")
+        return rows
+
+    def take(self, rows):
+        """按行号取向量；行号连续时返回 memmap 切片（不复制），否则按行收集"""
+        if len(rows) == 0:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        matrix = self.matrix()
+        if np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return matrix[rows[0]:rows[0] + len(rows)]
+        return np.asarray(matrix[rows])
+
+    def get_or_encode(self, texts, encode_fn, desc="Encoding texts"):
+        """返回 texts 对应的 len(texts)×dim 向量（缓存的 dtype），只对未缓存的文本运行 encode_fn"""
+        return self.take(self.ensure(texts, encode_fn, desc))
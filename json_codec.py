@@ -0,0 +1,122 @@
+# json_codec.py - JSONL 编解码层：装有 orjson / msgspec 时使用快速实现，否则退回标准库；结果与标准库逐字节一致
+import json
+import math
+
+try:
+    import orjson
+except ImportError:  # 可选加速
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # 可选加速
+    msgspec = None
+
+# 各阶段实际读取的字段；按字段解码时其余字段直接跳过
+LABEL_FIELDS = ('user_id', 'gmap_id', 'name', 'rating', 'time', 'category', 'robot_review',
+                'text', 'original_text', 'processed_text', 'pii')
+BEHAVIOR_FIELDS = ('user_id', 'gmap_id', 'rating', 'time')
+NEAR_DUPE_FIELDS = ('user_id', 'gmap_id', 'time', 'text', 'original_text', 'processed_text')
+
+# orjson 会把超出 64 位的整数静默解析为浮点数，绝对值达到该量级的浮点结果需由标准库重新解析
+_INT64_LIMIT = float(2 ** 63)
+
+
+def backend():
+    """当前使用的解码实现，用于打印"""
+    if msgspec is not None:
+        return 'msgspec'
+    return 'orjson' if orjson is not None else 'json'
+
+
+def loads(data):
+    """
+    解析一行 JSON（str 或 bytes）。快速实现不接受的输入（NaN/Infinity、孤立代理项等）交给标准库重试，
+    因此解析结果与 json.loads 相同，解析失败时抛出的也是 json.JSONDecodeError。
+    """
+    if msgspec is not None:
+        try:
+            return msgspec.json.decode(data)
+        except (msgspec.MsgspecError, UnicodeEncodeError):
+            pass
+    elif orjson is not None:
+        try:
+            obj = orjson.loads(data)
+            if not _has_huge_float(obj):
+                return obj
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def _has_huge_float(obj):
+    """是否含有绝对值 >= 2^63 的浮点数（可能是被 orjson 转成浮点的大整数）"""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        kind = type(value)
+        if kind is dict:
+            stack.extend(value.values())
+        elif kind is list:
+            stack.extend(value)
+        elif kind is float and abs(value) >= _INT64_LIMIT:
+            return True
+    return False
+
+
+def _orjson_exact(obj):
+    """orjson 与标准库的输出只在浮点数上不同（1e16 vs 1e+16、NaN 输出为 null）；含这类浮点时走标准库"""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        kind = type(value)
+        if kind is dict:
+            stack.extend(value.values())
+        elif kind is list or kind is tuple:
+            stack.extend(value)
+        elif kind is float and (not math.isfinite(value) or 'e' in repr(value)):
+            return False
+    return True
+
+
+def dumps(obj, compact=False):
+    """
+    等价于 json.dumps(obj, ensure_ascii=False)；compact=True 时等价于再加 separators=(",", ":")。
+    orjson 只能输出紧凑格式，所以只有 compact 时才会用到它。
+    """
+    if compact:
+        if orjson is not None and _orjson_exact(obj):
+            try:
+                return orjson.dumps(obj).decode('utf-8')
+            except TypeError:  # 非字符串键、超大整数、孤立代理项等
+                pass
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(obj, ensure_ascii=False)
+
+
+_DECODERS = {}
+
+def _struct_decoder(fields):
+    decoder = _DECODERS.get(fields)
+    if decoder is None:
+        struct = msgspec.defstruct('Row', [(name, object, msgspec.UNSET) for name in fields])
+        decoder = _DECODERS[fields] = msgspec.json.Decoder(struct)
+    return decoder
+
+
+def decode_fields(data, fields):
+    """
+    只解码 fields 中的字段，返回只含这些字段（且输入中存在）的 dict。
+    有 msgspec 时按结构体解码，未声明的字段在解析时直接跳过；否则完整解析后再投影。
+    顶层不是对象的行（null、数字、数组等）抛出 ValueError，与解析失败一样由调用方跳过。
+    """
+    if msgspec is not None:
+        try:
+            row = _struct_decoder(fields).decode(data)
+            return {name: getattr(row, name) for name in fields if getattr(row, name) is not msgspec.UNSET}
+        except (msgspec.MsgspecError, UnicodeEncodeError):
+            pass  # 非对象或 msgspec 不接受的输入，按通用路径处理
+    row = loads(data)
+    if not isinstance(row, dict):
+        raise ValueError(f"顶层不是 JSON 对象: {type(row).__name__}")
+    return {name: row[name] for name in fields if name in row}
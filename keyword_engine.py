@@ -0,0 +1,112 @@
+# keyword_engine.py - 词典关键词匹配引擎：导入时把各词典编译为前缀trie正则，每条评论按词典各扫描一次
+import re
+
+
+def split_alternation(pattern):
+    """把 r"(a|b|c)" 形式的纯字面量择一串拆成词条列表（去重，保持顺序）"""
+    body = pattern.strip()
+    if body.startswith("(") and body.endswith(")"):
+        body = body[1:-1]
+    terms = []
+    seen = set()
+    for term in body.split("|"):
+        term = term.strip().lower()
+        if not term or term in seen:
+            continue
+        if re.search(r"[\\()\[\]?*+{}^$.]", term):
+            raise ValueError(f"词条包含正则元字符，无法编入trie: {term!r}")
+        seen.add(term)
+        terms.append(term)
+    return terms
+
+
+def _trie_to_regex(node):
+    """递归生成trie节点对应的正则；更长的续写排在前面，保证贪婪匹配"""
+    if "" in node and len(node) == 1:
+        return None
+
+    alternatives = []
+    leaf_chars = []
+    optional = False
+    for ch in sorted(node):
+        if ch == "":
+            optional = True
+            continue
+        sub = _trie_to_regex(node[ch])
+        if sub is None:
+            leaf_chars.append(re.escape(ch))
+        else:
+            alternatives.append(re.escape(ch) + sub)
+
+    only_chars = not alternatives
+    if leaf_chars:
+        alternatives.append(leaf_chars[0] if len(leaf_chars) == 1 else "[" + "".join(leaf_chars) + "]")
+
+    result = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+    if optional:
+        result = result + "?" if only_chars else "(?:" + result + ")?"
+    return result
+
+
+def build_trie_pattern(terms):
+    """把词条列表编译为前缀共享的正则（不含外层分组）"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    return _trie_to_regex(trie) or ""
+
+
+class KeywordEngine:
+    """
+    词典名 -> 预编译正则。
+    count=True 的词典返回非重叠命中次数（等价于 len(re.findall)），
+    count=False 的词典只需判断是否命中（re.search），返回 0/1。
+    """
+
+    def __init__(self):
+        self._lexicons = {}
+
+    def add_terms(self, name, terms, word_boundary=False, flags=re.I, count=True):
+        """注册一个纯字面量词典"""
+        body = "(?:" + build_trie_pattern(terms) + ")"
+        if word_boundary:
+            body = r"\b" + body + r"\b"
+        self.add_pattern(name, re.compile(body, flags), count=count)
+
+    def add_pattern(self, name, pattern, count=True):
+        """注册一个已编译的正则（实体识别等非纯字面量模式）"""
+        if name in self._lexicons:
+            raise ValueError(f"词典重复注册: {name}")
+        self._lexicons[name] = (pattern, count)
+
+    def names(self):
+        return list(self._lexicons)
+
+    def pattern(self, name):
+        return self._lexicons[name][0]
+
+    def contains(self, name, text):
+        if not text:
+            return False
+        return self._lexicons[name][0].search(text) is not None
+
+    def count(self, name, text):
+        if not text:
+            return 0
+        return sum(1 for _ in self._lexicons[name][0].finditer(text))
+
+    def scan(self, text, names=None):
+        """对一条文本返回 {词典名: 命中数}"""
+        hits = {}
+        for name in (names if names is not None else self._lexicons):
+            pattern, count = self._lexicons[name]
+            if not text:
+                hits[name] = 0
+            elif count:
+                hits[name] = sum(1 for _ in pattern.finditer(text))
+            else:
+                hits[name] = 1 if pattern.search(text) is not None else 0
+        return hits
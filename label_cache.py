@@ -0,0 +1,122 @@
+# label_cache.py - 增量标注：按「行内容 + 行为/近重复上下文」的摘要缓存 process_batch 的结果，只重算新增或变化的评论
+import hashlib
+import os
+import pickle
+import sqlite3
+
+from json_codec import LABEL_FIELDS
+
+# 标签函数实现所在的源文件；代码改动后旧结果一并作废
+LF_SOURCES = ('lf_rules.py', 'lf_aggregate.py', 'keyword_engine.py', 'keyword_offtopic_detector.py',
+              'label_model.py', 'run_full_labeling.py')
+
+_MISSING = '<missing>'
+_QUERY_CHUNK = 500  # 单条 SQL 的参数个数需低于 SQLite 上限 (999)
+
+
+def cache_fingerprint(rules):
+    """规则指纹 + 标签模型文件 + 标签函数源码的摘要；任一变化都使缓存整体失效"""
+    h = hashlib.sha1(rules.fingerprint.encode('utf-8'))
+    if rules.label_model_path and os.path.exists(rules.label_model_path):
+        stat = os.stat(rules.label_model_path)
+        h.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in LF_SOURCES:
+        path = os.path.join(base, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def row_digest(row, context):
+    """
+    一条评论的缓存键：process_batch 读取的全部字段（缺失与 None 区分开）加上该行的上下文特征
+    （行为索引回连值、近重复标记）。同一条评论在用户/商家历史变化后会得到新的键。
+    """
+    values = tuple(row.get(name, _MISSING) for name in LABEL_FIELDS)
+    payload = repr((values, context)).encode('utf-8', 'surrogatepass')
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+class LabelCache:
+    """
+    SQLite 中的 摘要 -> 标注结果（不含 comment_id）映射。fingerprint 与库中记录的不一致时清空全部结果。
+    多个工作进程可同时打开同一个库：WAL 模式下读不阻塞，写入按批提交。
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS results (digest BLOB PRIMARY KEY, result BLOB)')
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+            if row is None or row[0] != fingerprint:
+                if row is not None:
+                    print("♻️ 规则、标签模型或标签函数代码已变化，清空标注缓存")
+                self.conn.execute('DELETE FROM results')
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def get_many(self, digests):
+        """返回 {digest: result}，只包含命中的键"""
+        found = {}
+        for k in range(0, len(digests), _QUERY_CHUNK):
+            chunk = digests[k:k + _QUERY_CHUNK]
+            query = f"SELECT digest, result FROM results WHERE digest IN ({','.join('?' * len(chunk))})"
+            for digest, blob in self.conn.execute(query, chunk):
+                found[digest] = pickle.loads(blob)
+        self.hits += len(found)
+        self.misses += len(digests) - len(found)
+        return found
+
+    def put_many(self, items):
+        """items: [(digest, result), ...]；comment_id 与位置有关，不写入缓存"""
+        rows = []
+        for digest, result in items:
+            stored = dict(result)
+            stored.pop('comment_id', None)
+            rows.append((digest, pickle.dumps(stored, protocol=pickle.HIGHEST_PROTOCOL)))
+        if rows:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO results VALUES (?, ?)', rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def check_label_cache(path, rules=None):
+    """
+    在启动工作进程之前调用：指纹不一致时清空缓存，返回已有的结果条数。
+    SQLite 连接不能跨 fork 使用，所以这里不保留连接，工作进程各自通过 get_label_cache 打开。
+    """
+    if rules is None:
+        from lf_rules import get_rules
+        rules = get_rules()
+    cache = LabelCache(path, cache_fingerprint(rules))
+    try:
+        return len(cache)
+    finally:
+        cache.close()
+
+
+_CACHE_BY_PATH = {}
+
+def get_label_cache(path, rules=None):
+    """按 (路径, 规则指纹) 缓存已打开的连接，工作进程内每个批次不会重复打开数据库"""
+    if rules is None:
+        from lf_rules import get_rules
+        rules = get_rules()
+    key = (path, rules.fingerprint)
+    cache = _CACHE_BY_PATH.get(key)
+    if cache is None:
+        cache = _CACHE_BY_PATH[key] = LabelCache(path, cache_fingerprint(rules))
+    return cache
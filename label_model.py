@@ -0,0 +1,259 @@
+# label_model.py - 生成式标签模型：从无标注的 LF 投票矩阵中学习各标签函数的准确率与相关性，替代手工权重
+import argparse
+import time
+import numpy as np
+
+from lf_aggregate import aggregate_lfs_batch, final_labels
+
+# 投票取值 -1 忽略 / 0 可信 / 1 不可信，映射到下标 0 / 1 / 2
+NUM_VOTES = 3
+
+
+def _vote_masks(L):
+    """N×K 投票矩阵 -> 三个 N×K float32 指示矩阵（忽略/可信/不可信），用于矩阵乘法统计"""
+    L = np.asarray(L)
+    return [(L == v).astype(np.float32) for v in (-1, 0, 1)]
+
+
+def compress_votes(L):
+    """
+    投票模式的取值组合远少于行数：把每行编码为一个三进制整数后去重，
+    返回 (唯一模式矩阵 U, 每种模式的行数 counts, 每行对应的模式下标 inverse)。
+    EM 只在唯一模式上按行数加权迭代，代价与数据量基本无关。
+    """
+    L = np.asarray(L)
+    if L.shape[1] > 39:
+        raise ValueError("标签函数超过 39 个，无法编码为 int64")
+    powers = NUM_VOTES ** np.arange(L.shape[1], dtype=np.int64)
+    keys = (L.astype(np.int64) + 1) @ powers
+    uniq, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    U = (uniq[:, None] // powers[None, :]) % NUM_VOTES - 1
+    return U.astype(np.int8), counts.astype(np.float64), inverse.ravel()
+
+
+class LabelModel:
+    """
+    条件独立的二分类生成模型（Dawid-Skene / Snorkel 风格），用 EM 拟合：
+      P(y, λ) = π_y · Π_j θ_j[y, λ_j] ^ d_j
+    θ_j[y, v] 为第 j 个标签函数在真实类别 y 下投出 v 的概率（含忽略），
+    d_j 为相关性折减系数：强相关的一组 LF 共享一份证据，避免重复计票。
+    所有统计量都通过 N×K 指示矩阵的矩阵乘法完成，百万行量级的拟合只需数秒。
+    """
+
+    def __init__(self, lf_names, smoothing=1.0, dependency_threshold=0.5):
+        self.lf_names = list(lf_names)
+        self.smoothing = smoothing
+        self.dependency_threshold = dependency_threshold
+        k = len(self.lf_names)
+        self.theta = np.full((k, 2, NUM_VOTES), 1.0 / NUM_VOTES)
+        self.prior = np.array([0.5, 0.5])
+        self.dep_weights = np.ones(k)
+        self.correlations = np.zeros((k, k))
+
+    # ------------------------------------------------------------------ 拟合
+    def fit(self, L, init_proba=None, class_balance=None, sample_size=None, max_iter=100, tol=1e-5, seed=0):
+        """
+        L: N×K 投票矩阵（列顺序与 lf_names 一致）
+        init_proba: 初始后验 P(y=1)，默认用现有手工权重的聚合结果作为锚点，保证类别方向不翻转
+        class_balance: 固定不可信比例（例如目标 0.15）；为 None 时从数据中学习
+        sample_size: 只在随机抽样的子集上拟合，拟合结果可直接应用到全量数据
+        """
+        L = np.asarray(L)
+        if sample_size is not None and sample_size < len(L):
+            idx = np.random.default_rng(seed).choice(len(L), size=sample_size, replace=False)
+            L = L[idx]
+            if init_proba is not None:
+                init_proba = np.asarray(init_proba)[idx]
+
+        if init_proba is None:
+            init_proba, _, _ = aggregate_lfs_batch(L, (L != -1).astype(np.float64), self.lf_names)
+        U, counts, inverse = compress_votes(L)
+        # 同一投票模式的初始后验取平均（默认锚点下本来就相同）
+        q1 = np.bincount(inverse, weights=np.asarray(init_proba, dtype=np.float64), minlength=len(U)) / counts
+        masks = _vote_masks(U)
+
+        # 先在锚点后验下估计类内相关性，对强相关的 LF 组折减权重，再跑 EM。
+        # 不能用 EM 之后的后验：若两个 LF 互为副本，EM 会让它们主导类别划分，类内相关性反而被掩盖
+        self.correlations = self._conditional_correlations(masks[0], q1, counts)
+        self.dep_weights = self._dependency_weights(self.correlations)
+        self._em(masks, counts, q1, class_balance, max_iter, tol)
+        return self
+
+    def _em(self, masks, counts, q1, class_balance, max_iter, tol):
+        a = self.smoothing
+        n = counts.sum()
+        for _ in range(max_iter):
+            # M 步：先验与各 LF 的条件投票分布（按模式行数加权）
+            w1 = counts * q1
+            w0 = counts - w1
+            if class_balance is None:
+                self.prior = np.array([w0.sum(), w1.sum()]) / n
+            else:
+                self.prior = np.array([1.0 - class_balance, class_balance])
+            weights = np.column_stack([w0, w1]).astype(np.float32)
+            stats = np.stack([(weights.T @ m).T for m in masks], axis=2).astype(np.float64) + a  # K×2×3
+            theta = stats / stats.sum(axis=2, keepdims=True)
+            delta = np.abs(theta - self.theta).max()
+            self.theta = theta
+
+            # E 步：每种模式的类别后验
+            q1 = self._posterior(masks)
+            if delta < tol:
+                break
+        return q1
+
+    def _log_odds(self, masks):
+        """log P(y=1, λ) - log P(y=0, λ)；二分类下后验即其 sigmoid"""
+        log_theta = np.log(self.theta) * self.dep_weights[:, None, None]
+        diff = (log_theta[:, 1, :] - log_theta[:, 0, :]).astype(np.float32)  # K×3
+        log_odds = np.zeros(masks[0].shape[0], dtype=np.float64)
+        for v, m in enumerate(masks):
+            log_odds += m @ diff[:, v]
+        return log_odds + np.log(self.prior[1]) - np.log(self.prior[0])
+
+    def _posterior(self, masks):
+        with np.errstate(over='ignore'):
+            return 1.0 / (1.0 + np.exp(-self._log_odds(masks)))
+
+    @staticmethod
+    def _conditional_correlations(abstain_mask, q1, counts):
+        """按后验加权的类内相关系数（以“是否触发”为变量），两类取绝对值较大者"""
+        fired = 1.0 - abstain_mask.astype(np.float64)
+        k = fired.shape[1]
+        corr = np.zeros((k, k))
+        for w in (counts * (1.0 - q1), counts * q1):
+            total = w.sum()
+            if total <= 0:
+                continue
+            mean = (w @ fired) / total
+            centered = fired - mean
+            cov = (centered * w[:, None]).T @ centered / total
+            std = np.sqrt(np.clip(np.diag(cov), 1e-12, None))
+            c = cov / np.outer(std, std)
+            corr = np.where(np.abs(c) > np.abs(corr), c, corr)
+        np.fill_diagonal(corr, 1.0)
+        return corr
+
+    def _dependency_weights(self, corr):
+        """相关系数超过阈值的 LF 连成一组（连通分量），组内每个 LF 的权重为 1/组大小"""
+        k = len(self.lf_names)
+        parent = list(range(k))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for i in range(k):
+            for j in range(i + 1, k):
+                if abs(corr[i, j]) > self.dependency_threshold:
+                    parent[find(i)] = find(j)
+        roots = [find(i) for i in range(k)]
+        sizes = {r: roots.count(r) for r in roots}
+        return np.array([1.0 / sizes[r] for r in roots])
+
+    # ------------------------------------------------------------------ 预测
+    def _align(self, L, lf_names):
+        """按模型的列顺序重排投票矩阵，缺失的 LF 视为忽略"""
+        L = np.asarray(L)
+        if lf_names is None or list(lf_names) == self.lf_names:
+            return L
+        col = {name: j for j, name in enumerate(lf_names)}
+        aligned = np.full((L.shape[0], len(self.lf_names)), -1, dtype=L.dtype)
+        for j, name in enumerate(self.lf_names):
+            if name in col:
+                aligned[:, j] = L[:, col[name]]
+        return aligned
+
+    def predict_proba(self, L, lf_names=None):
+        """返回 N×2 概率矩阵，列为 [P(可信), P(不可信)]"""
+        U, _, inverse = compress_votes(self._align(L, lf_names))
+        p1 = self._posterior(_vote_masks(U))[inverse]
+        return np.column_stack([1.0 - p1, p1])
+
+    def predict(self, L, lf_names=None, tau_high=None, tau_low=None):
+        """按 TAU_HIGH/TAU_LOW 阈值给出最终标签：1 不可信, 0 可信, -1 忽略"""
+        return final_labels(self.predict_proba(L, lf_names)[:, 1], tau_high, tau_low)
+
+    def accuracies(self):
+        """各 LF 触发时投票正确的概率"""
+        acc = {}
+        for j, name in enumerate(self.lf_names):
+            correct = self.prior[0] * self.theta[j, 0, 1] + self.prior[1] * self.theta[j, 1, 2]
+            fired = self.prior[0] * (1 - self.theta[j, 0, 0]) + self.prior[1] * (1 - self.theta[j, 1, 0])
+            acc[name] = correct / fired if fired > 0 else float('nan')
+        return acc
+
+    def print_status(self):
+        print(f"🧠 标签模型: 不可信先验 {self.prior[1]:.3f}")
+        print("📊 各标签函数估计准确率 / 触发率 / 相关性折减:")
+        acc = self.accuracies()
+        for j, name in enumerate(self.lf_names):
+            coverage = self.prior[0] * (1 - self.theta[j, 0, 0]) + self.prior[1] * (1 - self.theta[j, 1, 0])
+            print(f"   {name:24}: acc {acc[name]:.3f}  cov {coverage:.3f}  d {self.dep_weights[j]:.2f}")
+
+    # ------------------------------------------------------------------ 持久化
+    def save(self, path):
+        # 经文件句柄写入，路径不会被 np.savez 补上 .npz 后缀（run_full_labeling 按配置中的原路径加载）
+        with open(path, 'wb') as f:
+            np.savez(f, lf_names=np.array(self.lf_names), theta=self.theta, prior=self.prior,
+                     dep_weights=self.dep_weights, correlations=self.correlations)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        model = cls([str(n) for n in data['lf_names']])
+        model.theta = data['theta']
+        model.prior = data['prior']
+        model.dep_weights = data['dep_weights']
+        model.correlations = data['correlations']
+        return model
+
+
+_MODEL_CACHE = {}
+
+def get_label_model(path):
+    """按路径缓存已加载的模型，批处理中重复调用不会重复读盘"""
+    model = _MODEL_CACHE.get(path)
+    if model is None:
+        model = _MODEL_CACHE[path] = LabelModel.load(path)
+    return model
+
+
+def load_vote_matrix(parquet_path, lf_names=None):
+    """从标注输出的 Parquet 中只读取 lf_<name>_label 列，组装为 N×K 投票矩阵"""
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(parquet_path)
+    if lf_names is None:
+        lf_names = [c[len('lf_'):-len('_label')] for c in schema.names
+                    if c.startswith('lf_') and c.endswith('_label')]
+    columns = [f'lf_{name}_label' for name in lf_names]
+    table = pq.read_table(parquet_path, columns=columns, memory_map=True)
+    L = np.column_stack([table.column(c).to_numpy(zero_copy_only=False) for c in columns]).astype(np.int8)
+    return L, lf_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在 LF 投票矩阵上拟合生成式标签模型")
+    parser.add_argument("--input", dest="input_path", required=True, help="run_full_labeling.py 输出的 .parquet 文件")
+    parser.add_argument("--output", dest="output_path", default="label_model.npz")
+    parser.add_argument("--sample", type=int, default=None, help="只在随机抽样的 N 行上拟合")
+    parser.add_argument("--class-balance", dest="class_balance", type=float, default=None, help="固定不可信比例")
+    args = parser.parse_args()
+
+    L, lf_names = load_vote_matrix(args.input_path)
+    print(f"📈 投票矩阵: {L.shape[0]:,} 行 × {L.shape[1]} 个标签函数")
+
+    start_time = time.time()
+    model = LabelModel(lf_names).fit(L, class_balance=args.class_balance, sample_size=args.sample)
+    print(f"⏱️ 拟合耗时: {time.time() - start_time:.2f} 秒")
+    model.print_status()
+
+    model.save(args.output_path)
+    print(f"✅ 模型已保存到: {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# label_profiler.py - 标注流程的可选性能剖析：每个标签函数的累计耗时、调用次数、命中率、p50/p99 延迟，以及解析/聚合/输出等阶段耗时
+import json
+import time
+import numpy as np
+
+# 延迟直方图：从 100ns 起每个桶放大 2^(1/8)（约 9%），共覆盖到约 15 秒；分位数按桶估计，内存与评论数无关
+_BUCKETS_PER_OCTAVE = 8
+_MIN_SECONDS = 1e-7
+_NUM_BUCKETS = _BUCKETS_PER_OCTAVE * 27
+_EDGES = _MIN_SECONDS * 2.0 ** (np.arange(1, _NUM_BUCKETS + 1) / _BUCKETS_PER_OCTAVE)
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图，可跨进程合并"""
+
+    def __init__(self):
+        self.counts = np.zeros(_NUM_BUCKETS + 1, dtype=np.int64)
+        self.total = 0.0
+        self.calls = 0
+
+    def add(self, seconds):
+        seconds = np.asarray(seconds, dtype=np.float64)
+        if seconds.size == 0:
+            return
+        buckets = np.searchsorted(_EDGES, seconds)
+        self.counts += np.bincount(buckets, minlength=_NUM_BUCKETS + 1)
+        self.total += float(seconds.sum())
+        self.calls += int(seconds.size)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        self.calls += other.calls
+
+    def quantile(self, q):
+        """分位数的估计值（所在桶的上边界，秒）"""
+        if self.calls == 0:
+            return 0.0
+        k = int(np.searchsorted(np.cumsum(self.counts), q * self.calls))
+        return float(_EDGES[min(k, _NUM_BUCKETS - 1)])
+
+
+class LabelProfiler:
+    """
+    Labeler 按批次调用 call() 计时每个标签函数，批次结束时 end_batch() 把缓冲的耗时汇总进直方图；
+    阶段耗时由 add_stage 累加。多进程时每个工作进程各持一份，主进程用 merge 合并。
+    """
+
+    def __init__(self, interval=30.0):
+        self.interval = interval
+        self.started = time.time()
+        self._last_progress = self.started
+        self.rows = 0
+        self.lfs = {}      # name -> LatencyHistogram
+        self.hits = {}     # name -> 投票（label != -1）次数
+        self.stages = {}   # name -> [秒, 次数]
+        self._pending = {}
+
+    def __getstate__(self):
+        # 计时缓冲只在批次内部有效，跨进程传递前已经清空
+        state = dict(self.__dict__)
+        state['_pending'] = {}
+        return state
+
+    def call(self, name, func, *args):
+        """运行一个标签函数并记录耗时与是否投票"""
+        t0 = time.perf_counter()
+        out = func(*args)
+        elapsed = time.perf_counter() - t0
+        pending = self._pending.get(name)
+        if pending is None:
+            pending = self._pending[name] = []
+            self.hits.setdefault(name, 0)
+        pending.append(elapsed)
+        if out[0] != -1:
+            self.hits[name] += 1
+        return out
+
+    def end_batch(self, rows):
+        for name, pending in self._pending.items():
+            hist = self.lfs.get(name)
+            if hist is None:
+                hist = self.lfs[name] = LatencyHistogram()
+            hist.add(pending)
+        self._pending = {}
+        self.rows += rows
+
+    def add_stage(self, name, seconds, count=1):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = [0.0, 0]
+        stats[0] += seconds
+        stats[1] += count
+
+    def merge(self, other):
+        """合并工作进程的剖析结果"""
+        self.rows += other.rows
+        for name, hist in other.lfs.items():
+            if name in self.lfs:
+                self.lfs[name].merge(hist)
+            else:
+                self.lfs[name] = hist
+        for name, hits in other.hits.items():
+            self.hits[name] = self.hits.get(name, 0) + hits
+        for name, (seconds, count) in other.stages.items():
+            self.add_stage(name, seconds, count)
+
+    def report(self):
+        """汇总为可直接 json.dump 的字典；share 为占全部已计时耗时的比例"""
+        lf_total = sum(hist.total for hist in self.lfs.values())
+        timed = lf_total + sum(seconds for seconds, _ in self.stages.values())
+        denom = max(timed, 1e-12)
+        wall = time.time() - self.started
+        lfs = {}
+        for name, hist in sorted(self.lfs.items(), key=lambda kv: kv[1].total, reverse=True):
+            lfs[name] = {
+                'calls': hist.calls,
+                'seconds': round(hist.total, 6),
+                'share': round(hist.total / denom, 4),
+                'mean_us': round(hist.total / max(hist.calls, 1) * 1e6, 3),
+                'p50_us': round(hist.quantile(0.50) * 1e6, 3),
+                'p99_us': round(hist.quantile(0.99) * 1e6, 3),
+                'hit_rate': round(self.hits.get(name, 0) / max(hist.calls, 1), 4),
+            }
+        stages = {name: {'seconds': round(seconds, 6), 'count': count, 'share': round(seconds / denom, 4)}
+                  for name, (seconds, count) in self.stages.items()}
+        stages['labeling_functions'] = {'seconds': round(lf_total, 6), 'count': self.rows,
+                                        'share': round(lf_total / denom, 4)}
+        return {
+            'rows': self.rows,
+            'wall_seconds': round(wall, 3),
+            'rows_per_second': round(self.rows / max(wall, 1e-9), 1),
+            'timed_seconds': round(timed, 6),
+            'stages': stages,
+            'lfs': lfs,
+        }
+
+    def progress_line(self):
+        report = self.report()
+        stages = sorted(report['stages'].items(), key=lambda kv: kv[1]['seconds'], reverse=True)
+        top_lfs = list(report['lfs'].items())[:3]
+        parts = ', '.join(f"{name} {stats['share']*100:.0f}%" for name, stats in stages)
+        lf_parts = ', '.join(f"{name} {stats['share']*100:.0f}%" for name, stats in top_lfs)
+        return (f"⏱️ 已处理 {report['rows']:,} 条 ({report['rows_per_second']:.0f} 条/秒) | 阶段: {parts}"
+                f" | 最慢的标签函数: {lf_parts}")
+
+    def maybe_print_progress(self):
+        """距上次输出超过 interval 秒时打印一行进度"""
+        now = time.time()
+        if now - self._last_progress >= self.interval:
+            print(self.progress_line())
+            self._last_progress = now
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
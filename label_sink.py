@@ -0,0 +1,441 @@
+# label_sink.py - 标注结果的流式输出与增量摘要统计，内存占用与数据集大小无关
+import os
+import pickle
+import shutil
+import time
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet 输出为可选功能
+    pa = None
+    pq = None
+
+
+def category_str(category):
+    """category 字段可能是列表，取第一个作为统计用的业务类型"""
+    return str(category[0]) if isinstance(category, list) and category else str(category)
+
+
+class SummaryAccumulator:
+    """增量计算 generate_summary_report 所需的全部统计量，逐批 update 即可"""
+
+    def __init__(self):
+        self.total = 0
+        self.label_counts = {1: 0, 0: 0, -1: 0, 'ERROR': 0}
+        # key -> [总数, 不可信数, 可信数]；只统计非 ERROR 行
+        self.by_rating = {}
+        self.by_category = {}
+        self.robot = [0, 0, 0]
+
+    def update(self, results):
+        for r in results:
+            label = r['final_label']
+            self.total += 1
+            if label in self.label_counts:
+                self.label_counts[label] += 1
+
+            if r.get('robot_review') == True:
+                self.robot[0] += 1
+                self.robot[1] += label == 1
+                self.robot[2] += label == 0
+
+            if label == 'ERROR':
+                continue
+            for table, key in ((self.by_rating, r.get('rating')), (self.by_category, category_str(r.get('category')))):
+                stats = table.get(key)
+                if stats is None:
+                    stats = table[key] = [0, 0, 0]
+                stats[0] += 1
+                stats[1] += label == 1
+                stats[2] += label == 0
+
+    def report(self):
+        """打印摘要报告（与原 generate_summary_report 输出一致）"""
+        print(f"\n📊 标签结果摘要报告")
+        print("=" * 60)
+
+        total = self.total
+        denom = max(1, total)
+        untrustworthy = self.label_counts[1]
+        trustworthy = self.label_counts[0]
+        ignore = self.label_counts[-1]
+        errors = self.label_counts['ERROR']
+
+        print(f"📈 总体统计:")
+        print(f"   总评论数: {total:,}")
+        print(f"   可信评论: {trustworthy:,} ({trustworthy/denom*100:.1f}%)")
+        print(f"   不可信评论: {untrustworthy:,} ({untrustworthy/denom*100:.1f}%)")
+        print(f"   忽略评论: {ignore:,} ({ignore/denom*100:.1f}%)")
+        print(f"   处理失败: {errors:,} ({errors/denom*100:.1f}%)")
+
+        print(f"\n⭐ 按评分统计:")
+        try:
+            ratings = sorted(self.by_rating)
+        except TypeError:
+            ratings = sorted(self.by_rating, key=str)
+        for rating in ratings:
+            self._print_group(f"评分 {rating}", self.by_rating[rating])
+
+        print(f"\n🏪 按业务类型统计:")
+        # 显示前10个最常见的业务类型
+        top_categories = sorted(self.by_category.items(), key=lambda kv: kv[1][0], reverse=True)[:10]
+        for category, stats in top_categories:
+            self._print_group(category, stats)
+
+        print(f"\n🤖 机器人评论分析:")
+        robot_total, robot_untrust, robot_trust = self.robot
+        if robot_total > 0:
+            print(f"   机器人评论总数: {robot_total:,}")
+            print(f"   机器人不可信评论: {robot_untrust:,} ({robot_untrust/robot_total*100:.1f}%)")
+            print(f"   机器人可信评论: {robot_trust:,} ({robot_trust/robot_total*100:.1f}%)")
+        else:
+            print("   未发现机器人评论")
+
+        print(f"\n🎯 标签质量评估:")
+        print(f"   可信评论比例: {trustworthy/denom*100:.1f}% (目标: 30-50%)")
+        print(f"   不可信评论比例: {untrustworthy/denom*100:.1f}% (目标: 20-40%)")
+        print(f"   忽略评论比例: {ignore/denom*100:.1f}% (目标: 最小化)")
+
+        if trustworthy/denom*100 >= 30 and trustworthy/denom*100 <= 50:
+            print("   ✅ 可信评论比例在目标范围内")
+        else:
+            print("   ⚠️ 可信评论比例超出目标范围")
+
+        if untrustworthy/denom*100 >= 20 and untrustworthy/denom*100 <= 40:
+            print("   ✅ 不可信评论比例在目标范围内")
+        else:
+            print("   ⚠️ 不可信评论比例超出目标范围")
+
+        if ignore/denom*100 < 10:
+            print("   ✅ 忽略评论比例较低")
+        else:
+            print("   ⚠️ 忽略评论比例较高")
+
+    @staticmethod
+    def _print_group(name, stats):
+        total_count, untrust_count, trust_count = stats
+        if total_count > 0:
+            untrust_rate = untrust_count / total_count * 100
+            trust_rate = trust_count / total_count * 100
+            print(f"   {name}: {untrust_count}/{total_count} 不可信 ({untrust_rate:.1f}%), {trust_count}/{total_count} 可信 ({trust_rate:.1f}%)")
+
+
+class CsvResultSink:
+    """每批结果立即追加写入 CSV；可选地同时更新摘要累加器"""
+
+    def __init__(self, output_path, summary=None, checkpointing=False, resume_state=None):
+        self.path = output_path.replace('.parquet', '.csv')
+        self.summary = summary
+        self.rows_written = 0
+        if resume_state is not None:
+            # 续跑：截掉上次检查点之后写入的半截数据，继续追加
+            with open(self.path, 'ab') as f:
+                f.truncate(resume_state['bytes'])
+            self.rows_written = resume_state['rows']
+        elif os.path.exists(self.path):
+            # 覆盖旧文件，之后全部以追加方式写入
+            os.remove(self.path)
+
+    def write(self, results):
+        if not results:
+            return
+        df = pd.DataFrame(results)
+        df.to_csv(self.path, mode='a', header=self.rows_written == 0, index=False, encoding='utf-8')
+        self.rows_written += len(df)
+        if self.summary is not None:
+            self.summary.update(results)
+
+    def checkpoint(self):
+        """已写出部分的状态；每次 to_csv 都会关闭文件，当前大小即为完整行的边界"""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {'rows': self.rows_written, 'bytes': size}
+
+    def close(self, finalize=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(finalize=exc_type is None)
+        return False
+
+
+def _to_int(value):
+    """评分/时间等字段可能是空串或 'ERROR'，无法转换时记为缺失"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+class ParquetResultSink:
+    """
+    每批结果写成一个 Parquet row group。lf_outputs 展开为列式投票矩阵：
+    每个标签函数对应 lf_<name>_label (int8) 和 lf_<name>_conf (float32)，
+    category/user_id/label_str 使用字典编码，下游可按列读取而无需解析 CSV 文本。
+
+    Parquet 文件在写完 footer 之前不可读，进程被中断时已写的数据无法恢复。
+    checkpointing=True 时结果先写入 <output>.parts/ 下的分段文件，每个检查点关闭一段，
+    close() 时再按顺序把各段的 row group 拷贝进最终文件。
+    """
+
+    def __init__(self, output_path, summary=None, lf_names=None, checkpointing=False, resume_state=None):
+        if pa is None:
+            raise ImportError("写入 Parquet 需要安装 pyarrow: pip install pyarrow")
+        self.path = output_path
+        self.summary = summary
+        self.lf_names = list(lf_names) if lf_names is not None else None
+        # 是否带 cascade_scorer.py 的级联结果列；未指定时由第一批结果决定
+        self.cascade = None
+        self.rows_written = 0
+        self._writer = None
+        self._schema = None
+        self._held = []  # 未指定 lf_names 且还没见到成功标注的行时，暂存的全 ERROR 结果
+        self.parts_dir = output_path + '.parts' if checkpointing else None
+        self.parts = 0
+        if resume_state is not None:
+            self.rows_written = resume_state['rows']
+            self.parts = resume_state['parts']
+            if resume_state['lf_names'] is not None:
+                self.lf_names = list(resume_state['lf_names'])
+            self.cascade = resume_state.get('cascade')
+        if self.parts_dir is not None:
+            os.makedirs(self.parts_dir, exist_ok=True)
+            # 丢弃上次检查点之后写出的分段（以及非续跑时遗留的旧分段）
+            for name in os.listdir(self.parts_dir):
+                if not name.startswith('part-') or int(name[5:10]) >= self.parts:
+                    os.remove(os.path.join(self.parts_dir, name))
+
+    def _part_path(self, index):
+        return os.path.join(self.parts_dir, f'part-{index:05d}.parquet')
+
+    def _build_schema(self):
+        dict_str = pa.dictionary(pa.int32(), pa.string())
+        fields = [
+            ('comment_id', pa.int64()),
+            ('user_id', dict_str),
+            ('gmap_id', dict_str),
+            ('name', pa.string()),
+            ('rating', pa.int8()),
+            ('time', pa.int64()),
+            ('category', dict_str),
+            ('category_list', pa.list_(pa.string())),
+            ('robot_review', pa.bool_()),
+            ('text', pa.string()),
+            ('processed_text', pa.string()),
+            ('entity_count', pa.int32()),
+            ('len_char', pa.int32()),
+            ('len_tok', pa.int32()),
+            ('p_untrust', pa.float64()),
+            ('score', pa.float64()),
+            ('final_label', pa.int8()),
+            ('label_str', dict_str),
+        ]
+        for name in self.lf_names:
+            fields.append((f'lf_{name}_label', pa.int8()))
+            fields.append((f'lf_{name}_conf', pa.float32()))
+        if self.cascade:
+            fields.append(('model_prob', pa.float64()))
+            fields.append(('cascade_label', pa.int8()))
+            fields.append(('cascade_source', dict_str))
+        return pa.schema(fields)
+
+    def _columns(self, results):
+        cols = {
+            'comment_id': [r['comment_id'] for r in results],
+            'user_id': [str(r.get('user_id', '')) for r in results],
+            'gmap_id': [str(r.get('gmap_id', '')) for r in results],
+            'name': [str(r.get('name', '')) for r in results],
+            'rating': [_to_int(r.get('rating')) for r in results],
+            'time': [_to_int(r.get('time')) for r in results],
+            'category': [category_str(r.get('category')) for r in results],
+            'category_list': [[str(c) for c in r['category']] if isinstance(r.get('category'), list) else None
+                              for r in results],
+            'robot_review': [bool(r.get('robot_review', False)) for r in results],
+            'text': [str(r.get('text', '')) for r in results],
+            'processed_text': [str(r.get('processed_text', '')) for r in results],
+            'entity_count': [_to_int(r['entity_count']) for r in results],
+            'len_char': [_to_int(r['len_char']) for r in results],
+            'len_tok': [_to_int(r['len_tok']) for r in results],
+            'p_untrust': [_to_float(r['p_untrust']) for r in results],
+            'score': [_to_float(r['score']) for r in results],
+            'final_label': [_to_int(r['final_label']) for r in results],
+            'label_str': [str(r['label_str']) for r in results],
+        }
+        for name in self.lf_names:
+            votes = [r['lf_outputs'].get(name, (-1, 0.0)) for r in results]
+            cols[f'lf_{name}_label'] = [lab for lab, _ in votes]
+            cols[f'lf_{name}_conf'] = [conf for _, conf in votes]
+        if self.cascade:
+            cols['model_prob'] = [_to_float(r['model_prob']) for r in results]
+            cols['cascade_label'] = [_to_int(r['cascade_label']) for r in results]
+            cols['cascade_source'] = [str(r['cascade_source']) for r in results]
+        return cols
+
+    def write(self, results):
+        if not results:
+            return
+        if self.lf_names is None:
+            # 未指定时以第一批出现过的标签函数为准（保持首次出现的顺序）；
+            # 全是 ERROR 行（lf_outputs 为空）的批次先暂存，等到有成功标注的行再确定列
+            names = {}
+            for r in results:
+                for name in r.get('lf_outputs', {}):
+                    names.setdefault(name, None)
+            if not names:
+                self._held.extend(results)
+                return
+            self.lf_names = list(names)
+        if self._held:
+            results = self._held + results
+            self._held = []
+        if self.cascade is None:
+            self.cascade = 'cascade_label' in results[0]
+        if self._schema is None:
+            self._schema = self._build_schema()
+        if self._writer is None:
+            target = self._part_path(self.parts) if self.parts_dir is not None else self.path
+            self._writer = pq.ParquetWriter(target, self._schema, compression='zstd')
+
+        table = pa.Table.from_pydict(self._columns(results), schema=self._schema)
+        self._writer.write_table(table)
+        self.rows_written += len(results)
+        if self.summary is not None:
+            self.summary.update(results)
+
+    def _flush_held(self):
+        """检查点或结束时仍未确定列：暂存的行只能不带投票列写出"""
+        if self._held:
+            if self.lf_names is None:
+                self.lf_names = []
+            results, self._held = self._held, []
+            self.write(results)
+
+    def checkpoint(self):
+        """关闭当前分段使其成为完整的 Parquet 文件，返回已写出部分的状态"""
+        self._flush_held()
+        if self.parts_dir is not None and self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self.parts += 1
+        return {'rows': self.rows_written, 'parts': self.parts, 'lf_names': self.lf_names, 'cascade': self.cascade}
+
+    def close(self, finalize=True):
+        """finalize=False（处理中途出错）时只关闭当前分段，保留分段目录供续跑"""
+        if finalize:
+            self._flush_held()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            if self.parts_dir is not None:
+                self.parts += 1
+        if self.parts_dir is None or not finalize:
+            return
+        if self.parts:
+            schema = pq.read_schema(self._part_path(0))
+            with pq.ParquetWriter(self.path, schema, compression='zstd') as writer:
+                for index in range(self.parts):
+                    part = pq.ParquetFile(self._part_path(index))
+                    for group in range(part.num_row_groups):
+                        writer.write_table(part.read_row_group(group))
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        self.parts_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(finalize=exc_type is None)
+        return False
+
+
+def open_result_sink(output_path, summary=None, lf_names=None, checkpointing=False, resume_state=None):
+    """
+    按扩展名选择输出格式：.parquet 写列式 Parquet，其余写 CSV。
+    lf_names 为 Parquet 投票矩阵的列（run_full_labeling.lf_names_for），CSV 不需要
+    """
+    if output_path.endswith('.parquet'):
+        return ParquetResultSink(output_path, summary, lf_names=lf_names, checkpointing=checkpointing,
+                                 resume_state=resume_state)
+    return CsvResultSink(output_path, summary, checkpointing=checkpointing, resume_state=resume_state)
+
+
+def resume_state_valid(output_path, state):
+    """
+    检查点记录的输出是否仍在磁盘上：CSV 至少要有记录的字节数（否则截断会用 NUL 补齐后继续追加），
+    Parquet 的每个已关闭分段都要存在且是完整文件。输出被删除或替换后应放弃检查点从头开始。
+    """
+    if output_path.endswith('.parquet'):
+        parts_dir = output_path + '.parts'
+        for index in range(state['parts']):
+            part = os.path.join(parts_dir, f'part-{index:05d}.parquet')
+            try:
+                pq.read_metadata(part)
+            except (OSError, pa.ArrowException):
+                return False
+        return True
+    path = output_path.replace('.parquet', '.csv')
+    if state['bytes'] == 0:
+        return True
+    return os.path.exists(path) and os.path.getsize(path) >= state['bytes']
+
+
+class LabelCheckpoint:
+    """
+    标注进度检查点：记录已处理到的输入字节偏移、已编号的评论数、输出 sink 的状态和摘要累加器，
+    以 pickle 原子替换写入 <output>.ckpt。续跑时只有输入文件（大小、修改时间）与运行参数
+    （规则指纹、索引路径等）都未变化才会采用，避免把两套规则的结果拼在一起。
+    """
+
+    def __init__(self, path, input_path, options, interval=60.0):
+        self.path = path
+        stat = os.stat(input_path)
+        self.identity = {'input_path': os.path.abspath(input_path), 'input_size': stat.st_size,
+                         'input_mtime_ns': stat.st_mtime_ns, 'options': dict(options)}
+        self.interval = interval
+        self._last_save = time.time()
+
+    def load(self):
+        """读取可用的检查点，不存在或与本次运行不匹配时返回 None"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ 检查点无法读取，将从头开始: {e}")
+            return None
+        if state.get('identity') != self.identity:
+            print("⚠️ 输入文件或运行参数已变化，忽略旧检查点并从头开始")
+            return None
+        return state
+
+    def update(self, offset, rows, sink, force=False):
+        """一批结果写出后调用；距上次保存超过 interval 秒时落盘"""
+        now = time.time()
+        if not force and now - self._last_save < self.interval:
+            return
+        state = {'identity': self.identity, 'offset': offset, 'rows': rows,
+                 'sink': sink.checkpoint(), 'summary': sink.summary}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._last_save = now
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
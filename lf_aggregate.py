@@ -1,9 +1,12 @@
 import math
-from config import STRICTNESS_LEVEL
+import numpy as np
+from config import STRICTNESS_LEVEL, TAU_HIGH, TAU_LOW
 
 # 根据严格程度动态调整权重
-def get_adjusted_weights():
-    """根据严格程度动态调整权重"""
+def get_adjusted_weights(strictness=None):
+    """根据严格程度动态调整权重；strictness 为 None 时使用 config.STRICTNESS_LEVEL"""
+    if strictness is None:
+        strictness = STRICTNESS_LEVEL
     base_weights = {
         "promo": 2.0,              # 促销内容基础权重
         "near_dupe": 1.8,          # 重复内容
@@ -11,6 +14,7 @@ def get_adjusted_weights():
         "offtopic": 0.6,           # 离题内容基础权重
         "user_burst": 1.2,         # 用户爆发
         "biz_burst": 1.2,          # 业务爆发
+        "user_extreme_hist": 0.6,  # 用户极端评分历史
         "too_short": 0.6,          # 过短文本
         "template": 0.8,           # 模板化内容
         "entity_sparse": 0.6,      # 实体稀疏
@@ -27,10 +31,10 @@ def get_adjusted_weights():
     for key, base_weight in base_weights.items():
         if key in ["promo", "sent_conflict", "political_content"]:
             # 促销内容、情感冲突、政治内容权重随严格程度线性增加
-            adjusted_weights[key] = base_weight + STRICTNESS_LEVEL * 1.0
+            adjusted_weights[key] = base_weight + strictness * 1.0
         elif key in ["offtopic", "near_dupe"]:
             # 离题内容和重复内容权重适度增加
-            adjusted_weights[key] = base_weight + STRICTNESS_LEVEL * 0.5
+            adjusted_weights[key] = base_weight + strictness * 0.5
         else:
             # 其他权重保持不变
             adjusted_weights[key] = base_weight
@@ -64,6 +68,49 @@ def aggregate_lfs(lf_outputs):
     p_untrust = sigmoid(score)
     return p_untrust, score, hits
 
+def weight_vector(lf_names, weights=None):
+    """按列顺序取出权重向量，未配置的标签函数默认权重 1.0"""
+    if weights is None:
+        weights = get_adjusted_weights()
+    return np.array([weights.get(name, 1.0) for name in lf_names], dtype=np.float64)
+
+def lf_outputs_to_matrix(lf_outputs_list, lf_names):
+    """把 [{lf_name: (label, conf)}, ...] 转成 N×K 的标签矩阵 L (int8) 与置信度矩阵 C (float64)"""
+    n, k = len(lf_outputs_list), len(lf_names)
+    L = np.full((n, k), -1, dtype=np.int8)
+    C = np.zeros((n, k), dtype=np.float64)
+    for i, lf_outputs in enumerate(lf_outputs_list):
+        for j, name in enumerate(lf_names):
+            vote = lf_outputs.get(name)
+            if vote is not None:
+                L[i, j], C[i, j] = vote
+    return L, C
+
+def final_labels(p_untrust, tau_high=None, tau_low=None):
+    """按 TAU_HIGH/TAU_LOW 阈值得到最终标签：1 不可信, 0 可信, -1 忽略"""
+    tau_high = TAU_HIGH if tau_high is None else tau_high
+    tau_low = TAU_LOW if tau_low is None else tau_low
+    # 与逐条判断顺序一致：先判不可信，再判可信
+    return np.where(p_untrust >= tau_high, 1, np.where(p_untrust <= tau_low, 0, -1)).astype(np.int8)
+
+def aggregate_lfs_batch(L, C, lf_names, weights=None, tau_high=None, tau_low=None):
+    """
+    aggregate_lfs 的向量化版本，一次处理整批评论。
+    L: N×K 标签矩阵（1 不可信, 0 可信, -1 忽略），C: N×K 置信度矩阵，lf_names: 列对应的标签函数名
+    返回 (p_untrust, score, final_label)，均为长度 N 的数组
+    """
+    L = np.asarray(L)
+    C = np.asarray(C, dtype=np.float64)
+    w = weight_vector(lf_names, weights)
+    
+    # 1 -> +1, 0 -> -1, -1 -> 0（忽略的投票不贡献分数）
+    sign = (L == 1).astype(np.float64) - (L == 0).astype(np.float64)
+    # 逐行求和而非矩阵乘法：BLAS 的分块累加顺序随批大小变化，会让分片并行与顺序处理的结果差一个 ulp
+    score = (sign * C * w).sum(axis=1)
+    with np.errstate(over='ignore'):
+        p_untrust = 1.0 / (1.0 + np.exp(-score))
+    return p_untrust, score, final_labels(p_untrust, tau_high, tau_low)
+
 def print_weight_status():
     """打印当前权重状态"""
     current_weights = get_adjusted_weights()
@@ -1,8 +1,21 @@
 # lf_rules.py - Labeling functions for review trustworthiness detection
 import re
-from config import *
+import hashlib
+import importlib
+import json
+import os
+from collections import Counter
+import config
+from keyword_engine import KeywordEngine, build_trie_pattern, split_alternation
+from lf_aggregate import get_adjusted_weights
 
-PROMO_EN = r"(deal|discount|whatsapp|contact me|official|promo code|coupon|click (the )?link|buy now|limited time|referral|wholesale|reseller|unlock|free gift|dm me|cashback|use code|dm|pm|text me|message me|call me|reach out|get in touch|inbox me|slide into dm|hit me up|drop a line|shoot me a text|ping me|buzz me|ring me|drop me a line|give me a shout|drop me a message|send me a message|contact me directly|reach me at|get me on|find me on|look me up|search for me|my number is|my contact is|my details are|my info is|my contact info|my contact details|my phone number|my whatsapp|my telegram|my signal|my line|my wechat|my kik|my snapchat|my instagram|my facebook|my twitter|my linkedin|my email|my gmail|my yahoo|my outlook|my hotmail|my protonmail|my tutanota|my zoho|my aol|my icloud|my yandex|my mail|my inbox|my dm|my pm|my message|my text|my call|my voice|my video|my facetime|my skype|my zoom|my teams|my slack|my discord|my telegram|my signal|my line|my wechat|my kik|my snapchat|my instagram|my facebook|my twitter|my linkedin|my email|my gmail|my yahoo|my outlook|my hotmail|my protonmail|my tutanota|my zoho|my aol|my icloud|my yandex|my mail|my inbox|my dm|my pm|my message|my text|my call|my voice|my video|my facetime|my skype|my zoom|my teams|my slack|my discord)"
+# 可选的关键词离题检测器：模块加载时导入一次（失败的导入不会被缓存，放在函数里会每条评论重新搜索一遍 sys.path）
+try:
+    from keyword_offtopic_detector import lf_offtopic_keyword
+except ImportError:
+    lf_offtopic_keyword = None
+
+PROMO_EN = r"(deal|discount|whatsapp|contact me|official|promo code|coupon|click the link|click link|buy now|limited time|referral|wholesale|reseller|unlock|free gift|dm me|cashback|use code|dm|pm|text me|message me|call me|reach out|get in touch|inbox me|slide into dm|hit me up|drop a line|shoot me a text|ping me|buzz me|ring me|drop me a line|give me a shout|drop me a message|send me a message|contact me directly|reach me at|get me on|find me on|look me up|search for me|my number is|my contact is|my details are|my info is|my contact info|my contact details|my phone number|my whatsapp|my telegram|my signal|my line|my wechat|my kik|my snapchat|my instagram|my facebook|my twitter|my linkedin|my email|my gmail|my yahoo|my outlook|my hotmail|my protonmail|my tutanota|my zoho|my aol|my icloud|my yandex|my mail|my inbox|my dm|my pm|my message|my text|my call|my voice|my video|my facetime|my skype|my zoom|my teams|my slack|my discord|my telegram|my signal|my line|my wechat|my kik|my snapchat|my instagram|my facebook|my twitter|my linkedin|my email|my gmail|my yahoo|my outlook|my hotmail|my protonmail|my tutanota|my zoho|my aol|my icloud|my yandex|my mail|my inbox|my dm|my pm|my message|my text|my call|my voice|my video|my facetime|my skype|my zoom|my teams|my slack|my discord)"
 # 高度模板化的评论模式 - 只在明显模板化时触发
 # 这些是非常具体的模板化短语，通常出现在批量生成的评论中
 TEMPLATE_EN = r"(highly recommend to everyone|must buy this product|100% recommend|definitely recommend this|strongly recommend this|absolutely recommend|would definitely recommend|will definitely buy again|worth every single penny|five star rating|top notch quality|best product ever|excellent quality and service|amazing quality and fast delivery|perfect in every way|couldn't be happier|exceeded my expectations completely|outstanding product and service|phenomenal experience overall|spectacular quality and value)"
@@ -15,25 +28,192 @@ FOOD_OFFTOPIC_EN = r"(political|election|vote|government|tax|insurance|investmen
 # Includes delivery-related terms as they might be off-topic for non-food businesses
 GENERAL_OFFTOPIC_EN = r"(shipping|delivery|logistics|courier|warehouse|parcel|invoice|refund|return|chargeback|tracking number|lost package|resend|political|election|vote|government|tax|insurance|investment|stock|crypto|bitcoin|ethereum|forex|trading|gambling|casino|lottery|betting|dating|marriage|divorce|legal|law|court|attorney|lawyer|medical|health|pharmacy|prescription|medication|surgery|hospital|clinic|doctor|nurse|dentist|orthodontist|veterinarian|pet|animal|car|automotive|vehicle|motorcycle|bike|bicycle|real estate|property|house|apartment|condo|mortgage|loan|credit|debt|banking|finance|accounting|tax|audit|consulting|marketing|advertising|seo|web design|graphic design|software|programming|coding|development|maintenance|repair|installation|construction|renovation|plumbing|electrical|hvac|landscaping|gardening|cleaning|janitorial|security|pest control|exterminator)"
 
+# 品牌/商品提及词
+BRAND_EN = r"(brand|product|item|goods|merchandise|stock|inventory|supply|supplier|manufacturer|distributor|retailer|wholesaler|reseller|dealer|vendor|seller|buyer|customer|client|consumer|user|end user|target audience|market|marketplace|platform|website|app|application|software|tool|service|solution|package|bundle|offer|deal|promotion|campaign|marketing|advertising|publicity|exposure|visibility|reach|engagement|conversion|sales|revenue|profit|margin|commission|fee|charge|cost|price|value|worth|quality|standard|specification|requirement|feature|function|benefit|advantage|pro|con|pros|cons|positive|negative|good|bad|better|worse|best|worst|improve|enhance|upgrade|optimize|maximize|minimize|increase|decrease|reduce|boost)"
+
+# 时效性促销词
+TIME_SENSITIVE_EN = r"(limited time|flash sale|24 hours|48 hours|72 hours|weekend|today only|tonight only|this week|this month|this year|seasonal|holiday|christmas|black friday|cyber monday|boxing day|new year|valentine|easter|halloween|thanksgiving|independence day|memorial day|labor day|veterans day|presidents day|columbus day|martin luther king day|juneteenth|kwanzaa|ramadan|eid|diwali|hanukkah|passover|rosh hashanah|yom kippur|chinese new year|lunar new year|vietnamese new year|korean new year|japanese new year|thai new year|lao new year|cambodian new year|burmese new year|mongolian new year|tibetan new year|nepali new year|bangladeshi new year|sri lankan new year|pakistani new year|indian new year|afghan new year|iranian new year|iraqi new year|syrian new year|lebanese new year|jordanian new year|palestinian new year|israeli new year|egyptian new year|libyan new year|tunisian new year|algerian new year|moroccan new year|sudanese new year|ethiopian new year|somali new year|kenyan new year|ugandan new year|tanzanian new year|rwandan new year|burundian new year|central african new year|chadian new year|cameroonian new year|gabonese new year|congolese new year|equatorial guinean new year|sao tomean new year|angolan new year|zambian new year|zimbabwean new year|botswanan new year|namibian new year|south african new year|lesotho new year|swazi new year|mozambican new year|malawian new year)"
+
+# 实体识别词典（纯字面量部分）；编译为trie正则后挂到 KEYWORDS 引擎上
+CURRENCY_EN = r"(dollar|dollars|buck|bucks|quid|pound|pounds|euro|euros|yen|yuan|won|rupee|rupees|peso|pesos|franc|francs|mark|marks|lira|liras|ruble|rubles|krono|kronor|krone|kroner|zloty|forint|forints|koruna|korunas|lei|leis|lev|levs|dinar|dinars|dirham|dirhams|rial|rials|taka|ringgit|baht|dong|rupiah|tugrik|som|tenge|manat|somoni|afghani|ariary|dalasi|cedi|dalasi|gourde|kina|kwacha|maloti|metical|naira|pula|shilling|tala|vatu|zloty)"
+TIME_WORDS_EN = r"(yesterday|today|tomorrow|morning|afternoon|evening|night|tonight|this morning|this afternoon|this evening|this week|next week|last week|this month|next month|last month|this year|next year|last year)"
+QTY_UNITS_EN = r"(min|mins|hour|hours|day|days|week|weeks|month|months|year|years|km|mile|miles|meter|meters|feet|inches|cm|mm|kg|pound|pounds|ounce|ounces|gram|grams|liter|liters|gallon|gallons|cup|cups|tablespoon|tablespoons|teaspoon|teaspoons|piece|pieces|item|items|unit|units|set|sets|pair|pairs|dozen|dozens|hundred|hundreds|thousand|thousands|million|millions|billion|billions)"
+FOOD_EN = r"(noodles|burger|sushi|espresso|latte|pasta|ramen|taco|steak|salad|pizza|sandwich|hot dog|chicken|beef|pork|lamb|fish|shrimp|salmon|tuna|cod|halibut|mahi mahi|swordfish|mackerel|sardines|anchovies|herring|trout|bass|perch|walleye|catfish|tilapia|snapper|grouper|redfish|blackfish|bluefish|striped bass|white bass|yellow bass|rock bass|smallmouth bass|largemouth bass|spotted bass|guadalupe bass|redeye bass|choctaw bass|tallapoosa bass|alabama bass|florida bass|georgia bass|kentucky bass|mississippi bass|missouri bass|north carolina bass|south carolina bass|tennessee bass|virginia bass|west virginia bass|arkansas bass|louisiana bass|oklahoma bass|texas bass|new mexico bass|arizona bass|california bass|nevada bass|utah bass|colorado bass|wyoming bass|montana bass|idaho bass|washington bass|oregon bass|alaska bass|hawaii bass|puerto rico bass|guam bass|virgin islands bass|northern mariana islands bass|american samoa bass|marshall islands bass|micronesia bass|palau bass|nauru bass|kiribati bass|tuvalu bass|tokelau bass|niue bass|cook islands bass|samoa bass|tonga bass|fiji bass|vanuatu bass|new caledonia bass|solomon islands bass|papua new guinea bass|timor leste bass|indonesia bass|malaysia bass|singapore bass|brunei bass|philippines bass|vietnam bass|laos bass|cambodia bass|thailand bass|myanmar bass|bangladesh bass|india bass|pakistan bass|afghanistan bass|iran bass|iraq bass|syria bass|lebanon bass|jordan bass|israel bass|palestine bass|egypt bass|libya bass|tunisia bass|algeria bass|morocco bass|western sahara bass|mauritania bass|senegal bass|gambia bass|guinea bass|guinea bissau bass|sierra leone bass|liberia bass|ivory coast bass|ghana bass|togo bass|benin bass|nigeria bass|niger bass|chad bass|cameroon bass|central african republic bass|equatorial guinea bass|gabon bass|congo bass|democratic republic of congo bass|angola bass|zambia bass|zimbabwe bass|botswana bass|namibia bass|south africa bass|lesotho bass|eswatini bass|mozambique bass|malawi bass|tanzania bass|kenya bass|uganda bass|rwanda bass|burundi bass|ethiopia bass|eritrea bass|djibouti bass|somalia bass|somaliland bass|comoros bass|mayotte bass|reunion bass|madagascar bass|mauritius bass|seychelles bass|maldives bass|sri lanka bass)"
+
 # Enhanced entity detection patterns
-MONEY_RE = re.compile(r"\$ ?\d+(?:\.\d+)?|\d+ ?(?:dollars?|bucks?|quid|pounds?|euros?|yen|yuan|won|rupees?|pesos?|francs?|marks?|liras?|rubles?|kronor?|kroner?|zloty|forints?|korunas?|leis?|levs?|dinars?|dirhams?|rials?|taka|ringgit|baht|dong|rupiah|tugrik|som|tenge|manat|somoni|afghani|ariary|dalasi|cedi|dalasi|gourde|kina|kwacha|maloti|metical|naira|pula|shilling|tala|vatu|zloty)\b", re.I)
-TIME_RE  = re.compile(r"\b(\d{1,2}:\d{2} ?(?:am|pm)?|[A-Z][a-z]{2,8} \d{1,2}, \d{4}|yesterday|today|tomorrow|morning|afternoon|evening|night|tonight|this morning|this afternoon|this evening|this week|next week|last week|this month|next month|last month|this year|next year|last year)\b")
-QTY_RE   = re.compile(r"\b\d+ (?:mins?|hours?|days?|weeks?|months?|years?|km|miles?|meters?|feet|inches|cm|mm|kg|pounds?|ounces?|grams?|liters?|gallons?|cups?|tablespoons?|teaspoons?|pieces?|items?|units?|sets?|pairs?|dozens?|hundreds?|thousands?|millions?|billions?)\b")
-FOOD_RE  = re.compile(r"\b(noodles|burger|sushi|espresso|latte|pasta|ramen|taco|steak|salad|pizza|sandwich|hot dog|chicken|beef|pork|lamb|fish|shrimp|salmon|tuna|cod|halibut|mahi mahi|swordfish|mackerel|sardines|anchovies|herring|trout|bass|perch|walleye|catfish|tilapia|snapper|grouper|redfish|blackfish|bluefish|striped bass|white bass|yellow bass|rock bass|smallmouth bass|largemouth bass|spotted bass|guadalupe bass|redeye bass|choctaw bass|tallapoosa bass|alabama bass|florida bass|georgia bass|kentucky bass|mississippi bass|missouri bass|north carolina bass|south carolina bass|tennessee bass|virginia bass|west virginia bass|arkansas bass|louisiana bass|oklahoma bass|texas bass|new mexico bass|arizona bass|california bass|nevada bass|utah bass|colorado bass|wyoming bass|montana bass|idaho bass|washington bass|oregon bass|alaska bass|hawaii bass|puerto rico bass|guam bass|virgin islands bass|northern mariana islands bass|american samoa bass|marshall islands bass|micronesia bass|palau bass|nauru bass|kiribati bass|tuvalu bass|tokelau bass|niue bass|cook islands bass|samoa bass|tonga bass|fiji bass|vanuatu bass|new caledonia bass|solomon islands bass|papua new guinea bass|timor leste bass|indonesia bass|malaysia bass|singapore bass|brunei bass|philippines bass|vietnam bass|laos bass|cambodia bass|thailand bass|myanmar bass|bangladesh bass|india bass|pakistan bass|afghanistan bass|iran bass|iraq bass|syria bass|lebanon bass|jordan bass|israel bass|palestine bass|egypt bass|libya bass|tunisia bass|algeria bass|morocco bass|western sahara bass|mauritania bass|senegal bass|gambia bass|guinea bass|guinea bissau bass|sierra leone bass|liberia bass|ivory coast bass|ghana bass|togo bass|benin bass|nigeria bass|niger bass|chad bass|cameroon bass|central african republic bass|equatorial guinea bass|gabon bass|congo bass|democratic republic of congo bass|angola bass|zambia bass|zimbabwe bass|botswana bass|namibia bass|south africa bass|lesotho bass|eswatini bass|mozambique bass|malawi bass|tanzania bass|kenya bass|uganda bass|rwanda bass|burundi bass|ethiopia bass|eritrea bass|djibouti bass|somalia bass|somaliland bass|comoros bass|mayotte bass|reunion bass|madagascar bass|mauritius bass|seychelles bass|maldives bass|sri lanka bass)\b", re.I)
+MONEY_RE = re.compile(r"\$ ?\d+(?:\.\d+)?|\d+ ?(?:" + build_trie_pattern(split_alternation(CURRENCY_EN)) + r")\b", re.I)
+TIME_RE  = re.compile(r"\b(\d{1,2}:\d{2} ?(?:am|pm)?|[A-Z][a-z]{2,8} \d{1,2}, \d{4}|" + build_trie_pattern(split_alternation(TIME_WORDS_EN)) + r")\b")
+QTY_RE   = re.compile(r"\b\d+ (?:" + build_trie_pattern(split_alternation(QTY_UNITS_EN)) + r")\b")
+FOOD_RE  = re.compile(r"\b(" + build_trie_pattern(split_alternation(FOOD_EN)) + r")\b", re.I)
+
+# 所有词典在导入时编译一次；LF 只通过引擎匹配，不再逐条评论传入原始择一串
+ENTITY_LEXICONS = ("money", "time", "qty", "food")
+
+KEYWORDS = KeywordEngine()
+KEYWORDS.add_terms("promo", split_alternation(PROMO_EN), count=False)
+KEYWORDS.add_terms("template", split_alternation(TEMPLATE_EN))
+KEYWORDS.add_terms("food_offtopic", split_alternation(FOOD_OFFTOPIC_EN), count=False)
+KEYWORDS.add_terms("general_offtopic", split_alternation(GENERAL_OFFTOPIC_EN), count=False)
+KEYWORDS.add_terms("brand", split_alternation(BRAND_EN), word_boundary=True)
+KEYWORDS.add_terms("time_sensitive", split_alternation(TIME_SENSITIVE_EN), word_boundary=True, count=False)
+KEYWORDS.add_pattern("money", MONEY_RE)
+KEYWORDS.add_pattern("time", TIME_RE)
+KEYWORDS.add_pattern("qty", QTY_RE)
+KEYWORDS.add_pattern("food", FOOD_RE)
+
+def keyword_hits(text: str) -> dict:
+    """Scan text once per lexicon and return {lexicon: hit count}"""
+    return KEYWORDS.scan(text)
 
 def rough_entity_count(text: str) -> int:
     """Count entities in text using regex patterns"""
     if not text: return 0
-    cnt = 0
-    cnt += len(MONEY_RE.findall(text))
-    cnt += len(TIME_RE.findall(text))
-    cnt += len(QTY_RE.findall(text))
-    cnt += len(FOOD_RE.findall(text))
-    return cnt
-
-def lf_promo_has_link(text, has_url, has_phone):
+    hits = KEYWORDS.scan(text, ENTITY_LEXICONS)
+    return sum(hits.values())
+
+EMOJI_RE = re.compile(r'[😀-🙿🌀-🗿🚀-🛿🦀-🧿]')
+REPEAT_RUN_RE = re.compile(r"(.)\1+")
+REPEAT_PUNCT_RE = re.compile(r"([!?])\1+")
+
+class TextFeatures:
+    """
+    每条评论只计算一次的共享文本特征，所有 LF 直接读取，不再各自重新扫描文本。
+    词典命中按需扫描并缓存（例如离题检测只需要 food/general 其中之一）。
+    """
+    __slots__ = ("text", "len_char", "len_tok", "caps_count", "non_alnum_count",
+                 "max_repeat_run", "max_punct_run", "emoji_count", "max_word_freq",
+                 "_hits", "_ent_count")
+
+    def __init__(self, text):
+        text = text or ""
+        self.text = text
+        self.len_char = len(text)
+
+        words = text.lower().split()
+        self.len_tok = len(words)
+        self.max_word_freq = max(Counter(words).values()) if words else 0
+
+        # 逐字符统计全部走 C 层的 str 方法，避免 Python 级循环
+        self.caps_count = sum(map(str.isupper, text))
+        self.non_alnum_count = self.len_char - sum(map(str.isalnum, text)) - sum(map(str.isspace, text))
+        self.emoji_count = len(EMOJI_RE.findall(text))
+
+        # 连续重复字符（不含换行，与 "(.)\1{n,}" 的语义一致）
+        self.max_repeat_run = max((m.end() - m.start() for m in REPEAT_RUN_RE.finditer(text)),
+                                  default=1 if text else 0)
+        self.max_punct_run = max((m.end() - m.start() for m in REPEAT_PUNCT_RE.finditer(text)),
+                                 default=1 if ("!" in text or "?" in text) else 0)
+
+        self._hits = {}
+        self._ent_count = None
+
+    def hits(self, lexicon):
+        """某个词典的命中数（count=False 的词典返回 0/1）"""
+        cached = self._hits.get(lexicon)
+        if cached is None:
+            cached = KEYWORDS.scan(self.text, (lexicon,))[lexicon]
+            self._hits[lexicon] = cached
+        return cached
+
+    @property
+    def entity_count(self):
+        if self._ent_count is None:
+            self._ent_count = sum(self.hits(name) for name in ENTITY_LEXICONS)
+        return self._ent_count
+
+def _features(text, feats):
+    return feats if feats is not None else TextFeatures(text)
+
+class RuleSet:
+    """
+    一次性从 config 构建的规则配置：阈值、聚合权重与编译好的词典引擎。
+    LF 通过 rules 参数读取阈值，不再在每次调用时拼接/编译正则。
+    config 变化后调用 reload_rules()（或在批次之间调用 reload_rules_if_changed()）整体重建并原子替换，
+    正在处理的批次继续使用旧对象。
+    """
+
+    def __init__(self, cfg):
+        self.strictness = float(getattr(cfg, 'STRICTNESS_LEVEL', 0.0))
+        self.tau_high = cfg.TAU_HIGH
+        self.tau_low = cfg.TAU_LOW
+        self.min_entities_for_trust = cfg.MIN_ENTITIES_FOR_TRUST
+        self.max_emojis = cfg.MAX_EMOJIS
+        self.max_caps_ratio = cfg.MAX_CAPS_RATIO
+        self.max_word_repetition_ratio = cfg.MAX_WORD_REPETITION_RATIO
+        self.max_brand_mentions = cfg.MAX_BRAND_MENTIONS
+        self.max_daily_reviews = cfg.MAX_DAILY_REVIEWS
+        self.max_extreme_rating_ratio = cfg.MAX_EXTREME_RATING_RATIO
+        self.biz_burst_window_hours = cfg.BIZ_BURST_WINDOW_HOURS
+        self.biz_burst_min_reviews = cfg.BIZ_BURST_MIN_REVIEWS
+        self.min_user_history = cfg.MIN_USER_HISTORY
+        self.sentiment_conflict_threshold = cfg.SENTIMENT_CONFLICT_THRESHOLD
+        self.max_non_alnum_ratio = cfg.MAX_NON_ALNUM_RATIO
+        # 原正则 "(.)\1{N+1,}" 等价于连续重复长度 >= N+2
+        self.min_repeat_run = cfg.MAX_REPEATED_CHARS + 2
+        self.min_punct_run = cfg.MAX_REPEATED_PUNCTUATION + 2
+        self.food_categories = frozenset(str(c).lower() for c in cfg.FOOD_CATEGORIES)
+        self.label_model_path = getattr(cfg, 'LABEL_MODEL_PATH', None)
+        self.weights = get_adjusted_weights(self.strictness)
+        self.keywords = KEYWORDS
+        self.fingerprint = self._fingerprint()
+
+    def _fingerprint(self):
+        """阈值、权重与词典内容的摘要，用于判断规则是否变化"""
+        settings = {k: (sorted(v) if isinstance(v, frozenset) else v)
+                    for k, v in vars(self).items() if k not in ('keywords', 'fingerprint')}
+        settings['lexicons'] = {name: self.keywords.pattern(name).pattern for name in self.keywords.names()}
+        blob = json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+_ACTIVE_RULES = None
+_CONFIG_MTIME = None  # 构建当前 RuleSet 时 config.py 的修改时间
+
+def _config_mtime():
+    try:
+        return os.stat(config.__file__).st_mtime_ns
+    except OSError:
+        return None
+
+def get_rules():
+    """当前生效的 RuleSet（首次调用时从 config 构建）"""
+    global _ACTIVE_RULES, _CONFIG_MTIME
+    if _ACTIVE_RULES is None:
+        _CONFIG_MTIME = _config_mtime()
+        _ACTIVE_RULES = RuleSet(config)
+    return _ACTIVE_RULES
+
+def reload_rules():
+    """重新加载 config.py 并整体替换当前 RuleSet，返回新对象"""
+    global _ACTIVE_RULES, _CONFIG_MTIME
+    _CONFIG_MTIME = _config_mtime()
+    importlib.reload(config)
+    rules = RuleSet(config)
+    _ACTIVE_RULES = rules
+    return rules
+
+def reload_rules_if_changed():
+    """config.py 的修改时间变化时重新加载；只做一次 stat，可以在每个批次之间调用。返回当前生效的 RuleSet"""
+    rules = get_rules()
+    if _config_mtime() != _CONFIG_MTIME:
+        rules = reload_rules()
+    return rules
+
+def pii_flags(row, text):
+    """
+    (has_url, has_phone)：优先读取 redact_pii.py --emit-flags 写入的 pii 计数；
+    没有该字段的旧数据退回到检查文本里的 <url>/<phone> 占位符（子串判断，不再跑正则）
+    """
+    pii = row.get('pii')
+    if isinstance(pii, dict):
+        return (pii.get('url') or 0) > 0, (pii.get('phone') or 0) > 0
+    if not isinstance(text, str) or not text:
+        return False, False
+    return '<url>' in text, '<phone>' in text
+
+def lf_promo_has_link(text, has_url, has_phone, feats=None):
     """Detect promotional content with links or phone numbers"""
-    if re.search(PROMO_EN, text, re.I):
+    if not text: return (-1, 0.0)
+    if _features(text, feats).hits("promo"):
         return (1, 0.95) if (has_url or has_phone) else (1, 0.80)
     return (-1, 0.0)
 
@@ -41,12 +221,12 @@ def lf_too_short(len_tok, len_char):
     """Detect reviews that are too short"""
     return (1, 0.70) if (len_tok <= 5 or len_char <= 12) else (-1, 0.0)
 
-def lf_template_low_entities(text, ent_count):
+def lf_template_low_entities(text, ent_count, feats=None):
     """Detect template reviews with low entity count - 更严格的模板检测"""
     if not text: return (-1, 0.0)
     
     # 检查是否包含模板化短语
-    template_matches = len(re.findall(TEMPLATE_EN, text, re.I))
+    template_matches = _features(text, feats).hits("template")
     
     # 只有在以下条件下才触发：
     # 1. 包含模板化短语
@@ -62,20 +242,18 @@ def lf_entity_sparse(len_char, ent_count):
     """Detect reviews with sparse entity information"""
     return (1, 0.60) if (len_char > 12 and ent_count == 0) else (-1, 0.0)
 
-def lf_offtopic(category, text):
+def lf_offtopic(category, text, feats=None, rules=None):
     """Detect off-topic content for business category"""
     if not text:
         return (-1, 0.0)
     
     # Use the new keyword-based detector (more reliable and faster)
-    try:
-        from keyword_offtopic_detector import lf_offtopic_keyword
+    if lf_offtopic_keyword is not None:
         return lf_offtopic_keyword(category, text)
-    except ImportError:
-        # Fallback to original keyword-based detection
-        return _lf_offtopic_keyword_fallback(category, text)
+    # Fallback to original keyword-based detection
+    return _lf_offtopic_keyword_fallback(category, text, feats, rules)
 
-def _lf_offtopic_keyword_fallback(category, text):
+def _lf_offtopic_keyword_fallback(category, text, feats=None, rules=None):
     """Fallback keyword-based offtopic detection (original implementation)"""
     # Handle different category formats
     if category is not None:
@@ -96,37 +274,40 @@ def _lf_offtopic_keyword_fallback(category, text):
     # For non-food businesses: these might be off-topic
     
     # Check if any category is food-related
-    is_food_related = any(cat in FOOD_CATEGORIES for cat in categories)
+    food_categories = (rules or get_rules()).food_categories
+    is_food_related = any(cat in food_categories for cat in categories)
     
     if is_food_related:
         # For food-related businesses, use FOOD_OFFTOPIC_EN (excludes delivery-related terms)
-        if re.search(FOOD_OFFTOPIC_EN, text, re.I):
+        if _features(text, feats).hits("food_offtopic"):
             return (1, 0.75)
     else:
         # For non-food businesses, use GENERAL_OFFTOPIC_EN (includes delivery-related terms)
-        if re.search(GENERAL_OFFTOPIC_EN, text, re.I):
+        if _features(text, feats).hits("general_offtopic"):
             return (1, 0.75)
     
     return (-1, 0.0)
 
-def lf_format_noise(text):
+def lf_format_noise(text, feats=None, rules=None):
     """Detect format noise like excessive punctuation"""
     if not text: return (-1, 0.0)
-    non_alnum = sum(1 for c in text if not c.isalnum() and not c.isspace())
-    ratio = non_alnum / max(1, len(text))
+    feats = _features(text, feats)
+    rules = rules or get_rules()
+    ratio = feats.non_alnum_count / max(1, feats.len_char)
     # also catch stretched characters / repeated punctuation
-    if ratio > MAX_NON_ALNUM_RATIO or re.search(r"(.)\1{" + str(MAX_REPEATED_CHARS + 1) + r",}", text) or re.search(r"([!?])\1{" + str(MAX_REPEATED_PUNCTUATION + 1) + r",}", text):
+    if ratio > rules.max_non_alnum_ratio or feats.max_repeat_run >= rules.min_repeat_run or feats.max_punct_run >= rules.min_punct_run:
         return (1, 0.60)
     return (-1, 0.0)
 
-def lf_trust_signal(ent_count, has_promo_hit):
+def lf_trust_signal(ent_count, has_promo_hit, rules=None):
     """Detect trust signals (high entity count without promotional content)"""
-    if ent_count >= MIN_ENTITIES_FOR_TRUST and not has_promo_hit:
+    if ent_count >= (rules or get_rules()).min_entities_for_trust and not has_promo_hit:
         return (0, 0.70)
     return (-1, 0.0)
 
-def lf_rating_sentiment_conflict(rating, sent_pos, sent_neg, hi=0.9):
+def lf_rating_sentiment_conflict(rating, sent_pos, sent_neg, rules=None):
     """Detect conflicts between rating and sentiment"""
+    hi = (rules or get_rules()).sentiment_conflict_threshold
     if rating in (1,2) and sent_pos >= hi: return (1, 0.85)
     if rating in (4,5) and sent_neg >= hi: return (1, 0.85)
     return (-1, 0.0)
@@ -147,50 +328,42 @@ def lf_user_near_dupe(is_near_dupe):
     """Detect near-duplicate user reviews"""
     return (1, 0.95) if is_near_dupe else (-1, 0.0)
 
-def lf_suspicious_patterns(text):
+def lf_suspicious_patterns(text, feats=None, rules=None):
     """Detect suspicious patterns like excessive emojis, caps, or repetitive text"""
     if not text: return (-1, 0.0)
+    feats = _features(text, feats)
+    rules = rules or get_rules()
     
     # Excessive emojis
-    emoji_count = len(re.findall(r'[😀-🙿🌀-🗿🚀-🛿🦀-🧿]', text))
-    if emoji_count > MAX_EMOJIS:
+    if feats.emoji_count > rules.max_emojis:
         return (1, 0.75)
     
     # Excessive caps
-    caps_ratio = sum(1 for c in text if c.isupper()) / max(1, len(text))
-    if caps_ratio > MAX_CAPS_RATIO:
+    caps_ratio = feats.caps_count / max(1, feats.len_char)
+    if caps_ratio > rules.max_caps_ratio:
         return (1, 0.70)
     
     # Repetitive words
-    words = text.lower().split()
-    if len(words) > 3:
-        word_freq = {}
-        for word in words:
-            word_freq[word] = word_freq.get(word, 0) + 1
-        max_freq = max(word_freq.values())
-        if max_freq > len(words) * MAX_WORD_REPETITION_RATIO:
+    if feats.len_tok > 3:
+        if feats.max_word_freq > feats.len_tok * rules.max_word_repetition_ratio:
             return (1, 0.65)
     
     return (-1, 0.0)
 
-def lf_brand_mentioning(text):
+def lf_brand_mentioning(text, feats=None, rules=None):
     """Detect excessive brand/product mentioning"""
     if not text: return (-1, 0.0)
     
-    # Common brand indicators
-    brand_indicators = r'\b(brand|product|item|goods|merchandise|stock|inventory|supply|supplier|manufacturer|distributor|retailer|wholesaler|reseller|dealer|vendor|seller|buyer|customer|client|consumer|user|end user|target audience|market|marketplace|platform|website|app|application|software|tool|service|solution|package|bundle|offer|deal|promotion|campaign|marketing|advertising|publicity|exposure|visibility|reach|engagement|conversion|sales|revenue|profit|margin|commission|fee|charge|cost|price|value|worth|quality|standard|specification|requirement|feature|function|benefit|advantage|pro|con|pros|cons|positive|negative|good|bad|better|worse|best|worst|improve|enhance|upgrade|optimize|maximize|minimize|increase|decrease|reduce|boost)\b'
-    
-    matches = len(re.findall(brand_indicators, text, re.I))
-    if matches > MAX_BRAND_MENTIONS:
+    matches = _features(text, feats).hits("brand")
+    if matches > (rules or get_rules()).max_brand_mentions:
         return (1, 0.60)
     
     return (-1, 0.0)
 
-def lf_time_sensitive_content(text):
+def lf_time_sensitive_content(text, feats=None):
     """Detect time-sensitive promotional content"""
-    time_indicators = r'\b(limited time|flash sale|24 hours|48 hours|72 hours|weekend|today only|tonight only|this week|this month|this year|seasonal|holiday|christmas|black friday|cyber monday|boxing day|new year|valentine|easter|halloween|thanksgiving|independence day|memorial day|labor day|veterans day|presidents day|columbus day|martin luther king day|juneteenth|kwanzaa|ramadan|eid|diwali|hanukkah|passover|rosh hashanah|yom kippur|chinese new year|lunar new year|vietnamese new year|korean new year|japanese new year|thai new year|lao new year|cambodian new year|burmese new year|mongolian new year|tibetan new year|nepali new year|bangladeshi new year|sri lankan new year|pakistani new year|indian new year|afghan new year|iranian new year|iraqi new year|syrian new year|lebanese new year|jordanian new year|palestinian new year|israeli new year|egyptian new year|libyan new year|tunisian new year|algerian new year|moroccan new year|sudanese new year|ethiopian new year|somali new year|kenyan new year|ugandan new year|tanzanian new year|rwandan new year|burundian new year|central african new year|chadian new year|cameroonian new year|gabonese new year|congolese new year|equatorial guinean new year|sao tomean new year|angolan new year|zambian new year|zimbabwean new year|botswanan new year|namibian new year|south african new year|lesotho new year|swazi new year|mozambican new year|malawian new year)\b'
-    
-    if re.search(time_indicators, text, re.I):
+    if not text: return (-1, 0.0)
+    if _features(text, feats).hits("time_sensitive"):
         return (1, 0.80)
     
     return (-1, 0.0)
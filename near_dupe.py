@@ -0,0 +1,286 @@
+# near_dupe.py - 近重复评论检测：词 shingle + MinHash 签名 + LSH 分桶，找出复制粘贴式的刷评簇
+import argparse
+import os
+import re
+import time
+import zlib
+from array import array
+import numpy as np
+from tqdm import tqdm
+
+from behavior_features import hash64
+from json_codec import NEAR_DUPE_FIELDS, decode_fields
+from config import NEAR_DUPE_THRESHOLD, NEAR_DUPE_MIN_TOKENS
+
+TOKEN_RE = re.compile(r"\w+")
+# 小于 2^32 的最大素数，哈希值落在 uint32 范围内
+HASH_PRIME = np.uint64(4294967291)
+SIGNATURE_BATCH = 4096
+# 每次参与矩阵运算的 shingle 数上限，uint64 临时矩阵约为 SHINGLE_CHUNK × num_perm × 8 字节
+SHINGLE_CHUNK = 1 << 14
+
+
+def review_text(row):
+    """与 process_batch 相同的取文本规则"""
+    text = row.get('text', row.get('original_text', ''))
+    if not text:
+        text = row.get('processed_text', '')
+    return text if isinstance(text, str) else str(text)
+
+
+def review_key(row):
+    """评论的 64 位内容键：同一用户、商家、时间、文本即视为同一条，分片/多进程下同样可查"""
+    return hash64(f"{row.get('user_id', '')}\x1f{row.get('gmap_id', '')}\x1f{row.get('time', '')}\x1f"
+                  f"{review_text(row)}")
+
+
+def shingle_hashes(text, k=3, min_tokens=NEAR_DUPE_MIN_TOKENS):
+    """小写分词后取连续 k 词 shingle，返回去重后的 32 位哈希；词数不足 min_tokens 返回 None"""
+    tokens = TOKEN_RE.findall(text.lower()) if text else []
+    if len(tokens) < max(1, min_tokens):
+        return None
+    if len(tokens) < k:
+        return [zlib.crc32(" ".join(tokens).encode('utf-8'))]
+    return list({zlib.crc32(" ".join(tokens[i:i + k]).encode('utf-8')) for i in range(len(tokens) - k + 1)})
+
+
+class MinHasher:
+    """num_perm 个形如 (a·x + b) mod p 的随机哈希；一批文档的全部 shingle 一次矩阵运算完成"""
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = np.random.default_rng(seed)
+        # a < 2^31 且 x < 2^32，a·x + b 不会溢出 uint64
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signatures(self, shingle_lists):
+        """
+        shingle 哈希列表的列表 -> n×num_perm 的 uint32 签名矩阵（每个列表至少含一个 shingle）。
+        按 SHINGLE_CHUNK 分块计算，块内按文档 reduceat 取最小值后并入结果，跨块的文档取两块最小值。
+        """
+        n = len(shingle_lists)
+        lengths = np.fromiter((len(s) for s in shingle_lists), dtype=np.int64, count=n)
+        flat = np.fromiter((h for s in shingle_lists for h in s), dtype=np.uint64, count=int(lengths.sum()))
+        doc = np.repeat(np.arange(n), lengths)
+        # 哈希值都小于 HASH_PRIME < 2^32，可直接在 uint32 上累积最小值
+        out = np.full((n, self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        for lo in range(0, len(flat), SHINGLE_CHUNK):
+            hi = min(lo + SHINGLE_CHUNK, len(flat))
+            hashed = (flat[lo:hi, None] * self.a[None, :] + self.b[None, :]) % HASH_PRIME
+            d = doc[lo:hi]
+            starts = np.flatnonzero(np.concatenate([[True], d[1:] != d[:-1]]))
+            rows = d[starts]
+            out[rows] = np.minimum(out[rows], np.minimum.reduceat(hashed, starts, axis=0).astype(np.uint32))
+        return out
+
+
+def _band_keys(signatures, band, rows):
+    """把一个 band 的 rows 个 uint32 混合成一个 64 位桶键"""
+    cols = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+    key = np.zeros(len(signatures), dtype=np.uint64)
+    for j in range(cols.shape[1]):
+        key = (key ^ cols[:, j]) * np.uint64(0x100000001B3)  # FNV 风格，溢出即取模 2^64
+    return key
+
+
+def lsh_edges(signatures, bands=16, threshold=NEAR_DUPE_THRESHOLD):
+    """
+    每个 band 内按桶键排序，桶内每个成员只与桶首比较（而不是两两比较），
+    估计 Jaccard（签名相同位置占比）达到 threshold 的才连边。总代价 O(bands · N log N)。
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    src, dst = [], []
+    for band in range(bands):
+        key = _band_keys(signatures, band, rows)
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        starts = np.concatenate([[True], sorted_key[1:] != sorted_key[:-1]])
+        head = order[np.maximum.accumulate(np.where(starts, np.arange(n), 0))]
+        members = order[~starts]
+        heads = head[~starts]
+        if len(members) == 0:
+            continue
+        sim = (signatures[members] == signatures[heads]).mean(axis=1)
+        keep = sim >= threshold
+        src.append(members[keep])
+        dst.append(heads[keep])
+    if not src:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # 多个 band 命中的同一条边只保留一次；打包成单个 int64 去重远快于按行 unique
+    edges = np.unique(np.concatenate(src).astype(np.int64) * n + np.concatenate(dst))
+    return edges // n, edges % n
+
+
+def connected_components(n, src, dst):
+    """向量化的最小标签传播 + 指针跳跃，返回每个节点所在连通分量的最小节点下标"""
+    labels = np.arange(n, dtype=np.int64)
+    if len(src) == 0:
+        return labels
+    while True:
+        m = np.minimum(labels[src], labels[dst])
+        new = labels.copy()
+        np.minimum.at(new, src, m)
+        np.minimum.at(new, dst, m)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+class NearDupeIndex:
+    """
+    评论键(排序) -> 近重复簇信息。cluster_id 为簇内最早出现的评论在输入中的序号，非近重复为 -1；
+    same_user 表示簇内还有同一用户的其他评论，cross_user 表示簇跨越多个用户（疑似批量刷评）。
+    """
+
+    def __init__(self, keys, cluster_ids, cluster_sizes, same_user, cross_user):
+        self.keys = keys
+        self.cluster_ids = cluster_ids
+        self.cluster_sizes = cluster_sizes
+        self.same_user = same_user
+        self.cross_user = cross_user
+
+    # ------------------------------------------------------------------ 构建
+    @classmethod
+    def build(cls, input_path, threshold=NEAR_DUPE_THRESHOLD, min_tokens=NEAR_DUPE_MIN_TOKENS,
+              num_perm=64, bands=16, shingle_size=3, seed=1):
+        """流式扫描一遍 JSONL：只保留 64 位键、用户哈希和 MinHash 签名，不保留文本"""
+        if num_perm % bands:
+            raise ValueError(f"num_perm={num_perm} 必须能被 bands={bands} 整除")
+        hasher = MinHasher(num_perm, seed)
+        # 用紧凑的 C 数组累积，不为每条评论单独保存一个 Python int 对象
+        keys, users, sig_rows, sig_chunks = array('Q'), array('Q'), array('q'), []
+        pending, pending_rows = [], []
+        row_no = 0
+
+        def flush():
+            if pending:
+                sig_chunks.append(hasher.signatures(pending))
+                sig_rows.extend(pending_rows)
+                pending.clear()
+                pending_rows.clear()
+
+        with open(input_path, 'rb') as f, \
+             tqdm(total=os.path.getsize(input_path), unit='B', unit_scale=True, desc="近重复签名") as pbar:
+            for raw in f:
+                pbar.update(len(raw))
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    row = decode_fields(line, NEAR_DUPE_FIELDS)
+                except ValueError:
+                    continue
+                keys.append(review_key(row))
+                users.append(hash64(row.get('user_id', '')))
+                shingles = shingle_hashes(review_text(row), shingle_size, min_tokens)
+                if shingles is not None:
+                    pending.append(shingles)
+                    pending_rows.append(row_no)
+                    if len(pending) >= SIGNATURE_BATCH:
+                        flush()
+                row_no += 1
+        flush()
+
+        keys = np.frombuffer(keys, dtype=np.uint64)
+        users = np.frombuffer(users, dtype=np.uint64)
+        sig_rows = np.frombuffer(sig_rows, dtype=np.int64)
+        signatures = np.concatenate(sig_chunks) if sig_chunks else np.zeros((0, num_perm), dtype=np.uint32)
+        del sig_chunks
+        return cls.from_signatures(keys, users, sig_rows, signatures, threshold, bands)
+
+    @classmethod
+    def from_signatures(cls, keys, users, sig_rows, signatures, threshold=NEAR_DUPE_THRESHOLD, bands=16):
+        """keys/users 覆盖全部评论；sig_rows 为有签名的评论序号，与 signatures 逐行对应"""
+        n = len(keys)
+        src, dst = lsh_edges(signatures, bands, threshold)
+        # 签名矩阵的行号 -> 输入序号，连通分量的最小标签即簇内最早的评论
+        labels = np.arange(n, dtype=np.int64)
+        labels[sig_rows] = sig_rows[connected_components(len(sig_rows), src, dst)]
+
+        sizes = np.bincount(labels, minlength=n)
+        cluster_sizes = sizes[labels].astype(np.int32)
+        clustered = cluster_sizes > 1
+        cluster_ids = np.where(clustered, labels, -1)
+
+        # 同簇同用户的评论数 > 1 即 same_user；簇内不同用户数 > 1 即 cross_user（只需统计成簇的评论）
+        same_user = np.zeros(n, dtype=bool)
+        cross_user = np.zeros(n, dtype=bool)
+        idx = np.flatnonzero(clustered)
+        if len(idx):
+            _, uid = np.unique(users[idx], return_inverse=True)
+            pair = labels[idx] * (int(uid.max()) + 1) + uid.ravel()
+            uniq, inverse, counts = np.unique(pair, return_inverse=True, return_counts=True)
+            same_user[idx] = counts[inverse.ravel()] > 1
+            users_per_cluster = np.bincount(uniq // (int(uid.max()) + 1), minlength=n)
+            cross_user[idx] = users_per_cluster[labels[idx]] > 1
+
+        order = np.argsort(keys, kind='stable')
+        return cls(keys[order], cluster_ids[order], cluster_sizes[order], same_user[order], cross_user[order])
+
+    # ------------------------------------------------------------------ 持久化
+    def save(self, path):
+        # 与 BehaviorIndex.save 相同，经文件句柄写入以免路径被补上 .npz 后缀
+        with open(path, 'wb') as f:
+            np.savez(f, keys=self.keys, cluster_ids=self.cluster_ids, cluster_sizes=self.cluster_sizes,
+                     same_user=self.same_user, cross_user=self.cross_user)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        return cls(data['keys'], data['cluster_ids'], data['cluster_sizes'], data['same_user'], data['cross_user'])
+
+    # ------------------------------------------------------------------ 回连
+    def lookup(self, rows):
+        """为一批行返回 is_near_dupe / cluster_id / same_user / cross_user 数组；索引中不存在的行视为非重复"""
+        keys = np.fromiter((review_key(row) for row in rows), dtype=np.uint64, count=len(rows))
+        if len(self.keys) == 0:
+            none = np.zeros(len(keys), dtype=bool)
+            return {'is_near_dupe': none, 'cluster_id': np.full(len(keys), -1, dtype=np.int64),
+                    'same_user': none, 'cross_user': none}
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        cluster_ids = np.where(found, self.cluster_ids[pos], -1)
+        return {
+            'is_near_dupe': cluster_ids >= 0,
+            'cluster_id': cluster_ids,
+            'same_user': found & self.same_user[pos],
+            'cross_user': found & self.cross_user[pos],
+        }
+
+
+_INDEX_CACHE = {}
+
+def get_near_dupe_index(path):
+    """按路径缓存已加载的索引，工作进程内每个批次不会重复读盘"""
+    index = _INDEX_CACHE.get(path)
+    if index is None:
+        index = _INDEX_CACHE[path] = NearDupeIndex.load(path)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MinHash/LSH 近重复评论检测，输出可回连到标注流程的簇索引")
+    parser.add_argument("--input", dest="input_path", required=True)
+    parser.add_argument("--output", dest="output_path", default="near_dupe_index.npz")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPE_THRESHOLD, help="估计 Jaccard 相似度阈值")
+    parser.add_argument("--min-tokens", dest="min_tokens", type=int, default=NEAR_DUPE_MIN_TOKENS,
+                        help="词数少于该值的评论不参与（过短的通用好评不算刷评）")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    index = NearDupeIndex.build(args.input_path, threshold=args.threshold, min_tokens=args.min_tokens)
+    index.save(args.output_path)
+
+    clustered = index.cluster_ids >= 0
+    print(f"📈 评论数: {len(index.keys):,}")
+    print(f"🔁 近重复评论: {int(clustered.sum()):,}  簇数: {len(np.unique(index.cluster_ids[clustered])):,}")
+    print(f"👤 同用户重复: {int(index.same_user.sum()):,}  👥 跨用户重复: {int(index.cross_user.sum()):,}")
+    print(f"⏱️ 耗时: {time.time() - start_time:.2f} 秒")
+    print(f"✅ 索引已保存到: {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# predict_roberta.py - 微调后 RoBERTa 分类器的 CPU 批量推理：模型只加载一次，可导出 ONNX / 动态 int8 量化，按长度排序后动态补齐
+import argparse
+import os
+import time
+import numpy as np
+from tqdm import tqdm
+from transformers import RobertaTokenizerFast
+
+import json_codec
+
+try:
+    import onnxruntime as ort
+except ImportError:  # 可选：--backend onnx 时需要
+    ort = None
+
+MODEL_DIR = "./roberta_bot_classifier_weighted"  # classifier_roBERTa.py 的输出目录
+MAX_LEN = 128       # 与训练时的截断长度一致
+BATCH_SIZE = 64     # 每次前向的评论数；输入已按长度排序，批内几乎没有补齐
+CHUNK_ROWS = 20000  # 每读入这么多行排序、打分、写出一次，内存与输入大小无关
+ONNX_OPSET = 14
+
+
+def clean_texts(texts):
+    return ["" if x is None or str(x) == "nan" else str(x) for x in texts]
+
+
+def pad_batch(seqs, pad_id):
+    """把一批变长 token 序列补齐到批内最大长度，返回 int64 的 (input_ids, attention_mask)"""
+    width = max(1, max(len(ids) for ids in seqs))
+    input_ids = np.full((len(seqs), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(seqs), width), dtype=np.int64)
+    for i, ids in enumerate(seqs):
+        input_ids[i, :len(ids)] = ids
+        attention_mask[i, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def softmax_positive(logits):
+    """二分类 logits -> 正类（机器人/不可信，label=1）概率"""
+    logits = np.asarray(logits, dtype=np.float64)
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp[:, 1] / exp.sum(axis=1)
+
+
+def _weights_mtime(model_dir):
+    """模型目录中文件的最新修改时间；重新训练保存后，旧的 ONNX 导出会被重新生成"""
+    mtimes = [entry.stat().st_mtime_ns for entry in os.scandir(model_dir) if entry.is_file()]
+    return max(mtimes) if mtimes else 0
+
+
+class RobertaScorer:
+    """
+    加载 classifier_roBERTa.py 保存的模型，对文本列表批量打分。
+    backend='torch' 用 PyTorch eager 推理，quantize=True 时对全部 Linear 层做动态 int8 量化；
+    backend='onnx' 首次使用时把模型导出到 <model_dir>/onnx/（quantize=True 时再生成 int8 版本），之后直接由
+    onnxruntime 加载，不再需要 PyTorch。threads 为算子内线程数，None 时使用库的默认值。
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, backend='torch', quantize=False, threads=None,
+                 max_len=MAX_LEN, batch_size=BATCH_SIZE):
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f"未知的推理后端: {backend}")
+        if backend == 'onnx' and ort is None:
+            raise ImportError("--backend onnx 需要安装 onnxruntime")
+        if not os.path.isdir(model_dir):
+            raise FileNotFoundError(f"模型目录不存在: {model_dir}（先运行 classifier_roBERTa.py）")
+        self.model_dir = model_dir
+        self.backend = backend
+        self.quantize = quantize
+        self.threads = threads
+        self.max_len = max_len
+        self.batch_size = batch_size
+        self.tokenizer = RobertaTokenizerFast.from_pretrained(model_dir)
+        self.pad_id = self.tokenizer.pad_token_id
+        self.model = None
+        self.session = None
+        if backend == 'torch':
+            self._load_torch()
+        else:
+            self._load_onnx()
+
+    def _load_torch_model(self):
+        import torch
+        from transformers import RobertaForSequenceClassification
+        model = RobertaForSequenceClassification.from_pretrained(self.model_dir)
+        model.eval()
+        return torch, model
+
+    def _load_torch(self):
+        torch, model = self._load_torch_model()
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        print(f"🧠 已加载 PyTorch 模型 ({'int8 动态量化' if self.quantize else 'fp32'}, "
+              f"{torch.get_num_threads()} 线程)")
+
+    def _export_onnx(self, path):
+        torch, model = self._load_torch_model()
+        print(f"📦 导出 ONNX 模型: {path}")
+        dummy = self.tokenizer(["placeholder"], return_tensors="pt")
+        tmp_path = path + '.tmp'
+        with torch.no_grad():
+            torch.onnx.export(model, (dummy["input_ids"], dummy["attention_mask"]), tmp_path,
+                              input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                              dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                            "attention_mask": {0: "batch", 1: "sequence"},
+                                            "logits": {0: "batch"}},
+                              opset_version=ONNX_OPSET)
+        os.replace(tmp_path, path)
+
+    def _onnx_path(self):
+        """返回可用的 ONNX 文件路径，缺失或早于模型权重时重新导出/量化"""
+        onnx_dir = os.path.join(self.model_dir, 'onnx')
+        os.makedirs(onnx_dir, exist_ok=True)
+        weights_mtime = _weights_mtime(self.model_dir)
+        fp32_path = os.path.join(onnx_dir, 'model.onnx')
+
+        def stale(path):
+            return not os.path.exists(path) or os.stat(path).st_mtime_ns < weights_mtime
+
+        if stale(fp32_path):
+            self._export_onnx(fp32_path)
+        if not self.quantize:
+            return fp32_path
+        int8_path = os.path.join(onnx_dir, 'model.int8.onnx')
+        if stale(int8_path) or os.stat(int8_path).st_mtime_ns < os.stat(fp32_path).st_mtime_ns:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print(f"📦 生成 int8 动态量化模型: {int8_path}")
+            tmp_path = int8_path + '.tmp'
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        return int8_path
+
+    def _load_onnx(self):
+        path = self._onnx_path()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        print(f"🧠 已加载 ONNX 模型: {path}")
+
+    def _forward(self, input_ids, attention_mask):
+        if self.session is not None:
+            return self.session.run(["logits"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        import torch
+        with torch.inference_mode():
+            return self.model(input_ids=torch.from_numpy(input_ids),
+                              attention_mask=torch.from_numpy(attention_mask)).logits.numpy()
+
+    def predict_proba(self, texts):
+        """
+        返回每条文本为正类（label=1）的概率，顺序与输入一致。
+        整批文本一次性分词（不补齐），按 token 数排序后切成 batch_size 的批，每批只补齐到批内最长。
+        """
+        texts = clean_texts(texts)
+        probs = np.empty(len(texts), dtype=np.float32)
+        if not texts:
+            return probs
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_len, padding=False)['input_ids']
+        lengths = np.fromiter((len(ids) for ids in encoded), dtype=np.int64, count=len(encoded))
+        order = np.argsort(lengths, kind='stable')
+        for k in range(0, len(order), self.batch_size):
+            idx = order[k:k + self.batch_size]
+            input_ids, attention_mask = pad_batch([encoded[i] for i in idx], self.pad_id)
+            probs[idx] = softmax_positive(self._forward(input_ids, attention_mask))
+        return probs
+
+
+def read_chunks(input_path, chunk_rows, pbar=None):
+    """按行读取 JSONL，产出 ([行, ...], 本块跳过的无效行数)；无法解析或不是对象的行跳过"""
+    chunk = []
+    invalid = 0
+    with open(input_path, 'rb') as f:
+        for raw in f:
+            if pbar is not None:
+                pbar.update(len(raw))
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                row = json_codec.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                invalid += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield chunk, invalid
+                chunk = []
+                invalid = 0
+    if chunk or invalid:
+        yield chunk, invalid
+
+
+def score_jsonl(scorer, input_path, output_path, chunk_rows=CHUNK_ROWS, text_field='text', threshold=0.5):
+    """
+    流式打分：每行原样输出并附加 roberta_prob（正类概率）与 roberta_label（概率 >= threshold 为 1）。
+    返回 {'rows', 'invalid', 'positive'}
+    """
+    stats = {'rows': 0, 'invalid': 0, 'positive': 0}
+    with open(output_path, 'w', encoding='utf-8', newline='\n') as out, \
+            tqdm(total=os.path.getsize(input_path), unit='B', unit_scale=True, desc="推理进度") as pbar:
+        for rows, invalid in read_chunks(input_path, chunk_rows, pbar):
+            stats['invalid'] += invalid
+            probs = scorer.predict_proba([row.get(text_field) for row in rows])
+            for row, prob in zip(rows, probs.tolist()):
+                row['roberta_prob'] = round(prob, 6)
+                row['roberta_label'] = int(prob >= threshold)
+                stats['positive'] += row['roberta_label']
+                out.write(json_codec.dumps(row) + '\n')
+            stats['rows'] += len(rows)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用微调后的 RoBERTa 分类器对 JSONL 评论批量打分（CPU）")
+    parser.add_argument("--input", dest="input_path", required=True, help="待打分的 JSONL 评论文件")
+    parser.add_argument("--output", dest="output_path", default="roberta_predictions.jsonl",
+                        help="输出 JSONL：原始字段 + roberta_prob + roberta_label")
+    parser.add_argument("--model-dir", dest="model_dir", default=MODEL_DIR)
+    parser.add_argument("--backend", choices=("torch", "onnx"), default="torch",
+                        help="onnx 首次运行时导出到 <model-dir>/onnx/，需要 onnxruntime")
+    parser.add_argument("--quantize", action="store_true", help="动态 int8 量化（Linear 层权重）")
+    parser.add_argument("--threads", type=int, default=None, help="算子内线程数（默认由推理库决定）")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--chunk-rows", dest="chunk_rows", type=int, default=CHUNK_ROWS,
+                        help="每次读入、按长度排序的行数")
+    parser.add_argument("--max-len", dest="max_len", type=int, default=MAX_LEN)
+    parser.add_argument("--text-field", dest="text_field", default="text")
+    parser.add_argument("--threshold", type=float, default=0.5, help="roberta_label 的概率阈值")
+    args = parser.parse_args()
+
+    print("🚀 开始 RoBERTa 批量推理")
+    print("=" * 80)
+    if not os.path.exists(args.input_path):
+        print(f"❌ 输入文件不存在: {args.input_path}")
+        return
+    if not os.path.isdir(args.model_dir):
+        print(f"❌ 模型目录不存在: {args.model_dir}（先运行 classifier_roBERTa.py）")
+        return
+    if args.backend == 'onnx' and ort is None:
+        print("❌ --backend onnx 需要安装 onnxruntime")
+        return
+
+    start_time = time.time()
+    scorer = RobertaScorer(args.model_dir, backend=args.backend, quantize=args.quantize, threads=args.threads,
+                           max_len=args.max_len, batch_size=args.batch_size)
+    load_time = time.time() - start_time
+    stats = score_jsonl(scorer, args.input_path, args.output_path, chunk_rows=args.chunk_rows,
+                        text_field=args.text_field, threshold=args.threshold)
+
+    total_time = time.time() - start_time
+    print(f"📈 打分行数: {stats['rows']:,}  (无法解析: {stats['invalid']:,})")
+    print(f"🤖 roberta_label=1: {stats['positive']:,} ({stats['positive']/max(stats['rows'], 1)*100:.1f}%)")
+    print(f"✅ 结果已保存到 {args.output_path}")
+    print(f"\n⏱️ 总耗时: {total_time:.2f} 秒（加载模型 {load_time:.2f} 秒）")
+    print(f"🚀 推理速度: {stats['rows']/max(total_time - load_time, 1e-9):.0f} 条/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,165 @@
 ﻿import argparse
-import json
+import io
+import os
 import re
-from typing import Tuple
+import shutil
+import tempfile
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+
+import json_codec
 
 URL_PATTERN = re.compile(r"(?i)\b((?:https?:\/\/|www\.)[^\s\"\)\]]+)")
 PHONE_CANDIDATE = re.compile(r"(?<![A-Za-z0-9])(\+?\d[\d\s\-\.\(\)]{6,}?\d)(?![A-Za-z0-9])")
 EMAIL_PATTERN = re.compile(r"(?i)\b[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}\b")
 
-def replace_phones_strict(text: str) -> Tuple[str, bool]:
-    replaced = False
+# Email and URL in one scan. Email is tried first at each position, which gives the same result as
+# running EMAIL_PATTERN and then URL_PATTERN: an email inside a URL ends up inside "<url>" either way,
+# and a URL cannot start right after an email because an email always ends before a non-word char.
+EMAIL_URL_PATTERN = re.compile(
+    r"(?i)(?P<email>\b[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}\b)|(?P<url>\b(?:https?:\/\/|www\.)[^\s\"\)\]]+)")
+WWW_HINT = re.compile(r"(?i)www\.")
+ASCII_DIGITS = "0123456789"
+MIN_PHONE_DIGITS = 8
+
+def count_digits(text: str) -> int:
+    return sum(map(text.count, ASCII_DIGITS))
+
+def replace_phones_counted(text: str) -> Tuple[str, int]:
+    replaced = 0
     def _sub(m: re.Match) -> str:
         nonlocal replaced
         val = m.group(0)
-        digits = len(re.sub(r"[^0-9]", "", val))
-        if 8 <= digits <= 15:
-            replaced = True
+        digits = count_digits(val)
+        if MIN_PHONE_DIGITS <= digits <= 15:
+            replaced += 1
             return "<phone>"
         return val
     out = PHONE_CANDIDATE.sub(_sub, text)
     return out, replaced
 
+def replace_phones_strict(text: str) -> Tuple[str, bool]:
+    out, replaced = replace_phones_counted(text)
+    return out, replaced > 0
+
+def redact_text_counts(text: str) -> Tuple[str, Dict[str, int]]:
+    """Redact like redact_text and also return how many emails, urls and phones were replaced."""
+    counts = {"email": 0, "url": 0, "phone": 0}
+    if not isinstance(text, str):
+        return text, counts
+    # redact emails and urls; skipped when the text has no "@", "://" or "www."
+    if "@" in text or "://" in text or WWW_HINT.search(text):
+        def _sub(m: re.Match) -> str:
+            counts[m.lastgroup] += 1
+            return "<email>" if m.lastgroup == "email" else "<url>"
+        text = EMAIL_URL_PATTERN.sub(_sub, text)
+    # redact phones (strict digit counting); skipped when the whole text has too few digits
+    if count_digits(text) >= MIN_PHONE_DIGITS:
+        text, counts["phone"] = replace_phones_counted(text)
+    return text, counts
+
 def redact_text(text: str) -> Tuple[str, bool]:
     if not isinstance(text, str):
         return text, False
-    changed = False
-    # redact emails
-    new_text, email_count = EMAIL_PATTERN.subn("<email>", text)
-    if email_count:
-        changed = True
-    # redact urls
-    new_text2, url_count = URL_PATTERN.subn("<url>", new_text)
-    if url_count:
-        changed = True
-    # redact phones (strict digit counting)
-    new_text3, phone_changed = replace_phones_strict(new_text2)
-    if phone_changed:
-        changed = True
-    return new_text3, changed
+    new_text, counts = redact_text_counts(text)
+    return new_text, any(counts.values())
 
-def process_file(input_path: str, output_path: str, modified_rows_path: str) -> int:
+def redact_lines(fin, fout, fmod, emit_flags: bool = False) -> int:
+    """
+    Redact each JSONL line. With emit_flags, modified rows also get a "pii" field holding the
+    per-type replacement counts, so the labeling stage can read has_url/has_phone without rescanning.
+    """
     modified = 0
+    for line in fin:
+        line = line.rstrip("\n\r")
+        out_line = line
+        try:
+            obj = json_codec.loads(line)
+            if "text" in obj and obj["text"] is not None:
+                new_text, counts = redact_text_counts(obj["text"])
+                if any(counts.values()):
+                    obj["text"] = new_text
+                    if emit_flags:
+                        obj["pii"] = counts
+                    out_line = json_codec.dumps(obj, compact=True)
+                    fmod.write(out_line + "\n")
+                    modified += 1
+        except Exception:
+            pass
+        fout.write(out_line + "\n")
+    return modified
+
+def split_shards(input_path: str, num_shards: int) -> List[Tuple[int, int]]:
+    """Split the file into byte ranges whose boundaries fall right after a newline."""
+    file_size = os.path.getsize(input_path)
+    bounds = [0]
+    with open(input_path, "rb") as f:
+        for k in range(1, num_shards):
+            pos = max(file_size * k // num_shards, bounds[-1])
+            f.seek(pos)
+            if pos > 0:
+                f.readline()
+            bounds.append(min(f.tell(), file_size))
+    bounds.append(file_size)
+    return [(s, e) for s, e in zip(bounds, bounds[1:]) if e > s]
+
+def process_shard(task: Tuple[str, int, int, str, bool]) -> Tuple[str, str, int]:
+    """Redact one byte range into its own output/modified files; returns their paths and the modified count."""
+    input_path, start, end, shard_prefix, emit_flags = task
+    with open(input_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    out_path = shard_prefix + ".out"
+    mod_path = shard_prefix + ".mod"
+    # newline=None gives the same universal-newline line splitting as reading the file in text mode
+    with io.StringIO(data.decode("utf-8"), newline=None) as fin, \
+         open(out_path, "w", encoding="utf-8", newline="\n") as fout, \
+         open(mod_path, "w", encoding="utf-8", newline="\n") as fmod:
+        modified = redact_lines(fin, fout, fmod, emit_flags)
+    return out_path, mod_path, modified
+
+def process_file_parallel(input_path: str, output_path: str, modified_rows_path: str, workers: int,
+                          shard_bytes: int = 32 * 1024 * 1024, emit_flags: bool = False) -> int:
+    """Redact line-aligned byte shards in a process pool and concatenate the results in input order."""
+    num_shards = max(workers, -(-os.path.getsize(input_path) // shard_bytes))
+    shards = split_shards(input_path, num_shards)
+    tmp_dir = tempfile.mkdtemp(prefix="redact_", dir=os.path.dirname(os.path.abspath(output_path)))
+    tasks = [(input_path, s, e, os.path.join(tmp_dir, f"shard{i:05d}"), emit_flags) for i, (s, e) in enumerate(shards)]
+    modified = 0
+    try:
+        with Pool(processes=workers) as pool, \
+             open(output_path, "wb") as fout, \
+             open(modified_rows_path, "wb") as fmod:
+            # imap returns shards in order, so each one can be appended and deleted as soon as it is done
+            for out_path, mod_path, count in pool.imap(process_shard, tasks):
+                for src, dst in ((out_path, fout), (mod_path, fmod)):
+                    with open(src, "rb") as f:
+                        shutil.copyfileobj(f, dst, 1024 * 1024)
+                    os.remove(src)
+                modified += count
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return modified
+
+def process_file(input_path: str, output_path: str, modified_rows_path: str, workers: int = 1,
+                 emit_flags: bool = False) -> int:
+    if workers > 1:
+        return process_file_parallel(input_path, output_path, modified_rows_path, workers, emit_flags=emit_flags)
     with open(input_path, "r", encoding="utf-8") as fin, \
          open(output_path, "w", encoding="utf-8", newline="\n") as fout, \
          open(modified_rows_path, "w", encoding="utf-8", newline="\n") as fmod:
-        for line in fin:
-            line = line.rstrip("\n\r")
-            out_line = line
-            try:
-                obj = json.loads(line)
-                if "text" in obj and obj["text"] is not None:
-                    new_text, changed = redact_text(obj["text"])
-                    if changed:
-                        obj["text"] = new_text
-                        out_line = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
-                        fmod.write(out_line + "\n")
-                        modified += 1
-            except Exception:
-                pass
-            fout.write(out_line + "\n")
-    return modified
+        return redact_lines(fin, fout, fmod, emit_flags)
 
 def main():
     parser = argparse.ArgumentParser(description="Redact emails, URLs, and phone numbers in JSONL text field.")
     parser.add_argument("--input", dest="input_path", default="review-Alaska_10.filtered.json")
     parser.add_argument("--output", dest="output_path", default="review-Alaska_10.filtered.redacted.strict.json")
     parser.add_argument("--modified", dest="modified_rows_path", default="review-Alaska_10.filtered.modified_rows.strict.json")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes; >1 shards the input by byte offset.")
+    parser.add_argument("--emit-flags", dest="emit_flags", action="store_true",
+                        help="Add a \"pii\" field with email/url/phone counts to modified rows (read by run_full_labeling.py).")
     args = parser.parse_args()
-    modified = process_file(args.input_path, args.output_path, args.modified_rows_path)
+    modified = process_file(args.input_path, args.output_path, args.modified_rows_path, args.workers, args.emit_flags)
     print(f"modified_rows_strict={modified}")
 
 if __name__ == "__main__":
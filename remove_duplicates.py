@@ -2,11 +2,23 @@
 # -*- coding: utf-8 -*-
 """
 Remove duplicate comments based on (user_id, gmap_id, text) combination.
+
+JSONL input is deduplicated in a single streaming pass: each review is keyed by a
+128-bit digest of the combination, survivors are written immediately, and the seen-set
+is kept as sorted digest runs (16 bytes per unique review) that can spill to disk.
 """
 
+import argparse
+import hashlib
 import json
-import sys
-from collections import OrderedDict
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import json_codec
+
+CHUNK_LINES = 1 << 16
 
 def detect_file_format(file_path):
 
@@ -15,13 +27,12 @@ def detect_file_format(file_path):
             first_line = f.readline().strip()
             if not first_line:
                 return 'json'
-            
+
 
             try:
                 json.loads(first_line)
-                f.seek(0)
-                lines = f.readlines()
-                if len(lines) > 1:
+                # 只需知道是否还有第二行，不必读入整个文件
+                if f.readline():
                     return 'jsonl'
                 else:
                     # 单行JSON
@@ -31,72 +42,205 @@ def detect_file_format(file_path):
     except Exception:
         return 'json'
 
-def remove_duplicates(input_file, output_file):
+def combination_digest(item):
+    """128-bit digest of (user_id, gmap_id, text); repr keeps None and 'None' distinct like the old tuple keys"""
+    combination = (item.get('user_id', ''), item.get('gmap_id', ''), item.get('text', ''))
+    payload = repr(combination).encode('utf-8', 'surrogatepass')
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+def split_digests(digests):
+    """list of 16-byte digests -> (hi, lo) uint64 arrays"""
+    words = np.frombuffer(b''.join(digests), dtype='>u8').reshape(-1, 2)
+    return words[:, 0].copy(), words[:, 1].copy()
+
+def first_occurrences(hi, lo):
+    """Mask of rows whose digest has not appeared earlier in the same chunk"""
+    order = np.lexsort((np.arange(len(hi)), lo, hi))
+    sh, sl = hi[order], lo[order]
+    first = np.ones(len(hi), dtype=bool)
+    first[1:] = (sh[1:] != sh[:-1]) | (sl[1:] != sl[:-1])
+    mask = np.zeros(len(hi), dtype=bool)
+    mask[order[first]] = True
+    return mask
+
+class DigestSet:
+    """
+    Seen-set of 128-bit digests stored as sorted (hi, lo) runs, LSM style: new runs are
+    merged with smaller in-memory runs, and once a run exceeds memory_budget bytes it is
+    written to spill_dir and searched through a read-only memmap.
+    """
+
+    def __init__(self, memory_budget=None, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._tmpdir = None
+        self.memory_runs = []
+        self.disk_runs = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _run_contains(run, hi, lo):
+        run_hi, run_lo = run
+        left = np.searchsorted(run_hi, hi, side='left')
+        right = np.searchsorted(run_hi, hi, side='right')
+        found = np.zeros(len(hi), dtype=bool)
+        single = right - left == 1
+        found[single] = run_lo[left[single]] == lo[single]
+        # 高 64 位相同的极少数情况逐个比较低 64 位
+        for i in np.flatnonzero(right - left > 1):
+            found[i] = bool((run_lo[left[i]:right[i]] == lo[i]).any())
+        return found
+
+    def contains(self, hi, lo):
+        found = np.zeros(len(hi), dtype=bool)
+        for run in self.disk_runs + self.memory_runs:
+            pending = ~found
+            if pending.any():
+                found[pending] = self._run_contains(run, hi[pending], lo[pending])
+        return found
+
+    def add(self, hi, lo):
+        """Add digests that are known to be new and unique"""
+        if len(hi) == 0:
+            return
+        order = np.lexsort((lo, hi))
+        run = (hi[order], lo[order])
+        while self.memory_runs and len(self.memory_runs[-1][0]) <= len(run[0]):
+            prev_hi, prev_lo = self.memory_runs.pop()
+            merged_hi = np.concatenate([prev_hi, run[0]])
+            merged_lo = np.concatenate([prev_lo, run[1]])
+            order = np.lexsort((merged_lo, merged_hi))
+            run = (merged_hi[order], merged_lo[order])
+        if self.memory_budget is not None and len(run[0]) * 16 > self.memory_budget:
+            self.disk_runs.append(self._spill(run))
+        else:
+            self.memory_runs.append(run)
+        self.size += len(hi)
+
+    def _spill(self, run):
+        if self._tmpdir is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self._tmpdir = tempfile.mkdtemp(prefix='dedup_', dir=self.spill_dir)
+        base = os.path.join(self._tmpdir, f'run{len(self.disk_runs)}')
+        np.save(base + '_hi.npy', run[0])
+        np.save(base + '_lo.npy', run[1])
+        return (np.load(base + '_hi.npy', mmap_mode='r'), np.load(base + '_lo.npy', mmap_mode='r'))
+
+    def close(self):
+        self.disk_runs = []
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+def remove_duplicates_streaming(input_file, output_file, memory_budget=None, spill_dir=None):
+    """Single pass over JSONL: survivors are written in input order as soon as their chunk is checked"""
+    seen = DigestSet(memory_budget, spill_dir)
+    total = 0
+    duplicate_count = 0
+
+    def flush(items, digests, out):
+        nonlocal duplicate_count
+        hi, lo = split_digests(digests)
+        keep = first_occurrences(hi, lo)
+        keep[keep] = ~seen.contains(hi[keep], lo[keep])
+        seen.add(hi[keep], lo[keep])
+        for item, k in zip(items, keep):
+            if k:
+                out.write(json_codec.dumps(item) + '\n')
+        duplicate_count += len(items) - int(keep.sum())
+
+    try:
+        with open(input_file, 'r', encoding='utf-8') as f, open(output_file, 'w', encoding='utf-8') as out:
+            items, digests = [], []
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json_codec.loads(line)
+                except json.JSONDecodeError as e:
+                    print(e)
+                    continue
+                items.append(item)
+                digests.append(combination_digest(item))
+                total += 1
+                if len(items) >= CHUNK_LINES:
+                    flush(items, digests, out)
+                    items, digests = [], []
+            if items:
+                flush(items, digests, out)
+    except FileNotFoundError:
+        print(f" {input_file} does nnot exist.")
+        return
+    except Exception as e:
+        print(e)
+        return
+    finally:
+        seen.close()
+
+    print(f"{total - duplicate_count}/{total} kept, {duplicate_count} duplicates removed")
+
+def remove_duplicates(input_file, output_file, memory_budget=None, spill_dir=None):
 
     file_format = detect_file_format(input_file)
-    
+    if file_format == 'jsonl':
+        remove_duplicates_streaming(input_file, output_file, memory_budget, spill_dir)
+        return
+
     try:
         with open(input_file, 'r', encoding='utf-8') as f:
-            if file_format == 'jsonl':
-                data = []
-                for line_num, line in enumerate(f, 1):
-                    line = line.strip()
-                    if line:
-                        try:
-                            data.append(json.loads(line))
-                        except json.JSONDecodeError as e:
-                            print(e)
-                            continue
-            else:
-                data = json.load(f)
+            data = json.load(f)
     except FileNotFoundError:
         print(f" {input_file} does nnot exist.")
         return
     except Exception as e:
         print(f"Fail to read: {e}")
         return
-    
-    seen_combinations = OrderedDict()
+
+    seen_digests = set()
     unique_data = []
     duplicate_count = 0
-    
+
     for item in data:
-        user_id = item.get('user_id', '')
-        gmap_id = item.get('gmap_id', '')
-        text = item.get('text', '')
-        
+        digest = combination_digest(item)
 
-        combination = (user_id, gmap_id, text)
-        
-        if combination not in seen_combinations:
+        if digest not in seen_digests:
 
-            seen_combinations[combination] = True
+            seen_digests.add(digest)
             unique_data.append(item)
         else:
             duplicate_count += 1
 
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
-            if file_format == 'jsonl' or output_file.endswith('.jsonl'):
+            if output_file.endswith('.jsonl'):
                 for item in unique_data:
                     f.write(json.dumps(item, ensure_ascii=False) + '\n')
             else:
                 json.dump(unique_data, f, ensure_ascii=False, indent=2)
-              
+
     except Exception as e:
         print(e)
         return
-    
+
 
 def main():
 
-    if len(sys.argv) != 3:
-        sys.exit(1)
-    
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    
-    remove_duplicates(input_file, output_file)
+    parser = argparse.ArgumentParser(description="Remove duplicate comments based on (user_id, gmap_id, text)")
+    parser.add_argument("input_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--memory-mb", dest="memory_mb", type=float, default=None,
+                        help="spill seen-digest runs larger than this to disk (JSONL input only)")
+    parser.add_argument("--spill-dir", dest="spill_dir", default=None,
+                        help="directory for spilled digest runs (default: system temp dir)")
+    args = parser.parse_args()
+
+    memory_budget = int(args.memory_mb * 1024 * 1024) if args.memory_mb is not None else None
+    remove_duplicates(args.input_file, args.output_file, memory_budget, args.spill_dir)
 
 if __name__ == "__main__":
     main()
@@ -1,205 +1,522 @@
 # run_full_labeling.py - 对整个数据集进行标签
 import sys
 import os
-import json
+import argparse
+import numpy as np
 import pandas as pd
 import time
+from multiprocessing import Pool
 from tqdm import tqdm
+from label_sink import SummaryAccumulator, LabelCheckpoint, open_result_sink, resume_state_valid
+from behavior_features import BehaviorIndex, get_behavior_index
+from near_dupe import NearDupeIndex, get_near_dupe_index
+from json_codec import LABEL_FIELDS, decode_fields
+from label_cache import check_label_cache, get_label_cache, row_digest
 
 # 添加当前目录到路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-def load_and_process_data(input_path, batch_size=1000):
-    """分批加载和处理数据"""
+from lf_rules import (
+    lf_promo_has_link, lf_too_short, lf_template_low_entities,
+    lf_entity_sparse, lf_offtopic, lf_format_noise, lf_trust_signal,
+    lf_rating_sentiment_conflict, lf_suspicious_patterns,
+    lf_brand_mentioning, lf_time_sensitive_content, TextFeatures, get_rules, reload_rules_if_changed,
+    lf_user_burst, lf_user_extreme_hist, lf_biz_burst, lf_user_near_dupe, pii_flags
+)
+from lf_aggregate import aggregate_lfs_batch, lf_outputs_to_matrix, final_labels
+from label_profiler import LabelProfiler
+
+def load_and_process_data(input_path, batch_size=1000, sink=None, behavior_path=None, near_dupe_path=None,
+                          start_offset=0, start_rows=0, checkpoint=None, cache_path=None, profiler=None,
+                          watch_config=False):
+    """
+    分批加载和处理数据；传入 sink 时每批结果立即写出，不在内存中累积。
+    start_offset/start_rows 用于从检查点续跑：从该字节偏移（行首）开始读，comment_id 接着已处理条数编号；
+    传入 checkpoint 时每批写出后上报进度。cache_path 指定增量标注缓存，未变化的评论直接复用旧结果。
+    传入 LabelProfiler 时记录各标签函数和解析/聚合/输出等阶段的耗时。
+    watch_config=True 时每批开始前检查 config.py，有变化就换用新规则处理后续批次。
+    """
+    labeler = get_labeler()
+    behavior = get_behavior_index(behavior_path) if behavior_path else None
+    near_dupes = get_near_dupe_index(near_dupe_path) if near_dupe_path else None
+    cache = get_label_cache(cache_path) if cache_path else None
     print(f"📁 开始处理文件: {input_path}")
     print(f"📊 批处理大小: {batch_size}")
     
-    # 统计总行数
-    print("🔍 统计文件总行数...")
-    total_lines = 0
-    with open(input_path, 'r', encoding='utf-8') as f:
-        for _ in f:
-            total_lines += 1
-    
-    print(f"📈 文件总行数: {total_lines:,}")
+    # 进度按字节计算，只需读一遍文件
+    file_size = os.path.getsize(input_path)
+    print(f"📈 文件大小: {file_size:,} 字节")
+    if start_offset:
+        print(f"⏩ 从检查点续跑: 字节偏移 {start_offset:,}（已处理 {start_rows:,} 条评论）")
     
     # 分批处理
     all_results = []
-    processed_lines = 0
+    processed_lines = start_rows
+    labeled = start_rows
+    parse_time = 0.0
     
-    with open(input_path, 'r', encoding='utf-8') as f:
+    def flush(batch, pos):
+        nonlocal labeled, parse_time, labeler, cache
+        if watch_config:
+            labeler, cache = _refresh_rules(labeler, cache, cache_path)
+        batch_results = labeler.label(batch, processed_lines - len(batch) + 1, behavior=behavior,
+                                      near_dupes=near_dupes, cache=cache, profiler=profiler)
+        labeled += len(batch_results)
+        t0 = time.perf_counter()
+        if sink is not None:
+            sink.write(batch_results)
+            if checkpoint is not None:
+                checkpoint.update(pos, processed_lines, sink)
+        else:
+            all_results.extend(batch_results)
+        if profiler is not None:
+            profiler.add_stage('output', time.perf_counter() - t0)
+            profiler.add_stage('parse', parse_time, len(batch))
+            parse_time = 0.0
+            profiler.maybe_print_progress()
+        
+        # 显示进度
+        progress = pos / max(file_size, 1) * 100
+        print(f"📊 进度: {pos:,}/{file_size:,} 字节 ({progress:.1f}%) - 已处理 {labeled:,} 条评论")
+    
+    # 按字节读取以便记录偏移，检查点总是落在某一行的行尾
+    with open(input_path, 'rb') as f, \
+         tqdm(total=file_size, initial=start_offset, unit='B', unit_scale=True, desc="处理进度") as pbar:
+        f.seek(start_offset)
+        pos = start_offset
         batch = []
         
-        for line_num, line in enumerate(tqdm(f, total=total_lines, desc="处理进度")):
-            line = line.strip()
+        for raw in f:
+            line_start = pos
+            pos += len(raw)
+            pbar.update(len(raw))
+            line = raw.decode('utf-8').strip()
             if not line:
                 continue
                 
+            t0 = time.perf_counter()
             try:
-                data = json.loads(line)
-                batch.append(data)
-                processed_lines += 1
-                
-                # 当批次满了或到达文件末尾时处理
-                if len(batch) >= batch_size or line_num == total_lines - 1:
-                    batch_results = process_batch(batch, processed_lines - len(batch) + 1)
-                    all_results.extend(batch_results)
-                    
-                    # 显示进度
-                    progress = (processed_lines / total_lines) * 100
-                    print(f"📊 进度: {processed_lines:,}/{total_lines:,} ({progress:.1f}%) - 已处理 {len(all_results):,} 条评论")
-                    
-                    # 清空批次
-                    batch = []
-                    
-            except json.JSONDecodeError as e:
-                print(f"⚠️ 第{line_num+1}行JSON解析失败: {e}")
-                continue
-            except Exception as e:
-                print(f"❌ 第{line_num+1}行处理失败: {e}")
+                data = decode_fields(line, LABEL_FIELDS)
+            except ValueError as e:
+                print(f"⚠️ 字节偏移{line_start}处JSON解析失败: {e}")
                 continue
+            parse_time += time.perf_counter() - t0
+            batch.append(data)
+            processed_lines += 1
+            
+            # 批次满了就处理；标注或写出失败时直接抛出，检查点停在上一批
+            if len(batch) >= batch_size:
+                flush(batch, pos)
+                # 清空批次
+                batch = []
+        
+        # 文件末尾不足一批的剩余部分
+        if batch:
+            flush(batch, pos)
     
+    if cache is not None:
+        print(f"♻️ 增量标注: 复用 {cache.hits:,} 条, 重新计算 {cache.misses:,} 条")
     return all_results
 
-def process_batch(batch, start_index):
-    """处理一批数据"""
-    try:
-        from lf_rules import (
-            lf_promo_has_link, lf_too_short, lf_template_low_entities,
-            lf_entity_sparse, lf_offtopic, lf_format_noise, lf_trust_signal,
-            lf_rating_sentiment_conflict, lf_suspicious_patterns,
-            lf_brand_mentioning, lf_time_sensitive_content, rough_entity_count
-        )
-        from lf_aggregate import aggregate_lfs
-        from config import TAU_HIGH, TAU_LOW
-    except ImportError as e:
-        print(f"❌ 导入标签函数失败: {e}")
-        return []
-    
+def split_shards(input_path, num_shards, start=0):
+    """按字节偏移把 JSONL 文件 [start, 文件末尾) 切成若干分片，分片边界对齐到行首，返回 [(start, end), ...]"""
+    file_size = os.path.getsize(input_path)
+    bounds = [start]
+    with open(input_path, 'rb') as f:
+        for k in range(1, num_shards):
+            target = start + (file_size - start) * k // num_shards
+            if target <= bounds[-1]:
+                continue
+            # 从 target-1 读到行尾：若 target 恰为行首则边界不变
+            f.seek(target - 1)
+            f.readline()
+            pos = f.tell()
+            if bounds[-1] < pos < file_size:
+                bounds.append(pos)
+    bounds.append(file_size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+def process_shard(task):
+    """
+    工作进程入口：处理 [start, end) 字节范围内的所有行，comment_id 在分片内从 1 开始编号。
+    返回 (结果列表, 本分片的 LabelProfiler 或 None)
+    """
+    input_path, start, end, batch_size, behavior_path, near_dupe_path, cache_path, profile, watch_config = task
+    labeler = get_labeler()
+    profiler = LabelProfiler() if profile else None
+    behavior = get_behavior_index(behavior_path) if behavior_path else None
+    near_dupes = get_near_dupe_index(near_dupe_path) if near_dupe_path else None
+    cache = get_label_cache(cache_path) if cache_path else None
     results = []
+    batch = []
+    processed_lines = 0
+    pos = start
+    parse_time = 0.0
     
-    for i, row in enumerate(batch):
-        try:
-            # 获取文本信息
-            text = row.get('text', row.get('original_text', ''))
-            if not text:
-                text = row.get('processed_text', '')
-            
-            # 计算文本特征
-            len_tok = len(text.split()) if text else 0
-            len_char = len(text) if text else 0
-            ent_count = rough_entity_count(text) if 'rough_entity_count' in globals() else 0
-            
-            # 运行所有标签函数
-            lf_outputs = {}
-            
-            # 1. 促销检测
-            has_url = False  # 简化处理
-            has_phone = False  # 简化处理
-            lf_outputs['promo'] = lf_promo_has_link(text, has_url, has_phone)
-            
-            # 2. 长度检测
-            lf_outputs['too_short'] = lf_too_short(len_tok, len_char)
-            
-            # 3. 模板检测
-            lf_outputs['template'] = lf_template_low_entities(text, ent_count)
-            
-            # 4. 实体稀疏检测
-            lf_outputs['entity_sparse'] = lf_entity_sparse(len_char, ent_count)
-            
-            # 5. 离题检测
-            lf_outputs['offtopic'] = lf_offtopic(row.get('category'), text)
-            
-            # 6. 格式噪音检测
-            lf_outputs['format_noise'] = lf_format_noise(text)
-            
-            # 7. 可信信号检测
-            has_promo_hit = lf_outputs['promo'][0] == 1
-            lf_outputs['trust_signal'] = lf_trust_signal(ent_count, has_promo_hit)
+    with open(input_path, 'rb') as f:
+        f.seek(start)
+        for raw in f:
+            line_start = pos
+            pos += len(raw)
+            line = raw.decode('utf-8').strip()
+            if line:
+                try:
+                    t0 = time.perf_counter()
+                    batch.append(decode_fields(line, LABEL_FIELDS))
+                    parse_time += time.perf_counter() - t0
+                    processed_lines += 1
+                except ValueError as e:
+                    print(f"⚠️ 字节偏移{line_start}处JSON解析失败: {e}")
             
-            # 8. 评分情感冲突检测
-            rating = row.get('rating', 3)
-            sent_pos = 0.5  # 简化处理
-            sent_neg = 0.3  # 简化处理
-            lf_outputs['sent_conflict'] = lf_rating_sentiment_conflict(rating, sent_pos, sent_neg)
-            
-            # 9. 可疑模式检测
-            lf_outputs['suspicious_patterns'] = lf_suspicious_patterns(text)
-            
-            # 10. 品牌提及检测
-            lf_outputs['brand_mentioning'] = lf_brand_mentioning(text)
-            
-            # 11. 时间敏感内容检测
-            lf_outputs['time_sensitive_content'] = lf_time_sensitive_content(text)
-            
-            # 聚合标签函数输出
-            p_untrust, score, hits = aggregate_lfs(lf_outputs)
-            
-            # 根据阈值确定最终标签
-            if p_untrust >= TAU_HIGH:
-                final_label = 1  # 不可信
-                label_str = "untrustworthy"
-            elif p_untrust <= TAU_LOW:
-                final_label = 0  # 可信
-                label_str = "trustworthy"
+            if len(batch) >= batch_size:
+                if watch_config:
+                    labeler, cache = _refresh_rules(labeler, cache, cache_path)
+                results.extend(labeler.label(batch, processed_lines - len(batch) + 1, behavior=behavior,
+                                             near_dupes=near_dupes, cache=cache, profiler=profiler))
+                batch = []
+            if pos >= end:
+                break
+    
+    if batch:
+        if watch_config:
+            labeler, cache = _refresh_rules(labeler, cache, cache_path)
+        results.extend(labeler.label(batch, processed_lines - len(batch) + 1, behavior=behavior,
+                                     near_dupes=near_dupes, cache=cache, profiler=profiler))
+    
+    if profiler is not None:
+        profiler.add_stage('parse', parse_time, processed_lines)
+    return results, profiler
+
+def load_and_process_data_parallel(input_path, batch_size=1000, workers=2, shards_per_worker=8,
+                                   shard_bytes=64 * 1024 * 1024, sink=None, behavior_path=None,
+                                   near_dupe_path=None, start_offset=0, start_rows=0, checkpoint=None,
+                                   cache_path=None, profiler=None, watch_config=False):
+    """
+    多进程分片处理：按字节偏移切分输入，进程池并行标注，按输入顺序合并并重新编号 comment_id。
+    续跑参数与 load_and_process_data 相同，检查点在每个分片写出后上报；
+    传入 profiler 时各工作进程分别剖析，分片完成后合并进来。
+    """
+    print(f"📁 开始处理文件: {input_path}")
+    print(f"📊 批处理大小: {batch_size}, 工作进程数: {workers}")
+    if start_offset:
+        print(f"⏩ 从检查点续跑: 字节偏移 {start_offset:,}（已处理 {start_rows:,} 条评论）")
+    
+    # 分片大小同时受 shard_bytes 限制，保证单个分片的结果在内存中有上界
+    num_shards = max(workers * shards_per_worker, (os.path.getsize(input_path) - start_offset) // shard_bytes + 1)
+    shards = split_shards(input_path, num_shards, start=start_offset)
+    if cache_path:
+        print(f"♻️ 增量标注缓存: {cache_path}（已有 {check_label_cache(cache_path):,} 条结果）")
+    tasks = [(input_path, start, end, batch_size, behavior_path, near_dupe_path, cache_path, profiler is not None,
+              watch_config) for start, end in shards]
+    print(f"🧩 分片数: {len(shards)}")
+    
+    all_results = []
+    labeled = start_rows
+    with Pool(processes=workers) as pool, \
+         tqdm(total=os.path.getsize(input_path), initial=start_offset, unit='B', unit_scale=True,
+              desc="处理进度") as pbar:
+        # imap 保证结果按分片顺序返回，分片内的本地编号加上之前的累计条数即为全局 comment_id
+        for (start, end), (shard_results, shard_profile) in zip(shards, pool.imap(process_shard, tasks)):
+            for result in shard_results:
+                result['comment_id'] += labeled
+            labeled += len(shard_results)
+            t0 = time.perf_counter()
+            if sink is not None:
+                sink.write(shard_results)
+                if checkpoint is not None:
+                    checkpoint.update(end, labeled, sink)
             else:
-                final_label = -1  # 忽略
-                label_str = "ignore"
-            
-            # 记录结果
-            result = {
-                'comment_id': start_index + i,
-                'user_id': row.get('user_id', ''),
-                'name': row.get('name', ''),
-                'rating': row.get('rating', ''),
-                'time': row.get('time', ''),
-                'category': row.get('category', ''),
-                'robot_review': row.get('robot_review', False),
-                'text': text[:200] + "..." if len(text) > 200 else text,
-                'processed_text': row.get('processed_text', ''),
-                'entity_count': ent_count,
-                'len_char': len_char,
-                'len_tok': len_tok,
-                'p_untrust': p_untrust,
-                'score': score,
-                'final_label': final_label,
-                'label_str': label_str,
-                'lf_outputs': lf_outputs
-            }
-            
-            results.append(result)
+                all_results.extend(shard_results)
+            if profiler is not None:
+                profiler.merge(shard_profile)
+                profiler.add_stage('output', time.perf_counter() - t0)
+                profiler.maybe_print_progress()
+            pbar.update(end - start)
+    
+    print(f"📊 已处理 {labeled:,} 条评论")
+    return all_results
+
+# 最终标签：1 不可信, 0 可信, -1 忽略
+LABEL_STR = {1: "untrustworthy", 0: "trustworthy", -1: "ignore"}
+
+def _refresh_rules(labeler, cache, cache_path):
+    """--watch-config：config.py 变化时换用新规则及其指纹对应的增量缓存，返回 (labeler, cache)"""
+    rules = reload_rules_if_changed()
+    if rules is labeler.rules:
+        return labeler, cache
+    print("♻️ config.py 已变化，后续批次使用新规则")
+    return get_labeler(rules), (get_label_cache(cache_path, rules) if cache_path else None)
+
+def _row_context(beh, dupes, i):
+    """第 i 行除自身字段外影响标注结果的全部输入，作为增量缓存键的一部分"""
+    beh_ctx = None
+    if beh is not None:
+        beh_ctx = (int(beh['user_daily_cnt'][i]), float(beh['user_extreme_ratio'][i]), int(beh['biz_window_cnt'][i]))
+    dupe_ctx = bool(dupes['is_near_dupe'][i]) if dupes is not None else None
+    return beh_ctx, dupe_ctx
+
+# Labeler.label 写入 lf_outputs 的标签函数名（按写入顺序）；行为类与近重复类只在提供对应索引时运行
+BASE_LF_NAMES = ('promo', 'too_short', 'template', 'entity_sparse', 'offtopic', 'format_noise', 'trust_signal',
+                 'sent_conflict', 'suspicious_patterns', 'brand_mentioning', 'time_sensitive_content')
+BEHAVIOR_LF_NAMES = ('user_burst', 'user_extreme_hist', 'biz_burst')
+NEAR_DUPE_LF_NAMES = ('near_dupe',)
+
+def lf_names_for(behavior=False, near_dupes=False):
+    """给定是否提供行为索引/近重复索引时，每条评论会产生投票的标签函数列表"""
+    names = list(BASE_LF_NAMES)
+    if behavior:
+        names.extend(BEHAVIOR_LF_NAMES)
+    if near_dupes:
+        names.extend(NEAR_DUPE_LF_NAMES)
+    return names
+
+class Labeler:
+    """
+    绑定一份 RuleSet：标签函数在模块加载时导入一次，阈值/窗口等配置和标签模型在构造时取出，
+    之后每批只做计算。rules 为 None 时使用当前生效的 RuleSet。
+    """
+
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else get_rules()
+        # MAX_DAILY_REVIEWS 是允许的上限，超过才触发
+        self.user_burst_threshold = self.rules.max_daily_reviews + 1
+        self.max_extreme_ratio = self.rules.max_extreme_rating_ratio
+        self.biz_window_hours = self.rules.biz_burst_window_hours
+        self.biz_min_reviews = self.rules.biz_burst_min_reviews
+        self.min_user_history = self.rules.min_user_history
+        self.label_model = None
+        if self.rules.label_model_path:
+            from label_model import get_label_model
+            self.label_model = get_label_model(self.rules.label_model_path)
+
+    def label(self, batch, start_index, behavior=None, near_dupes=None, cache=None, profiler=None):
+        """
+        处理一批数据（整批共用同一份规则）。
+        behavior 为 BehaviorIndex 时额外运行用户/商家行为类标签函数，
+        near_dupes 为 NearDupeIndex 时额外运行近重复检测。
+        cache 为 LabelCache 时，内容与上下文特征都未变化的评论直接复用缓存结果，其余照常计算后写回缓存。
+        profiler 为 LabelProfiler 时记录本批各标签函数与各阶段的耗时（只作用于这一次调用）。
+        """
+        rules = self.rules
+        results = []
+        scored = []  # 成功运行标签函数的结果，统一做向量化聚合
+        
+        # 开启剖析时每个标签函数经 profiler.call 计时，否则直接调用
+        prof = profiler
+        call = prof.call if prof is not None else _call
+        clock = time.perf_counter
+        
+        # 整批一次性回连预计算的行为特征
+        t0 = clock()
+        beh = None
+        if behavior is not None:
+            beh = behavior.lookup(batch, self.biz_window_hours, self.min_user_history)
+        dupes = near_dupes.lookup(batch) if near_dupes is not None else None
+        if prof is not None:
+            prof.add_stage('lookup', clock() - t0)
+        
+        # 增量模式：整批一次查询缓存
+        digests = None
+        cached = {}
+        scored_digests = []
+        if cache is not None:
+            t0 = clock()
+            digests = [row_digest(row, _row_context(beh, dupes, i)) for i, row in enumerate(batch)]
+            cached = cache.get_many(digests)
+            if prof is not None:
+                prof.add_stage('cache', clock() - t0)
+        
+        features_time = 0.0
+        
+        for i, row in enumerate(batch):
+            hit = cached.get(digests[i]) if cached else None
+            if hit is not None:
+                results.append({'comment_id': start_index + i, **hit})
+                continue
             
-        except Exception as e:
-            print(f"❌ 处理第{start_index + i}条评论失败: {e}")
-            # 添加错误记录
-            text_content = row.get('text', row.get('original_text', ''))
-            if isinstance(text_content, str) and len(text_content) > 200:
-                text_display = text_content[:200] + "..."
-            else:
-                text_display = str(text_content)
+            try:
+                # 获取文本信息
+                text = row.get('text', row.get('original_text', ''))
+                if not text:
+                    text = row.get('processed_text', '')
                 
-            result = {
-                'comment_id': start_index + i,
-                'user_id': row.get('user_id', ''),
-                'name': row.get('name', ''),
-                'rating': row.get('rating', ''),
-                'time': row.get('time', ''),
-                'category': row.get('category', ''),
-                'robot_review': row.get('robot_review', False),
-                'text': text_display,
-                'processed_text': row.get('processed_text', ''),
-                'entity_count': 'ERROR',
-                'len_char': 'ERROR',
-                'len_tok': 'ERROR',
-                'p_untrust': 'ERROR',
-                'score': 'ERROR',
-                'final_label': 'ERROR',
-                'label_str': 'ERROR',
-                'lf_outputs': {}
-            }
-            results.append(result)
-    
-    return results
+                # 计算文本特征（每条评论只扫描一次，所有标签函数共享）
+                t0 = clock()
+                feats = TextFeatures(text)
+                len_tok = feats.len_tok
+                len_char = feats.len_char
+                ent_count = feats.entity_count
+                features_time += clock() - t0
+                
+                # 运行所有标签函数
+                lf_outputs = {}
+                
+                # 1. 促销检测（链接/电话来自脱敏阶段的检测结果）
+                has_url, has_phone = pii_flags(row, text)
+                lf_outputs['promo'] = call('promo', lf_promo_has_link, text, has_url, has_phone, feats)
+                
+                # 2. 长度检测
+                lf_outputs['too_short'] = call('too_short', lf_too_short, len_tok, len_char)
+                
+                # 3. 模板检测
+                lf_outputs['template'] = call('template', lf_template_low_entities, text, ent_count, feats)
+                
+                # 4. 实体稀疏检测
+                lf_outputs['entity_sparse'] = call('entity_sparse', lf_entity_sparse, len_char, ent_count)
+                
+                # 5. 离题检测
+                lf_outputs['offtopic'] = call('offtopic', lf_offtopic, row.get('category'), text, feats, rules)
+                
+                # 6. 格式噪音检测
+                lf_outputs['format_noise'] = call('format_noise', lf_format_noise, text, feats, rules)
+                
+                # 7. 可信信号检测
+                has_promo_hit = lf_outputs['promo'][0] == 1
+                lf_outputs['trust_signal'] = call('trust_signal', lf_trust_signal, ent_count, has_promo_hit, rules)
+                
+                # 8. 评分情感冲突检测
+                rating = row.get('rating', 3)
+                sent_pos = 0.5  # 简化处理
+                sent_neg = 0.3  # 简化处理
+                lf_outputs['sent_conflict'] = call('sent_conflict', lf_rating_sentiment_conflict,
+                                                     rating, sent_pos, sent_neg, rules)
+                
+                # 9. 可疑模式检测
+                lf_outputs['suspicious_patterns'] = call('suspicious_patterns', lf_suspicious_patterns,
+                                                           text, feats, rules)
+                
+                # 10. 品牌提及检测
+                lf_outputs['brand_mentioning'] = call('brand_mentioning', lf_brand_mentioning, text, feats, rules)
+                
+                # 11. 时间敏感内容检测
+                lf_outputs['time_sensitive_content'] = call('time_sensitive_content', lf_time_sensitive_content,
+                                                              text, feats)
+                
+                # 12-14. 用户/商家行为检测（需要预计算的行为索引）
+                if beh is not None:
+                    # MAX_DAILY_REVIEWS 是允许的上限，超过才触发
+                    lf_outputs['user_burst'] = call('user_burst', lf_user_burst,
+                                                      int(beh['user_daily_cnt'][i]), self.user_burst_threshold)
+                    lf_outputs['user_extreme_hist'] = call('user_extreme_hist', lf_user_extreme_hist,
+                                                         float(beh['user_extreme_ratio'][i]), self.max_extreme_ratio)
+                    lf_outputs['biz_burst'] = call('biz_burst', lf_biz_burst,
+                                                     int(beh['biz_window_cnt'][i]) >= self.biz_min_reviews)
+                
+                # 15. 近重复检测（需要预计算的 MinHash/LSH 簇索引）
+                if dupes is not None:
+                    lf_outputs['near_dupe'] = call('near_dupe', lf_user_near_dupe, bool(dupes['is_near_dupe'][i]))
+                
+                # 记录结果（p_untrust/score/final_label 在整批聚合后回填）
+                result = {
+                    'comment_id': start_index + i,
+                    'user_id': row.get('user_id', ''),
+                    'gmap_id': row.get('gmap_id', ''),
+                    'name': row.get('name', ''),
+                    'rating': row.get('rating', ''),
+                    'time': row.get('time', ''),
+                    'category': row.get('category', ''),
+                    'robot_review': row.get('robot_review', False),
+                    'text': text[:200] + "..." if len(text) > 200 else text,
+                    'processed_text': row.get('processed_text', ''),
+                    'entity_count': ent_count,
+                    'len_char': len_char,
+                    'len_tok': len_tok,
+                    'p_untrust': None,
+                    'score': None,
+                    'final_label': None,
+                    'label_str': None,
+                    'lf_outputs': lf_outputs
+                }
+                
+                results.append(result)
+                scored.append(result)
+                if digests is not None:
+                    scored_digests.append(digests[i])
+                
+            except Exception as e:
+                print(f"❌ 处理第{start_index + i}条评论失败: {e}")
+                # 添加错误记录
+                text_content = row.get('text', row.get('original_text', ''))
+                if isinstance(text_content, str) and len(text_content) > 200:
+                    text_display = text_content[:200] + "..."
+                else:
+                    text_display = str(text_content)
+                    
+                result = {
+                    'comment_id': start_index + i,
+                    'user_id': row.get('user_id', ''),
+                    'gmap_id': row.get('gmap_id', ''),
+                    'name': row.get('name', ''),
+                    'rating': row.get('rating', ''),
+                    'time': row.get('time', ''),
+                    'category': row.get('category', ''),
+                    'robot_review': row.get('robot_review', False),
+                    'text': text_display,
+                    'processed_text': row.get('processed_text', ''),
+                    'entity_count': 'ERROR',
+                    'len_char': 'ERROR',
+                    'len_tok': 'ERROR',
+                    'p_untrust': 'ERROR',
+                    'score': 'ERROR',
+                    'final_label': 'ERROR',
+                    'label_str': 'ERROR',
+                    'lf_outputs': {}
+                }
+                results.append(result)
+        
+        if prof is not None:
+            prof.add_stage('features', features_time, len(batch))
+            prof.end_batch(len(batch))
+        
+        # 聚合标签函数输出：整批一次向量化计算，并根据阈值确定最终标签
+        t0 = clock()
+        if scored:
+            lf_names = list(scored[0]['lf_outputs'])
+            L, C = lf_outputs_to_matrix([r['lf_outputs'] for r in scored], lf_names)
+            if self.label_model is not None:
+                # 使用学习得到的标签模型代替手工权重；score 取后验的 logit
+                p_untrust = self.label_model.predict_proba(L, lf_names)[:, 1]
+                p_clip = np.clip(p_untrust, 1e-12, 1 - 1e-12)
+                score = np.log(p_clip) - np.log1p(-p_clip)
+                final_label = final_labels(p_untrust, rules.tau_high, rules.tau_low)
+            else:
+                p_untrust, score, final_label = aggregate_lfs_batch(L, C, lf_names, rules.weights,
+                                                                    rules.tau_high, rules.tau_low)
+            for j, result in enumerate(scored):
+                result['p_untrust'] = float(p_untrust[j])
+                result['score'] = float(score[j])
+                result['final_label'] = int(final_label[j])
+                result['label_str'] = LABEL_STR[result['final_label']]
+        if prof is not None:
+            prof.add_stage('aggregate', clock() - t0)
+        
+        # 处理失败 (ERROR) 的行不缓存，下次运行重试
+        if cache is not None and scored:
+            t0 = clock()
+            cache.put_many(zip(scored_digests, scored))
+            if prof is not None:
+                prof.add_stage('cache', clock() - t0)
+        
+        return results
+
+def _call(name, func, *args):
+    """未开启剖析时的标签函数调用"""
+    return func(*args)
+
+_LABELER = None
+
+def get_labeler(rules=None):
+    """复用同一个 Labeler；rules 为 None 时跟随当前生效的 RuleSet（reload_rules 之后自动重建）"""
+    global _LABELER
+    if rules is None:
+        rules = get_rules()
+    if _LABELER is None or _LABELER.rules is not rules:
+        _LABELER = Labeler(rules)
+    return _LABELER
+
+def process_batch(batch, start_index, rules=None, behavior=None, near_dupes=None, cache=None):
+    """处理一批数据；参数含义见 Labeler.label，rules 为 None 时使用当前生效的 RuleSet"""
+    return get_labeler(rules).label(batch, start_index, behavior=behavior, near_dupes=near_dupes, cache=cache)
 
 def save_results(results, output_path):
     """保存结果到文件"""
@@ -208,112 +525,50 @@ def save_results(results, output_path):
     # 转换为DataFrame
     df = pd.DataFrame(results)
     
-    # 保存为CSV格式（便于查看）
-    csv_path = output_path.replace('.parquet', '.csv')
-    df.to_csv(csv_path, index=False, encoding='utf-8')
-    print(f"✅ 已保存 {len(df)} 条评论到 {csv_path}")
+    # .parquet 写列式 Parquet，其余保存为CSV格式（便于查看）
+    with open_result_sink(output_path) as sink:
+        sink.write(results)
+    print(f"✅ 已保存 {len(df)} 条评论到 {sink.path}")
     
     return df
 
 def generate_summary_report(df):
     """生成摘要报告"""
-    print(f"\n📊 标签结果摘要报告")
-    print("=" * 60)
-    
-    # 基本统计
-    total = len(df)
-    untrustworthy = len(df[df['final_label'] == 1])
-    trustworthy = len(df[df['final_label'] == 0])
-    ignore = len(df[df['final_label'] == -1])
-    errors = len(df[df['final_label'] == 'ERROR'])
-    
-    print(f"📈 总体统计:")
-    print(f"   总评论数: {total:,}")
-    print(f"   可信评论: {trustworthy:,} ({trustworthy/total*100:.1f}%)")
-    print(f"   不可信评论: {untrustworthy:,} ({untrustworthy/total*100:.1f}%)")
-    print(f"   忽略评论: {ignore:,} ({ignore/total*100:.1f}%)")
-    print(f"   处理失败: {errors:,} ({errors/total*100:.1f}%)")
-    
-    # 按评分统计
-    print(f"\n⭐ 按评分统计:")
-    rating_stats = df[df['final_label'] != 'ERROR'].groupby('rating').agg({
-        'final_label': ['count', lambda x: (x == 1).sum(), lambda x: (x == 0).sum()]
-    }).round(2)
-    
-    for rating in sorted(rating_stats.index):
-        total_count = rating_stats.loc[rating, ('final_label', 'count')]
-        untrust_count = rating_stats.loc[rating, ('final_label', '<lambda_0>')]
-        trust_count = rating_stats.loc[rating, ('final_label', '<lambda_1>')]
-        
-        if total_count > 0:
-            untrust_rate = untrust_count / total_count * 100
-            trust_rate = trust_count / total_count * 100
-            print(f"   评分 {rating}: {untrust_count}/{total_count} 不可信 ({untrust_rate:.1f}%), {trust_count}/{total_count} 可信 ({trust_rate:.1f}%)")
-    
-    # 按业务类型统计
-    print(f"\n🏪 按业务类型统计:")
-    # 处理category字段（可能是列表）
-    df['category_str'] = df['category'].apply(lambda x: str(x[0]) if isinstance(x, list) and x else str(x))
-    
-    category_stats = df[df['final_label'] != 'ERROR'].groupby('category_str').agg({
-        'final_label': ['count', lambda x: (x == 1).sum(), lambda x: (x == 0).sum()]
-    }).round(2)
-    
-    # 显示前10个最常见的业务类型
-    top_categories = category_stats.sort_values(('final_label', 'count'), ascending=False).head(10)
-    
-    for category in top_categories.index:
-        total_count = top_categories.loc[category, ('final_label', 'count')]
-        untrust_count = top_categories.loc[category, ('final_label', '<lambda_0>')]
-        trust_count = top_categories.loc[category, ('final_label', '<lambda_1>')]
-        
-        if total_count > 0:
-            untrust_rate = untrust_count / total_count * 100
-            trust_rate = trust_count / total_count * 100
-            print(f"   {category}: {untrust_count}/{total_count} 不可信 ({untrust_rate:.1f}%), {trust_count}/{total_count} 可信 ({trust_rate:.1f}%)")
-    
-    # 机器人评论分析
-    print(f"\n🤖 机器人评论分析:")
-    robot_stats = df[df['robot_review'] == True]
-    if len(robot_stats) > 0:
-        robot_total = len(robot_stats)
-        robot_untrust = len(robot_stats[robot_stats['final_label'] == 1])
-        robot_trust = len(robot_stats[robot_stats['final_label'] == 0])
-        
-        print(f"   机器人评论总数: {robot_total:,}")
-        print(f"   机器人不可信评论: {robot_untrust:,} ({robot_untrust/robot_total*100:.1f}%)")
-        print(f"   机器人可信评论: {robot_trust:,} ({robot_trust/robot_total*100:.1f}%)")
-    else:
-        print("   未发现机器人评论")
-    
-    print(f"\n🎯 标签质量评估:")
-    print(f"   可信评论比例: {trustworthy/total*100:.1f}% (目标: 30-50%)")
-    print(f"   不可信评论比例: {untrustworthy/total*100:.1f}% (目标: 20-40%)")
-    print(f"   忽略评论比例: {ignore/total*100:.1f}% (目标: 最小化)")
-    
-    if trustworthy/total*100 >= 30 and trustworthy/total*100 <= 50:
-        print("   ✅ 可信评论比例在目标范围内")
-    else:
-        print("   ⚠️ 可信评论比例超出目标范围")
-    
-    if untrustworthy/total*100 >= 20 and untrustworthy/total*100 <= 40:
-        print("   ✅ 不可信评论比例在目标范围内")
-    else:
-        print("   ⚠️ 不可信评论比例超出目标范围")
-    
-    if ignore/total*100 < 10:
-        print("   ✅ 忽略评论比例较低")
-    else:
-        print("   ⚠️ 忽略评论比例较高")
+    summary = SummaryAccumulator()
+    summary.update(df.to_dict('records'))
+    summary.report()
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="对整个数据集运行标签函数并聚合")
+    parser.add_argument("--input", dest="input_path", default=r"D:\MyPersonalFiles\NTU\TechJam2025\review-Alaska_10.filtered.redacted.strict.dedup.preprocessed.targeted.json")
+    parser.add_argument("--output", dest="output_path", default="full_dataset_labeled.csv")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1, help="工作进程数；>1 时按字节偏移分片并行处理")
+    parser.add_argument("--behavior-index", dest="behavior_index", default=None,
+                        help="用户/商家行为特征索引 (.npz)；文件不存在时先扫描输入构建")
+    parser.add_argument("--near-dupe-index", dest="near_dupe_index", default=None,
+                        help="MinHash/LSH 近重复簇索引 (.npz)；文件不存在时先扫描输入构建")
+    parser.add_argument("--label-cache", dest="label_cache", default=None,
+                        help="增量标注缓存 (SQLite)；只对新增或变化的评论运行标签函数")
+    parser.add_argument("--resume", action="store_true",
+                        help="从 <output>.ckpt 检查点续跑，跳过已处理的输入范围")
+    parser.add_argument("--checkpoint-interval", dest="checkpoint_interval", type=float, default=60.0,
+                        help="检查点保存间隔（秒）；0 表示不保存检查点")
+    parser.add_argument("--profile", dest="profile_path", default=None,
+                        help="开启性能剖析，把各标签函数与各阶段的耗时报告写入该 JSON 文件")
+    parser.add_argument("--profile-interval", dest="profile_interval", type=float, default=30.0,
+                        help="剖析时每隔多少秒打印一行耗时分布")
+    parser.add_argument("--watch-config", dest="watch_config", action="store_true",
+                        help="每批开始前检查 config.py，修改后的阈值/权重从下一批起生效（无需重启）")
+    args = parser.parse_args()
+    
     print("🚀 开始对整个数据集进行标签")
     print("=" * 80)
     
     # 文件路径
-    input_path = r"D:\MyPersonalFiles\NTU\TechJam2025\review-Alaska_10.filtered.redacted.strict.dedup.preprocessed.targeted.json"
-    output_path = "full_dataset_labeled.csv"
+    input_path = args.input_path
+    output_path = args.output_path
     
     # 检查输入文件
     if not os.path.exists(input_path):
@@ -324,23 +579,73 @@ def main():
     start_time = time.time()
     
     try:
-        # 1. 加载和处理数据
-        results = load_and_process_data(input_path, batch_size=1000)
+        # 0. 行为特征预计算（可选）
+        if args.behavior_index and not os.path.exists(args.behavior_index):
+            print(f"👥 构建行为特征索引: {args.behavior_index}")
+            BehaviorIndex.build(input_path).save(args.behavior_index)
+        if args.near_dupe_index and not os.path.exists(args.near_dupe_index):
+            print(f"🔁 构建近重复簇索引: {args.near_dupe_index}")
+            NearDupeIndex.build(input_path).save(args.near_dupe_index)
+        
+        # 检查点：规则或索引变化后旧进度作废；批大小和进程数不影响结果，可以在续跑时更改
+        checkpoint = None
+        state = None
+        if args.checkpoint_interval > 0:
+            options = {'output_path': os.path.abspath(output_path), 'behavior_index': args.behavior_index,
+                       'near_dupe_index': args.near_dupe_index, 'rules': get_rules().fingerprint}
+            checkpoint = LabelCheckpoint(output_path + '.ckpt', input_path, options, args.checkpoint_interval)
+            if args.resume:
+                state = checkpoint.load()
+                if state is None:
+                    print("⚠️ 未找到可用的检查点，从头开始")
+                elif not resume_state_valid(output_path, state['sink']):
+                    print(f"⚠️ 检查点之后输出文件已被删除或替换: {output_path}，从头开始")
+                    state = None
+        elif args.resume:
+            print("⚠️ --checkpoint-interval 为 0 时无法续跑，从头开始")
         
-        # 2. 保存结果
-        df = save_results(results, output_path)
+        # 1. 加载和处理数据，每批结果直接流式写出（2. 保存结果）并增量统计
+        summary = state['summary'] if state else SummaryAccumulator()
+        start_offset = state['offset'] if state else 0
+        start_rows = state['rows'] if state else 0
+        profiler = LabelProfiler(args.profile_interval) if args.profile_path else None
+        print(f"\n💾 保存结果到: {output_path}")
+        lf_names = lf_names_for(bool(args.behavior_index), bool(args.near_dupe_index))
+        with open_result_sink(output_path, summary, lf_names=lf_names, checkpointing=checkpoint is not None,
+                              resume_state=state['sink'] if state else None) as sink:
+            if args.workers > 1:
+                load_and_process_data_parallel(input_path, batch_size=args.batch_size, workers=args.workers, sink=sink,
+                                               behavior_path=args.behavior_index,
+                                               near_dupe_path=args.near_dupe_index,
+                                               start_offset=start_offset, start_rows=start_rows,
+                                               checkpoint=checkpoint, cache_path=args.label_cache,
+                                               profiler=profiler, watch_config=args.watch_config)
+            else:
+                load_and_process_data(input_path, batch_size=args.batch_size, sink=sink,
+                                      behavior_path=args.behavior_index,
+                                      near_dupe_path=args.near_dupe_index,
+                                      start_offset=start_offset, start_rows=start_rows,
+                                      checkpoint=checkpoint, cache_path=args.label_cache,
+                                      profiler=profiler, watch_config=args.watch_config)
+        if checkpoint is not None:
+            checkpoint.remove()
+        print(f"✅ 已保存 {sink.rows_written} 条评论到 {sink.path}")
+        if profiler is not None:
+            profiler.save(args.profile_path)
+            print(profiler.progress_line())
+            print(f"📝 性能剖析报告: {args.profile_path}")
         
         # 3. 生成摘要报告
-        generate_summary_report(df)
+        summary.report()
         
         # 4. 计算总耗时
         total_time = time.time() - start_time
         print(f"\n⏱️ 总耗时: {total_time:.2f} 秒")
-        print(f"🚀 处理速度: {len(results)/total_time:.0f} 条/秒")
+        print(f"🚀 处理速度: {summary.total/total_time:.0f} 条/秒")
         
         print(f"\n🎉 标签完成!")
         print(f"📁 结果文件: {output_path}")
-        print(f"📊 总处理评论数: {len(results):,}")
+        print(f"📊 总处理评论数: {summary.total:,}")
         
     except Exception as e:
         print(f"❌ 处理过程中发生错误: {e}")
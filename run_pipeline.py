@@ -0,0 +1,196 @@
+# run_pipeline.py - 端到端流式流水线：脱敏 → 去重 → 标注，每行只解析一次 JSON，中间结果不必落盘
+import argparse
+import os
+import time
+from multiprocessing import Pool
+from tqdm import tqdm
+
+import json_codec
+from redact_pii import redact_text_counts
+from remove_duplicates import DigestSet, combination_digest, split_digests, first_occurrences
+from run_full_labeling import process_batch, lf_names_for
+from label_sink import SummaryAccumulator, open_result_sink
+from behavior_features import get_behavior_index
+from near_dupe import get_near_dupe_index
+from label_cache import check_label_cache, get_label_cache
+
+
+def read_batches(input_path, batch_size, pbar=None):
+    """
+    按行读取 JSONL，产出 [(原始行, 解析结果), ...] 批次。解析失败的行结果为 None：
+    它们照常写入脱敏检查点（与 redact_pii.py 一致），之后的去重/标注阶段直接丢弃。
+    """
+    batch = []
+    with open(input_path, 'rb') as f:
+        for raw in f:
+            if pbar is not None:
+                pbar.update(len(raw))
+            line = raw.decode('utf-8').rstrip('\n\r')
+            try:
+                row = json_codec.loads(line)
+            except ValueError:
+                row = None
+            batch.append((line, row))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def redact_batch(batch):
+    """
+    脱敏阶段：与 redact_pii.py --emit-flags 相同，命中的行替换 text 并附加 pii 计数。
+    被修改的行原始行置为 None，写检查点时重新序列化。返回 (批次, 修改行数)
+    """
+    out = []
+    modified = 0
+    for line, row in batch:
+        if isinstance(row, dict) and row.get('text') is not None:
+            new_text, counts = redact_text_counts(row['text'])
+            if any(counts.values()):
+                row['text'] = new_text
+                row['pii'] = counts
+                line = None
+                modified += 1
+        out.append((line, row))
+    return out, modified
+
+
+def dedup_rows(rows, seen):
+    """去重阶段：按 (user_id, gmap_id, text) 的 128 位摘要保留首次出现的行"""
+    if not rows:
+        return rows
+    hi, lo = split_digests([combination_digest(row) for row in rows])
+    keep = first_occurrences(hi, lo)
+    keep[keep] = ~seen.contains(hi[keep], lo[keep])
+    seen.add(hi[keep], lo[keep])
+    return [row for row, k in zip(rows, keep) if k]
+
+
+def label_task(task):
+    """标注阶段（可在工作进程中运行）：行为/近重复索引和增量标注缓存按路径在进程内缓存"""
+    rows, start_index, behavior_path, near_dupe_path, cache_path = task
+    behavior = get_behavior_index(behavior_path) if behavior_path else None
+    near_dupes = get_near_dupe_index(near_dupe_path) if near_dupe_path else None
+    cache = get_label_cache(cache_path) if cache_path else None
+    return process_batch(rows, start_index, behavior=behavior, near_dupes=near_dupes, cache=cache)
+
+
+def run_pipeline(input_path, sink, batch_size=1000, workers=1, redacted_path=None, dedup_path=None,
+                 memory_budget=None, spill_dir=None, behavior_path=None, near_dupe_path=None, cache_path=None):
+    """
+    以 workers*2 个批次为一个窗口推进：脱敏、标注在进程池（或当前进程）中按批并行，
+    去重依赖全局已见集合，在主进程中按输入顺序执行。窗口同步推进，内存只与窗口大小有关。
+    """
+    stats = {'lines': 0, 'invalid': 0, 'redacted': 0, 'duplicates': 0, 'labeled': 0}
+    seen = DigestSet(memory_budget, spill_dir)
+    window = max(1, workers * 2)
+    if cache_path:
+        # 启动进程池之前校验缓存指纹（必要时清空）
+        print(f"♻️ 增量标注缓存: {cache_path}（已有 {check_label_cache(cache_path):,} 条结果）")
+    pool = Pool(processes=workers) if workers > 1 else None
+    mapper = pool.map if pool is not None else (lambda func, items: [func(item) for item in items])
+    redacted_out = open(redacted_path, 'w', encoding='utf-8', newline='\n') if redacted_path else None
+    dedup_out = open(dedup_path, 'w', encoding='utf-8', newline='\n') if dedup_path else None
+
+    def run_window(batches):
+        redacted = mapper(redact_batch, batches)
+        tasks = []
+        for batch, modified in redacted:
+            stats['lines'] += len(batch)
+            stats['redacted'] += modified
+            if redacted_out is not None:
+                for line, row in batch:
+                    if line is None:
+                        line = json_codec.dumps(row, compact=True)
+                    redacted_out.write(line + '\n')
+            rows = [row for _, row in batch if isinstance(row, dict)]
+            stats['invalid'] += len(batch) - len(rows)
+            unique = dedup_rows(rows, seen)
+            stats['duplicates'] += len(rows) - len(unique)
+            if dedup_out is not None:
+                for row in unique:
+                    dedup_out.write(json_codec.dumps(row) + '\n')
+            if unique:
+                tasks.append((unique, stats['labeled'] + 1, behavior_path, near_dupe_path, cache_path))
+                stats['labeled'] += len(unique)
+        for results in mapper(label_task, tasks):
+            sink.write(results)
+
+    try:
+        with tqdm(total=os.path.getsize(input_path), unit='B', unit_scale=True, desc="流水线进度") as pbar:
+            batches = []
+            for batch in read_batches(input_path, batch_size, pbar):
+                batches.append(batch)
+                if len(batches) >= window:
+                    run_window(batches)
+                    batches = []
+            if batches:
+                run_window(batches)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for f in (redacted_out, dedup_out):
+            if f is not None:
+                f.close()
+        seen.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="脱敏 → 去重 → 标注 一次完成的流式流水线")
+    parser.add_argument("--input", dest="input_path", required=True, help="原始 JSONL 评论文件")
+    parser.add_argument("--output", dest="output_path", default="full_dataset_labeled.csv",
+                        help="标注结果（.csv 或 .parquet）")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1, help="工作进程数；>1 时脱敏和标注在进程池中并行")
+    parser.add_argument("--redacted", dest="redacted_path", default=None, help="可选：脱敏后的检查点输出")
+    parser.add_argument("--dedup", dest="dedup_path", default=None, help="可选：去重后的检查点输出")
+    parser.add_argument("--memory-mb", dest="memory_mb", type=float, default=None,
+                        help="去重已见集合超过该大小的部分写入磁盘")
+    parser.add_argument("--spill-dir", dest="spill_dir", default=None)
+    parser.add_argument("--behavior-index", dest="behavior_index", default=None,
+                        help="预先构建的用户/商家行为特征索引 (.npz)")
+    parser.add_argument("--near-dupe-index", dest="near_dupe_index", default=None,
+                        help="预先在脱敏、去重后的数据上构建的近重复簇索引 (.npz)")
+    parser.add_argument("--label-cache", dest="label_cache", default=None,
+                        help="增量标注缓存 (SQLite)；只对新增或变化的评论运行标签函数")
+    args = parser.parse_args()
+
+    print("🚀 开始端到端流水线: 脱敏 → 去重 → 标注")
+    print("=" * 80)
+    if not os.path.exists(args.input_path):
+        print(f"❌ 输入文件不存在: {args.input_path}")
+        return
+    for path in (args.behavior_index, args.near_dupe_index):
+        if path and not os.path.exists(path):
+            print(f"❌ 索引文件不存在: {path}（流水线只读一遍输入，索引需提前构建）")
+            return
+
+    start_time = time.time()
+    memory_budget = int(args.memory_mb * 1024 * 1024) if args.memory_mb is not None else None
+    summary = SummaryAccumulator()
+    lf_names = lf_names_for(bool(args.behavior_index), bool(args.near_dupe_index))
+    with open_result_sink(args.output_path, summary, lf_names=lf_names) as sink:
+        stats = run_pipeline(args.input_path, sink, batch_size=args.batch_size, workers=args.workers,
+                             redacted_path=args.redacted_path, dedup_path=args.dedup_path,
+                             memory_budget=memory_budget, spill_dir=args.spill_dir,
+                             behavior_path=args.behavior_index, near_dupe_path=args.near_dupe_index,
+                             cache_path=args.label_cache)
+
+    print(f"📈 读取行数: {stats['lines']:,}  (无法解析: {stats['invalid']:,})")
+    print(f"🔒 脱敏修改: {stats['redacted']:,}")
+    print(f"🧹 去除重复: {stats['duplicates']:,}")
+    print(f"✅ 已保存 {sink.rows_written} 条评论到 {sink.path}")
+    summary.report()
+
+    total_time = time.time() - start_time
+    print(f"\n⏱️ 总耗时: {total_time:.2f} 秒")
+    print(f"🚀 处理速度: {stats['lines']/max(total_time, 1e-9):.0f} 行/秒")
+    print(f"\n🎉 流水线完成!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# token_dataset.py - 预分词数据集：整份语料只分词一次并缓存为 memmap，按长度分桶组批、每批动态补齐
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+from tqdm import tqdm
+
+TOKENIZE_CHUNK = 4096  # 快速分词器每次处理的文本数
+
+
+def corpus_key(texts, tokenizer_name, max_len):
+    """整份语料 + 分词器 + 截断长度的摘要，作为缓存目录名"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{tokenizer_name}\0{max_len}\0{len(texts)}\0".encode('utf-8'))
+    for text in texts:
+        h.update(text.encode('utf-8', 'surrogatepass'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class TokenCache:
+    """
+    变长 token 序列的磁盘缓存：ids.bin 是所有序列首尾相接的一维数组，offsets.npy 记录每条的起止位置。
+    词表不超过 65535 时用 uint16 存储。两者都以只读 memmap 打开，取样本时不复制整份数据。
+    """
+
+    def __init__(self, cache_dir, texts, tokenizer, max_len):
+        texts = [str(text) for text in texts]
+        tokenizer_name = getattr(tokenizer, 'name_or_path', type(tokenizer).__name__)
+        self.dir = os.path.join(cache_dir, corpus_key(texts, tokenizer_name, max_len))
+        self.ids_path = os.path.join(self.dir, 'ids.bin')
+        self.offsets_path = os.path.join(self.dir, 'offsets.npy')
+        self.meta_path = os.path.join(self.dir, 'meta.json')
+        if not os.path.exists(self.meta_path):
+            self._build(texts, tokenizer, max_len)
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.offsets = np.load(self.offsets_path, mmap_mode='r')
+        total = int(self.offsets[-1])
+        self.ids = np.memmap(self.ids_path, dtype=meta['dtype'], mode='r', shape=(total,)) if total else \
+            np.empty(0, dtype=meta['dtype'])
+        self.lengths = np.diff(np.asarray(self.offsets))
+
+    def _build(self, texts, tokenizer, max_len):
+        os.makedirs(self.dir, exist_ok=True)
+        dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max else np.int32
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        with open(self.ids_path, 'wb') as f:
+            for k in tqdm(range(0, len(texts), TOKENIZE_CHUNK), desc="Tokenizing"):
+                encoded = tokenizer(texts[k:k + TOKENIZE_CHUNK], truncation=True, max_length=max_len,
+                                    padding=False)['input_ids']
+                lengths = np.fromiter((len(ids) for ids in encoded), dtype=np.int64, count=len(encoded))
+                offsets[k + 1:k + 1 + len(encoded)] = offsets[k] + np.cumsum(lengths)
+                flat = np.fromiter((t for ids in encoded for t in ids), dtype=dtype, count=int(lengths.sum()))
+                f.write(flat.tobytes())
+        np.save(self.offsets_path, offsets)
+        # meta.json 最后写入，作为缓存完整的标志
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'dtype': np.dtype(dtype).name, 'count': len(texts), 'max_len': max_len}, f)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, idx):
+        return self.ids[self.offsets[idx]:self.offsets[idx + 1]]
+
+
+class TokenizedDataset(Dataset):
+    """按下标返回 (token ids, 标签)，补齐交给 collate"""
+
+    def __init__(self, cache, labels):
+        self.cache = cache
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.lengths = cache.lengths
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getitem__(self, idx):
+        return self.cache[idx], self.labels[idx]
+
+
+class LengthBucketSampler(Sampler):
+    """
+    长度分桶的批采样器：打乱后每 batch_size*bucket_batches 条为一组，组内按长度排序再切成批，
+    最后打乱批的顺序。同一批内长度接近，动态补齐时几乎没有浪费；shuffle=False 时整体按长度排序。
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_batches=50, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_batches = bucket_batches
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if not self.shuffle:
+            order = np.argsort(self.lengths, kind='stable')
+            batches = [order[k:k + self.batch_size] for k in range(0, len(order), self.batch_size)]
+        else:
+            rng = np.random.default_rng(self.seed + self.epoch)
+            self.epoch += 1
+            order = rng.permutation(len(self.lengths))
+            bucket = self.batch_size * self.bucket_batches
+            batches = []
+            for k in range(0, len(order), bucket):
+                chunk = order[k:k + bucket]
+                chunk = chunk[np.argsort(self.lengths[chunk], kind='stable')]
+                batches.extend(chunk[j:j + self.batch_size] for j in range(0, len(chunk), self.batch_size))
+            rng.shuffle(batches)
+        for batch in batches:
+            yield batch.tolist()
+
+
+class DynamicPadCollate:
+    """把一批变长序列补齐到该批的最大长度，返回与原 DataLoader 相同的字段"""
+
+    def __init__(self, pad_id):
+        self.pad_id = pad_id
+
+    def __call__(self, items):
+        width = max(len(ids) for ids, _ in items)
+        input_ids = np.full((len(items), width), self.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(items), width), dtype=np.int64)
+        for i, (ids, _) in enumerate(items):
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+        return {
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask),
+            "labels": torch.tensor([label for _, label in items], dtype=torch.long),
+        }